@@ -1,22 +1,28 @@
 import os
-import hashlib
-import secrets
-import string
 from datetime import datetime
-from flask import Blueprint, request, jsonify, send_file
+from itertools import chain
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import sqlite3
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
-import tempfile
+from db import get_connection, init_blueprint
+from auth import current_user
+from writer import WriteQueueFull, WriteTimeout, write
+from credentials import (
+    INLINE_BATCH_LIMIT, credentials_job, issue_credentials, running_credentials_job, start_credentials_job,
+    users_without_credentials
+)
+from pagination import InvalidPageRequest, paginate
+from migrations import run_migrations
+from analytics_counters import init_analytics_counters, read_analytics_counters
+from search_index import init_search_index
+from excel_export import workbook_response
 
 admin_bp = Blueprint('admin_enhancements', __name__, url_prefix='/admin')
+init_blueprint(admin_bp)
 
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect('timetable.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get a pooled database connection; close() returns it to the pool"""
+    return get_connection(sqlite3.Row)
 
 def init_enhancement_tables():
     """Initialize new tables for enhancements"""
@@ -83,43 +89,16 @@ def init_enhancement_tables():
         )
     ''')
     
+    run_migrations(cursor)
+    init_analytics_counters(cursor)
+    init_search_index(cursor)
+    
     conn.commit()
     conn.close()
 
 # Initialize tables when module is imported
 init_enhancement_tables()
 
-def generate_secure_credentials(user_id, name, email):
-    """Generate secure username and password for a user"""
-    # Generate username from email
-    username = email.split('@')[0].lower()
-    
-    # Generate random 10-character password
-    password_chars = string.ascii_letters + string.digits + "!@#$%^&*"
-    plain_password = ''.join(secrets.choice(password_chars) for _ in range(10))
-    
-    # Hash password using SHA256
-    password_hash = hashlib.sha256(plain_password.encode()).hexdigest()
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Update user table with hashed password
-    cursor.execute('''
-        UPDATE users SET password_hash = ? WHERE id = ?
-    ''', (password_hash, user_id))
-    
-    # Store plain credentials in export table
-    cursor.execute('''
-        INSERT INTO credentials_export (user_id, username, plain_password)
-        VALUES (?, ?, ?)
-    ''', (user_id, username, plain_password))
-    
-    conn.commit()
-    conn.close()
-    
-    return username, plain_password
-
 @admin_bp.route('/credentials/generate', methods=['POST'])
 @jwt_required()
 def generate_credentials():
@@ -130,31 +109,35 @@ def generate_credentials():
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get users without credentials (staff and dept_admin)
-        cursor.execute('''
-            SELECT u.id, u.name, u.email, u.role 
-            FROM users u 
-            LEFT JOIN credentials_export ce ON u.id = ce.user_id 
-            WHERE u.role IN ('staff', 'dept_admin') 
-            AND ce.user_id IS NULL 
-            AND u.password_hash IS NULL
-        ''')
+        # A running job is already issuing credentials to the same users
+        job = running_credentials_job()
+        if job:
+            conn.close()
+            return jsonify({
+                'success': True,
+                'message': 'Credentials generation is already running',
+                'job': job
+            }), 202
         
-        users_without_credentials = cursor.fetchall()
+        # Get users without credentials (staff and dept_admin)
+        users = users_without_credentials(cursor)
         conn.close()
         
-        generated_count = 0
-        for user in users_without_credentials:
-            username, password = generate_secure_credentials(
-                user['id'], user['name'], user['email']
-            )
-            generated_count += 1
+        # Large onboarding batches hash for minutes; run them in the background and report progress
+        if len(users) > INLINE_BATCH_LIMIT:
+            job_id = start_credentials_job(users)
+            return jsonify({
+                'success': True,
+                'message': f'Generating credentials for {len(users)} users',
+                'job': credentials_job(job_id)
+            }), 202
+        
+        generated_count = issue_credentials(users)
         
         return jsonify({
             'success': True,
@@ -162,6 +145,29 @@ def generate_credentials():
             'count': generated_count
         })
         
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/credentials/generate/<job_id>')
+@jwt_required()
+def credentials_generation_progress(job_id):
+    """Progress of a background credentials generation"""
+    try:
+        user_role = current_user('role')
+        
+        if not user_role or user_role['role'] != 'main_admin':
+            return jsonify({'error': 'Access denied'}), 403
+        
+        job = credentials_job(job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify({'success': True, 'job': job})
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -175,8 +181,7 @@ def export_credentials():
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -192,62 +197,29 @@ def export_credentials():
             ORDER BY ce.generated_at DESC
         ''')
         
-        credentials_data = cursor.fetchall()
+        first = cursor.fetchone()
         
-        if not credentials_data:
+        if not first:
             return jsonify({'error': 'No new credentials to export'}), 404
         
-        # Create Excel file
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "User Credentials"
-        
-        # Headers
-        headers = ['Name', 'Email', 'Role', 'Department', 'Username', 'Password', 'Generated At']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center")
-        
-        # Data rows
-        for row, data in enumerate(credentials_data, 2):
-            ws.cell(row=row, column=1, value=data['name'])
-            ws.cell(row=row, column=2, value=data['email'])
-            ws.cell(row=row, column=3, value=data['role'].replace('_', ' ').title())
-            ws.cell(row=row, column=4, value=data['department_name'] or 'N/A')
-            ws.cell(row=row, column=5, value=data['username'])
-            ws.cell(row=row, column=6, value=data['plain_password'])
-            ws.cell(row=row, column=7, value=data['generated_at'])
-        
-        # Auto-adjust column widths
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Save to temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
+        # Rows are streamed from the cursor into the sheet
+        rows = (
+            (data['name'], data['email'], data['role'].replace('_', ' ').title(), data['department_name'] or 'N/A',
+             data['username'], data['plain_password'], data['generated_at'])
+            for data in chain([first], cursor)
+        )
+        response = workbook_response(
+            f'user_credentials_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx', "User Credentials",
+            ['Name', 'Email', 'Role', 'Department', 'Username', 'Password', 'Generated At'], rows,
+            header_style='accent'
+        )
         
         # Mark as exported
         cursor.execute('UPDATE credentials_export SET exported = TRUE WHERE exported = FALSE')
         conn.commit()
         conn.close()
         
-        return send_file(
-            temp_file.name,
-            as_attachment=True,
-            download_name=f'user_credentials_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -262,43 +234,25 @@ def analytics_summary():
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        # Get analytics data
-        analytics = {}
-        
-        # Total departments
-        cursor.execute('SELECT COUNT(*) as count FROM departments')
-        analytics['total_departments'] = cursor.fetchone()['count']
-        
-        # Total staff
-        cursor.execute('SELECT COUNT(*) as count FROM users WHERE role = "staff"')
-        analytics['total_staff'] = cursor.fetchone()['count']
-        
-        # Pending approvals (syllabus uploads)
-        cursor.execute('SELECT COUNT(*) as count FROM syllabus_uploads WHERE status = "pending"')
-        analytics['pending_approvals'] = cursor.fetchone()['count']
-        
-        # Timetable generations
-        cursor.execute('SELECT COUNT(*) as count FROM timetable_logs')
-        analytics['timetable_generations'] = cursor.fetchone()['count']
-        
-        # Additional metrics
-        cursor.execute('SELECT COUNT(*) as count FROM users WHERE role = "dept_admin"')
-        analytics['total_dept_admins'] = cursor.fetchone()['count']
-        
-        cursor.execute('SELECT COUNT(*) as count FROM credentials_export WHERE exported = FALSE')
-        analytics['pending_credentials'] = cursor.fetchone()['count']
-        
-        cursor.execute('SELECT COUNT(*) as count FROM notifications')
-        analytics['total_notifications'] = cursor.fetchone()['count']
-        
+        # Get analytics data from the trigger-maintained counters in one read
+        counters = read_analytics_counters(cursor)
         conn.close()
         
+        analytics = {
+            'total_departments': counters['departments'],
+            'total_staff': counters['staff'],
+            'pending_approvals': counters['pending_syllabus_uploads'],  # syllabus uploads
+            'timetable_generations': counters['timetable_logs'],
+            'total_dept_admins': counters['dept_admins'],
+            'pending_credentials': counters['pending_credentials'],
+            'total_notifications': counters['notifications']
+        }
+        
         return jsonify({
             'success': True,
             'analytics': analytics
@@ -317,8 +271,7 @@ def send_notification():
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -335,14 +288,13 @@ def send_notification():
             if recipient_type not in ['staff', 'dept_admin', 'all']:
                 return jsonify({'error': 'Invalid recipient type'}), 400
             
+            conn.close()
+            
             # Insert notification
-            cursor.execute('''
+            write(lambda cursor: cursor.execute('''
                 INSERT INTO notifications (title, message, recipient_type, created_by)
                 VALUES (?, ?, ?, ?)
-            ''', (title, message, recipient_type, current_user_id))
-            
-            conn.commit()
-            conn.close()
+            ''', (title, message, recipient_type, current_user_id)))
             
             return jsonify({
                 'success': True,
@@ -350,22 +302,27 @@ def send_notification():
             })
         
         # GET request - return notification form data
-        cursor.execute('''
+        recent_notifications, next_cursor = paginate(cursor, '''
             SELECT n.*, u.name as created_by_name
-            FROM notifications n
+            FROM {table} n
             JOIN users u ON n.created_by = u.id
-            ORDER BY n.created_at DESC
-            LIMIT 10
-        ''')
-        
-        recent_notifications = cursor.fetchall()
+            WHERE 1
+        ''', sort_column='n.created_at', id_column='n.id', filters={'recipient_type': 'n.recipient_type'},
+            archived_table='notifications')
         conn.close()
         
         return jsonify({
             'success': True,
-            'recent_notifications': [dict(row) for row in recent_notifications]
+            'recent_notifications': [dict(row) for row in recent_notifications],
+            'next_cursor': next_cursor
         })
         
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -379,31 +336,32 @@ def syllabus_review():
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
         
         # Get syllabus uploads
-        cursor.execute('''
+        uploads, next_cursor = paginate(cursor, '''
             SELECT su.*, u.name as uploaded_by_name, d.name as department_name,
                    r.name as reviewed_by_name
             FROM syllabus_uploads su
             JOIN users u ON su.uploaded_by = u.id
             LEFT JOIN departments d ON su.department_id = d.id
             LEFT JOIN users r ON su.reviewed_by = r.id
-            ORDER BY su.uploaded_at DESC
-        ''')
-        
-        uploads = cursor.fetchall()
+            WHERE 1
+        ''', sort_column='su.uploaded_at', id_column='su.id', date_column='su.uploaded_at',
+            filters={'status': 'su.status', 'department_id': 'su.department_id'})
         conn.close()
         
         return jsonify({
             'success': True,
-            'uploads': [dict(row) for row in uploads]
+            'uploads': [dict(row) for row in uploads],
+            'next_cursor': next_cursor
         })
         
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -417,8 +375,7 @@ def approve_syllabus(upload_id):
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -457,8 +414,7 @@ def reject_syllabus(upload_id):
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -497,29 +453,31 @@ def timetable_logs():
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
         
         # Get timetable logs
-        cursor.execute('''
+        logs, next_cursor = paginate(cursor, '''
             SELECT tl.*, d.name as department_name, u.name as generated_by_name
-            FROM timetable_logs tl
+            FROM {table} tl
             JOIN departments d ON tl.department_id = d.id
             JOIN users u ON tl.generated_by = u.id
-            ORDER BY tl.generated_at DESC
-        ''')
-        
-        logs = cursor.fetchall()
+            WHERE 1
+        ''', sort_column='tl.generated_at', id_column='tl.id', date_column='tl.generated_at',
+            filters={'status': 'tl.status', 'department_id': 'tl.department_id'},
+            archived_table='timetable_logs')
         conn.close()
         
         return jsonify({
             'success': True,
-            'logs': [dict(row) for row in logs]
+            'logs': [dict(row) for row in logs],
+            'next_cursor': next_cursor
         })
         
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -533,8 +491,7 @@ def chatbot_query():
         # Verify main admin access
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
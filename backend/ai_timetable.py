@@ -1,5 +1,7 @@
 
-import sqlite3
+from db import get_connection, open_readonly, run_in_transaction
+from timetable_store import replace_live_timetable
+from timetable_views import TIME_SLOTS
 import json
 import random
 from typing import Dict, List, Tuple
@@ -10,16 +12,17 @@ from datetime import datetime
 class TimetableGenerator:
     def __init__(self):
         self.days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
-        self.time_slots = [
-            '9:00-10:00', '10:00-11:00', '11:15-12:15', 
-            '12:15-1:15', '2:15-3:15', '3:15-4:15', '4:30-5:30'
-        ]
+        self.time_slots = list(TIME_SLOTS)
         self.groq_api_key = os.getenv('GROQ_API_KEY')
         
-    def generate_timetable(self, department_id: int) -> Dict:
-        """Generate optimized timetable for a department"""
+    def generate_timetable(self, department_id: int, snapshot_path: str = None) -> Dict:
+        """Generate optimized timetable for a department
+
+        With a snapshot_path the inputs are read from that snapshot and the
+        result is returned without being saved, for what-if and offline runs.
+        """
         try:
-            conn = sqlite3.connect('timetable.db')
+            conn = open_readonly(snapshot_path) if snapshot_path else get_connection()
             cursor = conn.cursor()
             
             # Get department data
@@ -28,11 +31,13 @@ class TimetableGenerator:
             if not dept_data:
                 return {'error': 'Department not found'}
             
-            # Get staff and their subjects
+            # Get staff and their subjects, one row per assignment
             cursor.execute('''
-                SELECT u.id, u.name, u.staff_role, u.subjects_selected
+                SELECT u.id, u.name, u.staff_role, ss.subject_id
                 FROM users u
+                JOIN staff_subjects ss ON ss.staff_id = u.id
                 WHERE u.department_id = ? AND u.role = 'staff' AND u.subjects_locked = 1
+                ORDER BY u.id, ss.position
             ''', (department_id,))
             staff_data = cursor.fetchall()
             
@@ -53,14 +58,12 @@ class TimetableGenerator:
             
             # Process data
             staff_subjects = {}
-            for staff in staff_data:
-                if staff[3]:  # subjects_selected
-                    subject_ids = [int(s) for s in staff[3].split(',')]
-                    staff_subjects[staff[0]] = {
-                        'name': staff[1],
-                        'role': staff[2],
-                        'subjects': subject_ids
-                    }
+            for staff_id, name, role, subject_id in staff_data:
+                staff_subjects.setdefault(staff_id, {
+                    'name': name,
+                    'role': role,
+                    'subjects': []
+                })['subjects'].append(subject_id)
             
             subjects_dict = {s[0]: {'name': s[1], 'code': s[2]} for s in subjects_data}
             classrooms_dict = {c[0]: {'name': c[1], 'capacity': c[2]} for c in classrooms_data}
@@ -69,7 +72,8 @@ class TimetableGenerator:
             timetable = self._optimize_timetable(staff_subjects, subjects_dict, classrooms_dict)
             
             # Save timetable to database
-            self._save_timetable(department_id, timetable)
+            if not snapshot_path:
+                self._save_timetable(department_id, timetable)
             
             return {
                 'success': True,
@@ -151,36 +155,14 @@ class TimetableGenerator:
     
     def _save_timetable(self, department_id: int, timetable: List):
         """Save generated timetable to database"""
-        conn = sqlite3.connect('timetable.db')
-        cursor = conn.cursor()
-        
-        # Clear existing timetable for department
-        cursor.execute('DELETE FROM timetables WHERE department_id = ?', (department_id,))
-        
-        # Insert new timetable
-        for entry in timetable:
-            cursor.execute('''
-                INSERT INTO timetables (department_id, day, time_slot, subject_id, staff_id, classroom_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                department_id,
-                entry['day'],
-                entry['time_slot'],
-                entry['subject_id'],
-                entry['staff_id'],
-                entry['classroom_id']
-            ))
-        
-        conn.commit()
-        conn.close()
+        run_in_transaction(lambda cursor: replace_live_timetable(cursor, department_id, timetable))
     
     def export_to_excel(self, department_id: int, file_path: str):
         """Export timetable to Excel format"""
         try:
-            import openpyxl
-            from openpyxl.styles import Font, Alignment, PatternFill
+            from excel_export import write_workbook
             
-            conn = sqlite3.connect('timetable.db')
+            conn = get_connection()
             cursor = conn.cursor()
             
             # Get timetable data
@@ -195,41 +177,9 @@ class TimetableGenerator:
                 ORDER BY t.day, t.time_slot
             ''', (department_id,))
             
-            timetable_data = cursor.fetchall()
+            # Rows go from the cursor straight into the sheet
+            write_workbook(file_path, "Timetable", ['Day', 'Time Slot', 'Subject', 'Code', 'Staff', 'Classroom'], cursor)
             conn.close()
-            
-            # Create Excel workbook
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "Timetable"
-            
-            # Headers
-            headers = ['Day', 'Time Slot', 'Subject', 'Code', 'Staff', 'Classroom']
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = Font(bold=True)
-                cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-                cell.alignment = Alignment(horizontal="center")
-            
-            # Data
-            for row, data in enumerate(timetable_data, 2):
-                for col, value in enumerate(data, 1):
-                    ws.cell(row=row, column=col, value=value)
-            
-            # Auto-adjust column widths
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(str(cell.value))
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                ws.column_dimensions[column_letter].width = adjusted_width
-            
-            wb.save(file_path)
             return True
             
         except Exception as e:
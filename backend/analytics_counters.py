@@ -0,0 +1,147 @@
+import sys
+from db import ARCHIVE_SCHEMA, attach_archive, open_connection
+
+# counter -> (table, condition on the row with {row} standing for NEW/OLD, columns the condition reads)
+COUNTERS = {
+    'departments': ('departments', None, ()),
+    'staff': ('users', "{row}.role = 'staff'", ('role',)),
+    'dept_admins': ('users', "{row}.role = 'dept_admin'", ('role',)),
+    'pending_staff_requests': ('staff_registration_requests', "{row}.status = 'pending'", ('status',)),
+    'pending_syllabus_uploads': ('syllabus_uploads', "{row}.status = 'pending'", ('status',)),
+    'timetable_versions': ('timetable_versions', None, ()),
+    'timetable_logs': ('timetable_logs', None, ()),
+    'pending_credentials': ('credentials_export', '{row}.exported = FALSE', ('exported',)),
+    'notifications': ('notifications', None, ())
+}
+
+def _condition(condition, row):
+    return condition.format(row=row) if condition else '1'
+
+def _trigger_name(counter, event):
+    return f'trg_{COUNTERS[counter][0]}_{event}_{counter}_analytics'
+
+def _count(cursor, counter, schema='main'):
+    table, condition, _ = COUNTERS[counter]
+    where = _condition(condition, table)
+    cursor.execute(f'SELECT COUNT(*) FROM {schema}.{table} WHERE {where}')
+    return cursor.fetchone()[0]
+
+def _create_triggers(cursor, counter):
+    table, condition, columns = COUNTERS[counter]
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {_trigger_name(counter, 'insert')}
+        AFTER INSERT ON {table}
+        WHEN {_condition(condition, 'NEW')}
+        BEGIN
+            UPDATE analytics_counters SET value = value + 1 WHERE name = '{counter}';
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {_trigger_name(counter, 'delete')}
+        AFTER DELETE ON {table}
+        WHEN {_condition(condition, 'OLD')}
+        BEGIN
+            UPDATE analytics_counters SET value = value - 1 WHERE name = '{counter}';
+        END
+    ''')
+
+    if condition:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {_trigger_name(counter, 'update')}
+            AFTER UPDATE OF {', '.join(columns)} ON {table}
+            WHEN COALESCE({_condition(condition, 'NEW')}, 0) != COALESCE({_condition(condition, 'OLD')}, 0)
+            BEGIN
+                UPDATE analytics_counters
+                SET value = value + (CASE WHEN COALESCE({_condition(condition, 'NEW')}, 0) THEN 1 ELSE -1 END)
+                WHERE name = '{counter}';
+            END
+        ''')
+
+def init_analytics_counters(cursor):
+    """Create the counters table and the triggers of every counter whose table exists
+
+    A counter is seeded with a full count in the same transaction its
+    triggers are created in, so it starts exact.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS analytics_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0,
+            rebuilt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+    existing = {row[0] for row in cursor.fetchall()}
+
+    for counter, (table, _, _) in COUNTERS.items():
+        if table not in existing or _trigger_name(counter, 'insert') in existing:
+            continue
+
+        _create_triggers(cursor, counter)
+        cursor.execute('INSERT OR REPLACE INTO analytics_counters (name, value) VALUES (?, ?)',
+                       (counter, _count(cursor, counter)))
+
+def read_analytics_counters(cursor):
+    """All counters in one read, counters whose table does not exist yet read as 0"""
+    cursor.execute('SELECT name, value FROM analytics_counters')
+    values = {row[0]: row[1] for row in cursor.fetchall()}
+    return {counter: values.get(counter, 0) for counter in COUNTERS}
+
+def credit_archived_rows(cursor, table, ids):
+    """Count rows just moved to the archive back onto their table's counters
+
+    Their delete triggers took them off, but the counters cover the whole
+    history, archived rows included.
+    """
+    id_list = ', '.join('?' for _ in ids)
+    for counter, (counted_table, condition, _) in COUNTERS.items():
+        if counted_table != table:
+            continue
+        cursor.execute(f'''
+            UPDATE analytics_counters
+            SET value = value + (SELECT COUNT(*) FROM {ARCHIVE_SCHEMA}.{table}
+                                 WHERE id IN ({id_list}) AND {_condition(condition, table)})
+            WHERE name = ?
+        ''', (*ids, counter))
+
+def rebuild_analytics_counters(db_path='timetable.db'):
+    """Recount every counter from its table and its archive to repair drift, returns {counter: (old, new)}"""
+    conn = open_connection(db_path)
+    archived = set()
+    if attach_archive(conn, db_path):
+        archived = {row[0] for row in conn.execute(f"SELECT name FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE type = 'table'")}
+
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+
+    init_analytics_counters(cursor)
+    before = read_analytics_counters(cursor)
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in cursor.fetchall()}
+
+    changes = {}
+    for counter, (table, _, _) in COUNTERS.items():
+        if table not in tables:
+            continue
+        value = _count(cursor, counter)
+        if table in archived:
+            value += _count(cursor, counter, ARCHIVE_SCHEMA)
+        cursor.execute('''
+            INSERT OR REPLACE INTO analytics_counters (name, value, rebuilt_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', (counter, value))
+        changes[counter] = (before[counter], value)
+
+    conn.commit()
+    conn.close()
+    return changes
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'timetable.db'
+    for counter, (old, new) in rebuild_analytics_counters(db_path).items():
+        marker = '✅' if old == new else '⚠️'
+        print(f"{marker} {counter}: {old} -> {new}")
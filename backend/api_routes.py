@@ -1,10 +1,23 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import sqlite3
+from db import get_connection, init_blueprint, run_in_transaction
+from auth import current_user, calendar_feed_nonce, calendar_feed_token, is_calendar_feed_token
 from ai_timetable import TimetableGenerator
 import os
+from http_cache import compute_etag, compute_departments_etag, is_not_modified, not_modified, with_etag
+from timetable_store import replace_live_timetable
+from staff_subjects import subjects_for_staff, department_staff_subjects, set_staff_subjects
+from search_index import SEARCH_SOURCES, SEARCH_LIMIT, MAX_SEARCH_LIMIT, search
+from timetable_exports import cached_export, caching_chunks, csv_chunks, export_rows, ics_chunks
 
 api = Blueprint('api', __name__)
+init_blueprint(api)
+
+# Change-counter scopes each cached response is derived from
+SUBJECTS_SCOPES = ('subjects',)
+CLASSROOMS_SCOPES = ('classrooms',)
+DEPARTMENTS_SCOPES = ('departments',)
+TIMETABLES_SCOPES = ('timetables', 'subjects', 'classrooms', 'users')
 
 # Staff management routes
 @api.route('/api/staff', methods=['GET'])
@@ -12,12 +25,11 @@ api = Blueprint('api', __name__)
 def get_staff():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user's department
-        cursor.execute('SELECT department_id, role FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id', 'role')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
@@ -26,13 +38,14 @@ def get_staff():
         
         # Get staff in the same department
         cursor.execute('''
-            SELECT u.id, u.name, u.email, u.staff_role, u.subjects_selected, u.subjects_locked
+            SELECT u.id, u.name, u.email, u.staff_role, u.subjects_locked
             FROM users u
             WHERE u.department_id = ? AND u.role = 'staff'
             ORDER BY u.name
         ''', (department_id,))
         
         staff_data = cursor.fetchall()
+        staff_subjects = department_staff_subjects(cursor, department_id)
         conn.close()
         
         staff_list = []
@@ -42,8 +55,8 @@ def get_staff():
                 'name': staff[1],
                 'email': staff[2],
                 'staff_role': staff[3],
-                'subjects_selected': staff[4].split(',') if staff[4] else [],
-                'subjects_locked': bool(staff[5])
+                'subjects_selected': [str(subject_id) for subject_id in staff_subjects.get(staff[0], [])],
+                'subjects_locked': bool(staff[4])
             })
         
         return jsonify(staff_list), 200
@@ -51,23 +64,94 @@ def get_staff():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api.route('/api/staff/<int:staff_id>/subjects', methods=['GET'])
+@jwt_required()
+def get_staff_subjects(staff_id):
+    try:
+        user_data = current_user('department_id')
+        
+        if not user_data:
+            return jsonify({'error': 'User not found'}), 404
+        
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT 1 FROM users WHERE id = ? AND department_id = ? AND role = 'staff'",
+                       (staff_id, user_data[0]))
+        if not cursor.fetchone():
+            conn.close()
+            return jsonify({'error': 'Staff member not found'}), 404
+        
+        subject_ids = subjects_for_staff(cursor, staff_id)
+        cursor.execute(f'''
+            SELECT id, name, code FROM subjects WHERE id IN ({', '.join('?' * len(subject_ids))})
+        ''', subject_ids)
+        subjects = {row[0]: row for row in cursor.fetchall()}
+        conn.close()
+        
+        return jsonify([{
+            'id': str(subject_id),
+            'name': subjects[subject_id][1],
+            'code': subjects[subject_id][2]
+        } for subject_id in subject_ids if subject_id in subjects]), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/subjects/<int:subject_id>/staff', methods=['GET'])
+@jwt_required()
+def get_subject_staff(subject_id):
+    try:
+        user_data = current_user('department_id')
+        
+        if not user_data:
+            return jsonify({'error': 'User not found'}), 404
+        
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT u.id, u.name, u.email, u.staff_role
+            FROM staff_subjects ss
+            JOIN users u ON u.id = ss.staff_id
+            WHERE ss.subject_id = ? AND u.department_id = ? AND u.role = 'staff'
+            ORDER BY u.name
+        ''', (subject_id, user_data[0]))
+        
+        staff_data = cursor.fetchall()
+        conn.close()
+        
+        return jsonify([{
+            'id': str(staff[0]),
+            'name': staff[1],
+            'email': staff[2],
+            'staff_role': staff[3]
+        } for staff in staff_data]), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @api.route('/api/subjects', methods=['GET'])
 @jwt_required()
 def get_subjects():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user's department
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
         
         department_id = user_data[0]
         
+        etag = compute_etag(cursor, 'subjects', department_id, SUBJECTS_SCOPES)
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
         # Get subjects for the department
         cursor.execute('''
             SELECT id, name, code, credits
@@ -88,7 +172,7 @@ def get_subjects():
                 'credits': subject[3]
             })
         
-        return jsonify(subjects_list), 200
+        return with_etag(jsonify(subjects_list), etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -103,12 +187,11 @@ def create_subject():
         if not data.get('name') or not data.get('code'):
             return jsonify({'error': 'Name and code are required'}), 400
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user's department
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
@@ -144,7 +227,7 @@ def select_subjects():
         if not data.get('subject_ids'):
             return jsonify({'error': 'Subject IDs are required'}), 400
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user data
@@ -164,12 +247,8 @@ def select_subjects():
             return jsonify({'error': f'Maximum {max_subjects} subjects allowed for {staff_role}'}), 400
         
         # Update user's subjects
-        subjects_str = ','.join(map(str, data['subject_ids']))
-        cursor.execute('''
-            UPDATE users 
-            SET subjects_selected = ?, subjects_locked = 1
-            WHERE id = ?
-        ''', (subjects_str, current_user_id))
+        set_staff_subjects(cursor, current_user_id, data['subject_ids'])
+        cursor.execute('UPDATE users SET subjects_locked = 1 WHERE id = ?', (current_user_id,))
         
         conn.commit()
         conn.close()
@@ -226,23 +305,198 @@ def export_timetable():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _export_departments(cursor, column, entity_id, home_department_id):
+    """Departments whose counters an export's rows depend on
+
+    Timetables of any department may book a staff member or room, so the
+    departments of their rows count as well as the home department.
+    """
+    cursor.execute(f'SELECT DISTINCT department_id FROM timetables WHERE {column} = ?', (entity_id,))
+    return {row[0] or 0 for row in cursor.fetchall()} | {home_department_id or 0}
+
+def _export_target(cursor, user_department_id):
+    """(scope, id, home department_id) of the timetable export asked for, None if the staff member or room is unknown"""
+    if request.args.get('staff_id'):
+        staff_id = int(request.args['staff_id'])
+        cursor.execute("SELECT department_id FROM users WHERE id = ? AND role = 'staff'", (staff_id,))
+        row = cursor.fetchone()
+        return ('staff', staff_id, row[0]) if row else None
+    
+    if request.args.get('classroom_id'):
+        classroom_id = int(request.args['classroom_id'])
+        cursor.execute('SELECT department_id FROM classrooms WHERE id = ?', (classroom_id,))
+        row = cursor.fetchone()
+        return ('room', classroom_id, row[0]) if row else None
+    
+    department_id = request.args.get('department_id') or user_department_id
+    return ('department', int(department_id), int(department_id)) if department_id else None
+
+def _may_read_timetable(user_data, scope, entity_id, department_id):
+    """Whether a user with (role, department_id) may read a staff, room or department timetable
+
+    Main admins read everything. Anyone reads their own staff timetable and
+    the rooms and timetable of their department; other staff members'
+    timetables are for their department admin.
+    """
+    role, user_department_id = user_data
+    if role == 'main_admin':
+        return True
+    if scope == 'staff' and str(get_jwt_identity()) == str(entity_id):
+        return True
+    if str(department_id) != str(user_department_id):
+        return False
+    return scope != 'staff' or role == 'dept_admin'
+
+def _closing(conn, chunks):
+    # Streamed responses outlive the handler; the connection goes back once the last chunk is out
+    try:
+        yield from chunks
+    finally:
+        conn.close()
+
+def _export_response(conn, etag, chunks, mimetype, filename):
+    body = cached_export(etag)
+    if body is not None:
+        conn.close()
+        response = Response(body, mimetype=mimetype)
+    else:
+        response = Response(stream_with_context(_closing(conn, caching_chunks(etag, chunks))), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return with_etag(response, etag)
+
+@api.route('/api/timetables/export.csv', methods=['GET'])
+@jwt_required()
+def export_timetable_csv():
+    """Stream the live timetable of a department, or of ?staff_id= or ?classroom_id=, as CSV"""
+    try:
+        user_data = current_user('role', 'department_id')
+        
+        if not user_data:
+            return jsonify({'error': 'User not found'}), 404
+        
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        target = _export_target(cursor, user_data[1])
+        if not target:
+            conn.close()
+            return jsonify({'error': 'Nothing to export'}), 404
+        
+        scope, entity_id, department_id = target
+        if not _may_read_timetable(user_data, scope, entity_id, department_id):
+            conn.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        if scope == 'department':
+            department_ids = {department_id}
+        else:
+            column = 'staff_id' if scope == 'staff' else 'classroom_id'
+            department_ids = _export_departments(cursor, column, entity_id, department_id)
+        
+        etag = compute_departments_etag(cursor, f'timetable-csv-{scope}-{entity_id}', department_ids, TIMETABLES_SCOPES)
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
+        return _export_response(conn, etag, csv_chunks(export_rows(cursor, scope, entity_id)),
+                                'text/csv', f'timetable_{scope}_{entity_id}.csv'), 200
+        
+    except ValueError:
+        return jsonify({'error': 'Invalid id'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _calendar_staff(cursor, staff_id, feed_token=None):
+    """(name, department_id) of a staff member whose calendar the caller may read, None otherwise
+
+    A feed_token from the current feed link is enough on its own, so
+    calendar apps can subscribe; otherwise the staff member themselves and
+    admins of their department may read it.
+    """
+    cursor.execute("SELECT name, department_id FROM users WHERE id = ? AND role = 'staff'", (staff_id,))
+    staff = cursor.fetchone()
+    if not staff:
+        return None
+    
+    if feed_token and is_calendar_feed_token(cursor, feed_token, staff_id):
+        return staff
+    
+    if not get_jwt_identity():
+        return None
+    
+    # A revoked token or deleted user reads nothing, their own calendar included
+    user_data = current_user('role', 'department_id')
+    if user_data and _may_read_timetable(user_data, 'staff', staff_id, staff[1]):
+        return staff
+    return None
+
+@api.route('/api/staff/<int:staff_id>/timetable.ics', methods=['GET'])
+@jwt_required(optional=True)
+def staff_calendar(staff_id):
+    """A staff member's live timetable as an iCalendar feed of weekly recurring events"""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        staff = _calendar_staff(cursor, staff_id, request.args.get('token'))
+        if not staff:
+            conn.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        department_ids = _export_departments(cursor, 'staff_id', staff_id, staff[1])
+        etag = compute_departments_etag(cursor, f'timetable-ics-{staff_id}', department_ids, TIMETABLES_SCOPES)
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
+        chunks = ics_chunks(export_rows(cursor, 'staff', staff_id), f'{staff[0]} timetable')
+        return _export_response(conn, etag, chunks, 'text/calendar', f'timetable_{staff_id}.ics'), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@api.route('/api/staff/<int:staff_id>/calendar-feed', methods=['GET', 'POST'])
+@jwt_required()
+def staff_calendar_feed(staff_id):
+    """Subscription URL of a staff member's calendar feed; POST issues a new one and cuts off the old"""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        staff = _calendar_staff(cursor, staff_id)
+        conn.close()
+        
+        if not staff:
+            return jsonify({'error': 'Access denied'}), 403
+        
+        rotate = request.method == 'POST'
+        nonce = run_in_transaction(lambda cursor: calendar_feed_nonce(cursor, staff_id, rotate))
+        url = url_for('api.staff_calendar', staff_id=staff_id, token=calendar_feed_token(staff_id, nonce), _external=True)
+        return jsonify({'success': True, 'url': url}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @api.route('/api/classrooms', methods=['GET'])
 @jwt_required()
 def get_classrooms():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user's department
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
         
         department_id = user_data[0]
         
+        etag = compute_etag(cursor, 'classrooms', department_id, CLASSROOMS_SCOPES)
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
         cursor.execute('''
             SELECT id, name, capacity
             FROM classrooms
@@ -261,7 +515,7 @@ def get_classrooms():
                 'capacity': classroom[2]
             })
         
-        return jsonify(classrooms_list), 200
+        return with_etag(jsonify(classrooms_list), etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -276,12 +530,11 @@ def create_classroom():
         if not data.get('name') or not data.get('capacity'):
             return jsonify({'error': 'Name and capacity are required'}), 400
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user's department
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
@@ -310,18 +563,23 @@ def create_classroom():
 @jwt_required()
 def get_departments():
     try:
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
+        etag = compute_etag(cursor, 'departments', None, DEPARTMENTS_SCOPES)
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
         cursor.execute('SELECT id, name, code FROM departments ORDER BY name')
         departments = cursor.fetchall()
         conn.close()
         
-        return jsonify([{
+        return with_etag(jsonify([{
             'id': str(dept[0]),
             'name': dept[1],
             'code': dept[2]
-        } for dept in departments]), 200
+        } for dept in departments]), etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -334,10 +592,9 @@ def create_department():
         data = request.get_json()
         
         # Verify main admin
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role[0] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -367,37 +624,32 @@ def get_timetables():
         current_user_id = get_jwt_identity()
         department_id = request.args.get('department_id')
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        if department_id:
-            cursor.execute('''
-                SELECT t.id, t.day, t.time_slot, s.name as subject_name, s.code as subject_code,
-                       u.name as staff_name, c.name as classroom_name, t.subject_id, t.staff_id, t.classroom_id
-                FROM timetables t
-                JOIN subjects s ON t.subject_id = s.id
-                JOIN users u ON t.staff_id = u.id
-                JOIN classrooms c ON t.classroom_id = c.id
-                WHERE t.department_id = ?
-                ORDER BY t.day, t.time_slot
-            ''', (department_id,))
-        else:
+        if not department_id:
             # Get user's department
-            cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-            user_data = cursor.fetchone()
+            user_data = current_user('department_id')
             if not user_data or not user_data[0]:
+                conn.close()
                 return jsonify([]), 200
-            
-            cursor.execute('''
-                SELECT t.id, t.day, t.time_slot, s.name as subject_name, s.code as subject_code,
-                       u.name as staff_name, c.name as classroom_name, t.subject_id, t.staff_id, t.classroom_id
-                FROM timetables t
-                JOIN subjects s ON t.subject_id = s.id
-                JOIN users u ON t.staff_id = u.id
-                JOIN classrooms c ON t.classroom_id = c.id
-                WHERE t.department_id = ?
-                ORDER BY t.day, t.time_slot
-            ''', (user_data[0],))
+            department_id = user_data[0]
+        
+        etag = compute_etag(cursor, 'timetables', department_id, TIMETABLES_SCOPES)
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
+        cursor.execute('''
+            SELECT t.id, t.day, t.time_slot, s.name as subject_name, s.code as subject_code,
+                   u.name as staff_name, c.name as classroom_name, t.subject_id, t.staff_id, t.classroom_id
+            FROM timetables t
+            JOIN subjects s ON t.subject_id = s.id
+            JOIN users u ON t.staff_id = u.id
+            JOIN classrooms c ON t.classroom_id = c.id
+            WHERE t.department_id = ?
+            ORDER BY t.day, t.time_slot
+        ''', (department_id,))
         
         timetables_data = cursor.fetchall()
         conn.close()
@@ -423,7 +675,7 @@ def get_timetables():
                 }
             })
         
-        return jsonify(timetables_list), 200
+        return with_etag(jsonify(timetables_list), etag), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -439,28 +691,8 @@ def save_timetables():
         if not department_id:
             return jsonify({'error': 'Department ID is required'}), 400
         
-        conn = sqlite3.connect('timetable.db')
-        cursor = conn.cursor()
-        
-        # Delete existing timetable for this department
-        cursor.execute('DELETE FROM timetables WHERE department_id = ?', (department_id,))
-        
-        # Insert new timetable entries
-        for entry in timetable_entries:
-            cursor.execute('''
-                INSERT INTO timetables (department_id, day, time_slot, subject_id, staff_id, classroom_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                department_id,
-                entry['day'],
-                entry['time_slot'],
-                entry['subject_id'],
-                entry['staff_id'],
-                entry['classroom_id']
-            ))
-        
-        conn.commit()
-        conn.close()
+        # Existing entries are replaced in one transaction with a bulk insert
+        run_in_transaction(lambda cursor: replace_live_timetable(cursor, department_id, timetable_entries))
         
         return jsonify({'message': 'Timetable saved successfully'}), 200
         
@@ -472,12 +704,11 @@ def save_timetables():
 def get_constraints():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user's department and role
-        cursor.execute('SELECT department_id, role FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id', 'role')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
@@ -543,12 +774,11 @@ def create_constraint():
         if not data.get('role') or not data.get('subject_type'):
             return jsonify({'error': 'Role and subject type are required'}), 400
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         # Get current user's department and role
-        cursor.execute('SELECT department_id, role FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id', 'role')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
@@ -587,4 +817,40 @@ def create_constraint():
         }), 201
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'error': str(e)}), 500
+
+# Search
+@api.route('/api/search', methods=['GET'])
+@jwt_required()
+def search_everything():
+    try:
+        current_user_id = int(get_jwt_identity())
+        text = request.args.get('q', '').strip()
+        
+        if not text:
+            return jsonify({'error': 'Search text is required'}), 400
+        
+        sources = [source for source in request.args.get('types', '').split(',') if source]
+        unknown = [source for source in sources if source not in SEARCH_SOURCES]
+        if unknown:
+            return jsonify({'error': f"Unknown search types: {', '.join(unknown)}"}), 400
+        
+        limit = request.args.get('limit', SEARCH_LIMIT, type=int)
+        if limit < 1:
+            return jsonify({'error': 'limit must be positive'}), 400
+        limit = min(limit, MAX_SEARCH_LIMIT)
+        
+        user_data = current_user('role', 'department_id')
+        
+        if not user_data:
+            return jsonify({'error': 'User not found'}), 404
+        
+        conn = get_connection()
+        cursor = conn.cursor()
+        results = search(cursor, text, current_user_id, user_data[0], user_data[1], sources, limit)
+        conn.close()
+        
+        return jsonify({'success': True, 'results': results}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,20 +1,31 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, jwt_required, create_access_token, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import secrets
 import string
 import hashlib
 import json
-import tempfile
 import os
-from datetime import timedelta
+from datetime import datetime, timedelta
+from itertools import chain
 from dotenv import load_dotenv
 from api_routes import api
 from ai_timetable import TimetableGenerator
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
+from timetable_store import init_timetable_store, load_staff_timetable
+from http_cache import init_change_counters, create_change_triggers
+from db import get_connection, init_app as init_db_pool, pool_stats, query_stats
+from migrations import run_migrations
+from analytics_counters import init_analytics_counters, read_analytics_counters
+from search_index import init_search_index
+from auth import current_user, token_claims, is_token_revoked, init_token_revocations, init_calendar_feeds
+from staff_subjects import subjects_for_staff
+from writer import WriteQueueFull, WriteTimeout, submit_write, write, writer_stats
+from pagination import InvalidPageRequest, paginate
+from backup import create_snapshot, list_snapshots, rotate_snapshots, snapshot_path
+from archive import ARCHIVE_POLICIES, run_archive
+from passwords import PasswordPoolBusy, hash_password, password_stats, verify_password
+from excel_export import workbook_response
 
 # Load environment variables
 load_dotenv()
@@ -25,14 +36,22 @@ app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-chan
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
 
 jwt = JWTManager(app)
+
+# Tokens issued before a user's role or department changed are rejected
+@jwt.token_in_blocklist_loader
+def check_token_revoked(jwt_header, jwt_payload):
+    return is_token_revoked(jwt_payload)
 CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
 
 # Register existing Blueprint
 app.register_blueprint(api)
 
+# Release pooled connections that a request did not close
+init_db_pool(app)
+
 # Initialize the database
 def init_db():
-    conn = sqlite3.connect('timetable.db')
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -305,7 +324,26 @@ def init_db():
     )
 ''')
 
-    
+    # Change counters behind the ETags of read endpoints
+    init_change_counters(cursor)
+    create_change_triggers(cursor, 'departments', department_column=None)
+    create_change_triggers(cursor, 'subjects')
+    create_change_triggers(cursor, 'classrooms')
+    create_change_triggers(cursor, 'timetables')
+    create_change_triggers(cursor, 'users', update_columns=['name', 'department_id'])
+
+    # Revocation list for tokens whose role/department claims went stale
+    init_token_revocations(cursor)
+    init_calendar_feeds(cursor)
+
+    init_timetable_store(cursor)
+
+    # Versioned indexes over the tables above
+    run_migrations(cursor)
+
+    # Dashboard counters kept by triggers
+    init_analytics_counters(cursor)
+    init_search_index(cursor)
 
     conn.commit()
     conn.close()
@@ -315,6 +353,31 @@ def init_db():
 def health_check():
     return jsonify({'status': 'healthy', 'message': 'SRM Timetable AI Backend is running'}), 200
 
+# Internal statistics, down to SQL text and timings: main admins only
+@app.route('/api/health/db-pool', methods=['GET'])
+@jwt_required()
+def db_pool_health():
+    user_role = current_user('role')
+    if not user_role or user_role[0] != 'main_admin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify({'status': 'healthy', 'pool': pool_stats(), 'writers': writer_stats()}), 200
+
+@app.route('/api/health/db-queries', methods=['GET'])
+@jwt_required()
+def db_query_health():
+    user_role = current_user('role')
+    if not user_role or user_role[0] != 'main_admin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify({'status': 'healthy', 'queries': query_stats()}), 200
+
+@app.route('/api/health/passwords', methods=['GET'])
+@jwt_required()
+def password_health():
+    user_role = current_user('role')
+    if not user_role or user_role[0] != 'main_admin':
+        return jsonify({'error': 'Access denied'}), 403
+    return jsonify({'status': 'healthy', 'passwords': password_stats()}), 200
+
 # AUTH ROUTES
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -329,32 +392,45 @@ def login():
             print("❌ Missing email or password")
             return jsonify({'success': False, 'error': 'Email and password are required'}), 400
 
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
 
         cursor.execute('''
             SELECT u.id, u.name, u.email, u.password_hash, u.role, u.department_id,
-                   u.staff_role, u.subjects_selected, u.subjects_locked, d.name as department_name
+                   u.staff_role, u.subjects_locked, d.name as department_name
             FROM users u
             LEFT JOIN departments d ON u.department_id = d.id
             WHERE u.email = ?
         ''', (email,))
         user_data = cursor.fetchone()
-        conn.close()
 
         if not user_data:
+            conn.close()
             print("❌ User not found in DB")
             return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
 
-        user_id, name, db_email, db_password_hash, role, dept_id, staff_role, selected_subjects, locked, dept_name = user_data
+        user_id, name, db_email, db_password_hash, role, dept_id, staff_role, locked, dept_name = user_data
+        selected_subjects = subjects_for_staff(cursor, user_id)
+        conn.close()
 
         print(f"✅ User record found: {db_email}")
-        password_match = check_password_hash(db_password_hash, password)
+        try:
+            # Hashed on the bounded pool, off this request's thread
+            password_match, new_hash = verify_password(db_password_hash, password)
+        except PasswordPoolBusy as e:
+            return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': '1'}
         print(f"🔐 Password match: {password_match}")
 
         if not password_match:
             return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
 
+        if new_hash:
+            # Moved to the current scheme in the background; skipped if the password changed meanwhile
+            submit_write(lambda cursor: cursor.execute(
+                'UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                (new_hash, user_id, db_password_hash)
+            ))
+
         user = {
             'id': str(user_id),
             'name': name,
@@ -362,12 +438,13 @@ def login():
             'role': role,
             'department_id': str(dept_id) if dept_id else None,
             'staff_role': staff_role,
-            'subjects_selected': selected_subjects.split(',') if selected_subjects else [],
+            'subjects_selected': [str(subject_id) for subject_id in selected_subjects],
             'subjects_locked': bool(locked),
             'department_name': dept_name
         }
 
-        access_token = create_access_token(identity=str(user_id))
+        # Role and department travel in the token so handlers need no user lookup
+        access_token = create_access_token(identity=str(user_id), additional_claims=token_claims(role, dept_id))
         print(f"🎟️ Token issued for {db_email}")
 
         return jsonify({'success': True, 'data': {'user': user, 'token': access_token}}), 200
@@ -382,18 +459,19 @@ def login():
 def verify_token():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
 
         cursor.execute('''
             SELECT u.id, u.name, u.email, u.role, u.department_id,
-                   u.staff_role, u.subjects_selected, u.subjects_locked, d.name as department_name
+                   u.staff_role, u.subjects_locked, d.name as department_name
             FROM users u
             LEFT JOIN departments d ON u.department_id = d.id
             WHERE u.id = ?
         ''', (current_user_id,))
 
         user_data = cursor.fetchone()
+        selected_subjects = subjects_for_staff(cursor, current_user_id)
         conn.close()
 
         if not user_data:
@@ -406,9 +484,9 @@ def verify_token():
             'role': user_data[3],
             'department_id': str(user_data[4]) if user_data[4] else None,
             'staff_role': user_data[5],
-            'subjects_selected': user_data[6].split(',') if user_data[6] else [],
-            'subjects_locked': bool(user_data[7]),
-            'department_name': user_data[8]
+            'subjects_selected': [str(subject_id) for subject_id in selected_subjects],
+            'subjects_locked': bool(user_data[6]),
+            'department_name': user_data[7]
         }
 
         return jsonify({'success': True, 'data': {'user': user}}), 200
@@ -427,17 +505,16 @@ def logout():
 @jwt_required()
 def get_users():
     try:
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
 
-        cursor.execute('''
+        users_data, next_cursor = paginate(cursor, '''
             SELECT u.id, u.name, u.email, u.role, d.name as department_name
             FROM users u
             LEFT JOIN departments d ON u.department_id = d.id
-            ORDER BY u.name
-        ''')
-
-        users_data = cursor.fetchall()
+            WHERE 1
+        ''', sort_column='u.name', id_column='u.id', descending=False,
+            filters={'department_id': 'u.department_id', 'role': 'u.role'})
         conn.close()
 
         users_list = []
@@ -450,8 +527,10 @@ def get_users():
                 'department_name': user[4]
             })
 
-        return jsonify(users_list), 200
+        return jsonify({'success': True, 'users': users_list, 'next_cursor': next_cursor}), 200
 
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -462,9 +541,9 @@ def generate_secure_credentials(user_id, name, email):
     username = email.split('@')[0].lower()
     password_chars = string.ascii_letters + string.digits + "!@#$%^&*"
     plain_password = ''.join(secrets.choice(password_chars) for _ in range(10))
-    password_hash = generate_password_hash(plain_password)
+    password_hash = hash_password(plain_password)
     
-    conn = sqlite3.connect('timetable.db')
+    conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
@@ -481,24 +560,22 @@ def generate_secure_credentials(user_id, name, email):
 def get_staff_requests():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role[0] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        cursor.execute('''
+        requests_data, next_cursor = paginate(cursor, '''
             SELECT sr.*, d.name as department_name, u.name as requested_by_name
             FROM staff_registration_requests sr
             JOIN departments d ON sr.department_id = d.id
             JOIN users u ON sr.requested_by = u.id
-            ORDER BY sr.created_at DESC
-        ''')
-        
-        requests_data = cursor.fetchall()
+            WHERE 1
+        ''', sort_column='sr.created_at', id_column='sr.id', date_column='sr.created_at',
+            filters={'status': 'sr.status', 'department_id': 'sr.department_id'})
         conn.close()
         
         requests_list = []
@@ -521,8 +598,10 @@ def get_staff_requests():
                 'requested_by_name': req[14]
             })
         
-        return jsonify({'success': True, 'requests': requests_list}), 200
+        return jsonify({'success': True, 'requests': requests_list, 'next_cursor': next_cursor}), 200
         
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -533,16 +612,17 @@ def create_staff_request():
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role, department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('role', 'department_id')
         
         if not user_data or user_data[0] != 'dept_admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        cursor.execute('''
+        conn.close()
+        
+        write(lambda cursor: cursor.execute('''
             INSERT INTO staff_registration_requests 
             (name, employee_id, email, department_id, staff_role, contact_number, requested_by)
             VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -550,13 +630,14 @@ def create_staff_request():
             data['name'], data['employee_id'], data['email'],
             user_data[1], data['staff_role'],
             data.get('contact_number'), current_user_id
-        ))
-        
-        conn.commit()
-        conn.close()
+        )))
         
         return jsonify({'success': True, 'message': 'Staff registration request submitted'}), 201
         
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -565,11 +646,10 @@ def create_staff_request():
 def approve_staff_request(request_id):
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role[0] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -615,11 +695,10 @@ def approve_staff_request(request_id):
 def export_credentials():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role[0] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -634,45 +713,26 @@ def export_credentials():
             ORDER BY ce.generated_at DESC
         ''')
         
-        credentials_data = cursor.fetchall()
+        first = cursor.fetchone()
         
-        if not credentials_data:
+        if not first:
             return jsonify({'error': 'No new credentials to export'}), 404
         
-        # Create Excel file
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "User Credentials"
-        
-        headers = ['Name', 'Email', 'Role', 'Department', 'Username', 'Password', 'Generated At']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True, color="FFFFFF")
-            cell.fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-            cell.alignment = Alignment(horizontal="center")
-        
-        for row, data in enumerate(credentials_data, 2):
-            ws.cell(row=row, column=1, value=data[2])
-            ws.cell(row=row, column=2, value=data[3])
-            ws.cell(row=row, column=3, value=data[4].replace('_', ' ').title())
-            ws.cell(row=row, column=4, value=data[5] or 'N/A')
-            ws.cell(row=row, column=5, value=data[0])
-            ws.cell(row=row, column=6, value=data[1])
-            ws.cell(row=row, column=7, value=data[6])
-        
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
+        rows = (
+            (data[2], data[3], data[4].replace('_', ' ').title(), data[5] or 'N/A', data[0], data[1], data[6])
+            for data in chain([first], cursor)
+        )
+        response = workbook_response(
+            f'user_credentials_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx', "User Credentials",
+            ['Name', 'Email', 'Role', 'Department', 'Username', 'Password', 'Generated At'], rows,
+            header_style='accent'
+        )
         
         cursor.execute('UPDATE credentials_export SET exported = TRUE WHERE exported = FALSE')
         conn.commit()
         conn.close()
         
-        return send_file(
-            temp_file.name,
-            as_attachment=True,
-            download_name=f'user_credentials_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -682,40 +742,28 @@ def export_credentials():
 def analytics_summary():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role[0] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        analytics = {}
-        
-        cursor.execute('SELECT COUNT(*) as count FROM departments')
-        analytics['total_departments'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as count FROM users WHERE role = "staff"')
-        analytics['total_staff'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as count FROM staff_registration_requests WHERE status = "pending"')
-        analytics['pending_approvals'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as count FROM generated_timetables')
-        analytics['timetable_generations'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as count FROM users WHERE role = "dept_admin"')
-        analytics['total_dept_admins'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as count FROM credentials_export WHERE exported = FALSE')
-        analytics['pending_credentials'] = cursor.fetchone()[0]
-        
-        cursor.execute('SELECT COUNT(*) as count FROM notifications')
-        analytics['total_notifications'] = cursor.fetchone()[0]
-        
+        # Trigger-maintained counters, one read
+        counters = read_analytics_counters(cursor)
         conn.close()
         
+        analytics = {
+            'total_departments': counters['departments'],
+            'total_staff': counters['staff'],
+            'pending_approvals': counters['pending_staff_requests'],
+            'timetable_generations': counters['timetable_versions'],
+            'total_dept_admins': counters['dept_admins'],
+            'pending_credentials': counters['pending_credentials'],
+            'total_notifications': counters['notifications']
+        }
+        
         return jsonify({'success': True, 'analytics': analytics}), 200
         
     except Exception as e:
@@ -726,11 +774,10 @@ def analytics_summary():
 def handle_notifications():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role[0] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -744,26 +791,23 @@ def handle_notifications():
             if not title or not message or not recipient_type:
                 return jsonify({'error': 'Title, message, and recipient type are required'}), 400
             
-            cursor.execute('''
+            conn.close()
+            
+            write(lambda cursor: cursor.execute('''
                 INSERT INTO notifications (title, message, recipient_type, created_by)
                 VALUES (?, ?, ?, ?)
-            ''', (title, message, recipient_type, current_user_id))
-            
-            conn.commit()
-            conn.close()
+            ''', (title, message, recipient_type, current_user_id)))
             
             return jsonify({'success': True, 'message': 'Notification sent successfully'}), 200
         
         # GET request
-        cursor.execute('''
+        recent_notifications, next_cursor = paginate(cursor, '''
             SELECT n.*, u.name as created_by_name
-            FROM notifications n
+            FROM {table} n
             JOIN users u ON n.created_by = u.id
-            ORDER BY n.created_at DESC
-            LIMIT 10
-        ''')
-        
-        recent_notifications = cursor.fetchall()
+            WHERE 1
+        ''', sort_column='n.created_at', id_column='n.id', filters={'recipient_type': 'n.recipient_type'},
+            archived_table='notifications')
         conn.close()
         
         notifications_list = []
@@ -778,7 +822,93 @@ def handle_notifications():
                 'created_by_name': notif[6]
             })
         
-        return jsonify({'success': True, 'recent_notifications': notifications_list}), 200
+        return jsonify({'success': True, 'recent_notifications': notifications_list, 'next_cursor': next_cursor}), 200
+        
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/backups', methods=['GET', 'POST'])
+@jwt_required()
+def handle_backups():
+    try:
+        user_role = current_user('role')
+        
+        if not user_role or user_role[0] != 'main_admin':
+            return jsonify({'error': 'Access denied'}), 403
+        
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            
+            # Copied in small steps, so live traffic carries on meanwhile
+            snapshot = create_snapshot(label=data.get('label'))
+            rotated = rotate_snapshots()
+            
+            return jsonify({'success': True, 'snapshot': snapshot, 'rotated': rotated}), 201
+        
+        return jsonify({'success': True, 'snapshots': list_snapshots()}), 200
+        
+    except FileExistsError as e:
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/backups/<name>/what-if', methods=['POST'])
+@jwt_required()
+def what_if_timetable(name):
+    try:
+        user_role = current_user('role')
+        
+        if not user_role or user_role[0] != 'main_admin':
+            return jsonify({'error': 'Access denied'}), 403
+        
+        path = snapshot_path(name)
+        if not path:
+            return jsonify({'error': 'Snapshot not found'}), 404
+        
+        data = request.get_json()
+        if not data or not data.get('department_id'):
+            return jsonify({'error': 'Department ID is required'}), 400
+        
+        # Solved from the snapshot's data; nothing is written anywhere
+        result = TimetableGenerator().generate_timetable(int(data['department_id']), snapshot_path=path)
+        
+        if 'error' in result:
+            return jsonify(result), 400
+        
+        return jsonify(dict(result, snapshot=name)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/archive', methods=['POST'])
+@jwt_required()
+def archive_history():
+    try:
+        user_role = current_user('role')
+        
+        if not user_role or user_role[0] != 'main_admin':
+            return jsonify({'error': 'Access denied'}), 403
+        
+        data = request.get_json(silent=True) or {}
+        retention_days = data.get('retention_days')
+        if retention_days is not None and (not isinstance(retention_days, int) or retention_days < 0):
+            return jsonify({'error': 'retention_days must be a non-negative integer'}), 400
+        
+        # Moved in short batches; list endpoints keep serving archived rows
+        archived = run_archive(retention_days=retention_days)
+        
+        return jsonify({
+            'success': True,
+            'archived': archived,
+            'retention_days': {table: retention_days if retention_days is not None else policy[2]
+                               for table, policy in ARCHIVE_POLICIES.items()}
+        }), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -790,11 +920,10 @@ def handle_notifications():
 def get_enhanced_constraints():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id, role FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id', 'role')
         
         if user_data[1] == 'main_admin':
             cursor.execute('''
@@ -842,11 +971,10 @@ def create_enhanced_constraint():
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id, role FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id', 'role')
         
         if user_data[1] not in ['dept_admin', 'main_admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -876,11 +1004,10 @@ def create_enhanced_constraint():
 def get_choice_forms():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         cursor.execute('''
             SELECT scf.*, u.name as created_by_name,
@@ -924,11 +1051,10 @@ def create_choice_form():
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         cursor.execute('''
             INSERT INTO subject_choice_forms 
@@ -954,7 +1080,7 @@ def toggle_choice_form(form_id):
         data = request.get_json()
         status = data.get('status')
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('UPDATE subject_choice_forms SET status = ? WHERE id = ?', (status, form_id))
@@ -971,34 +1097,30 @@ def toggle_choice_form(form_id):
 def get_department_queries():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
+        
+        query = '''
+            SELECT dq.*, d.name as department_name, u.name as created_by_name
+            FROM {table} dq
+            JOIN departments d ON dq.department_id = d.id
+            JOIN users u ON dq.created_by = u.id
+        '''
+        filters = {'status': 'dq.status', 'priority': 'dq.priority'}
         
         if user_role[0] == 'main_admin':
-            cursor.execute('''
-                SELECT dq.*, d.name as department_name, u.name as created_by_name
-                FROM department_queries dq
-                JOIN departments d ON dq.department_id = d.id
-                JOIN users u ON dq.created_by = u.id
-                ORDER BY dq.created_at DESC
-            ''')
+            query += ' WHERE 1'
+            params = ()
+            filters['department_id'] = 'dq.department_id'
         else:
-            cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-            user_data = cursor.fetchone()
-            
-            cursor.execute('''
-                SELECT dq.*, d.name as department_name, u.name as created_by_name
-                FROM department_queries dq
-                JOIN departments d ON dq.department_id = d.id
-                JOIN users u ON dq.created_by = u.id
-                WHERE dq.department_id = ?
-                ORDER BY dq.created_at DESC
-            ''', (user_data[0],))
+            user_data = current_user('department_id')
+            query += ' WHERE dq.department_id = ?'
+            params = (user_data[0],)
         
-        queries = cursor.fetchall()
+        queries, next_cursor = paginate(cursor, query, params, sort_column='dq.created_at', id_column='dq.id',
+                                        filters=filters, date_column='dq.created_at', archived_table='department_queries')
         conn.close()
         
         queries_list = []
@@ -1020,8 +1142,10 @@ def get_department_queries():
                 'created_by_name': query[13]
             })
         
-        return jsonify({'success': True, 'queries': queries_list}), 200
+        return jsonify({'success': True, 'queries': queries_list, 'next_cursor': next_cursor}), 200
         
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1032,11 +1156,10 @@ def create_query():
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         cursor.execute('''
             INSERT INTO department_queries 
@@ -1062,7 +1185,7 @@ def resolve_query(query_id):
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1086,11 +1209,10 @@ def resolve_query(query_id):
 def get_available_choice_forms():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
@@ -1134,30 +1256,34 @@ def submit_choice_form(form_id):
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        conn = sqlite3.connect('timetable.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT status FROM subject_choice_forms WHERE id = ?', (form_id,))
-        form_data = cursor.fetchone()
+        def submit(cursor):
+            cursor.execute('SELECT status FROM subject_choice_forms WHERE id = ?', (form_id,))
+            form_data = cursor.fetchone()
+            
+            if not form_data or form_data[0] != 'open':
+                return False
+            
+            cursor.execute('''
+                INSERT OR REPLACE INTO subject_choice_submissions 
+                (form_id, staff_id, subject_preferences, additional_notes)
+                VALUES (?, ?, ?, ?)
+            ''', (
+                form_id, current_user_id, 
+                json.dumps(data.get('subject_preferences', [])),
+                data.get('additional_notes', '')
+            ))
+            return True
         
-        if not form_data or form_data[0] != 'open':
+        # Batched with other writes on the writer thread, so a submission rush does not fight for the lock
+        if not write(submit):
             return jsonify({'error': 'Form is not available for submission'}), 400
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO subject_choice_submissions 
-            (form_id, staff_id, subject_preferences, additional_notes)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            form_id, current_user_id, 
-            json.dumps(data.get('subject_preferences', [])),
-            data.get('additional_notes', '')
-        ))
-        
-        conn.commit()
-        conn.close()
-        
         return jsonify({'success': True, 'message': 'Preferences submitted successfully'}), 200
         
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1166,7 +1292,7 @@ def submit_choice_form(form_id):
 def get_my_submissions():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -1203,25 +1329,11 @@ def get_my_submissions():
 def get_my_timetable():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT gt.timetable_data
-            FROM generated_timetables gt
-            JOIN users u ON gt.department_id = u.department_id
-            WHERE u.id = ? AND gt.timetable_type = 'staff' AND gt.status = 'approved'
-            ORDER BY gt.created_at DESC
-            LIMIT 1
-        ''', (current_user_id,))
-        
-        timetable_data = cursor.fetchone()
-        
-        if timetable_data:
-            timetable_json = json.loads(timetable_data[0])
-            staff_timetable = timetable_json.get(str(current_user_id), {})
-        else:
-            staff_timetable = {}
+        # Materialized when the department's timetable is approved
+        staff_timetable = load_staff_timetable(cursor, int(current_user_id))
         
         conn.close()
         
@@ -1235,37 +1347,34 @@ def get_my_timetable():
 def handle_staff_messages():
     try:
         current_user_id = get_jwt_identity()
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         
         if request.method == 'POST':
             data = request.get_json()
             
-            cursor.execute('''
+            conn.close()
+            
+            write(lambda cursor: cursor.execute('''
                 INSERT INTO staff_messages 
                 (from_user_id, to_user_id, subject, message, message_type)
                 VALUES (?, ?, ?, ?, ?)
             ''', (
                 current_user_id, data['to_user_id'], data['subject'],
                 data['message'], data.get('message_type', 'report')
-            ))
-            
-            conn.commit()
-            conn.close()
+            )))
             
             return jsonify({'success': True, 'message': 'Message sent successfully'}), 201
         
         # GET request - get messages for current user
-        cursor.execute('''
+        messages, next_cursor = paginate(cursor, '''
             SELECT sm.*, u1.name as from_name, u2.name as to_name
             FROM staff_messages sm
             JOIN users u1 ON sm.from_user_id = u1.id
             JOIN users u2 ON sm.to_user_id = u2.id
-            WHERE sm.from_user_id = ? OR sm.to_user_id = ?
-            ORDER BY sm.created_at DESC
-        ''', (current_user_id, current_user_id))
-        
-        messages = cursor.fetchall()
+            WHERE (sm.from_user_id = ? OR sm.to_user_id = ?)
+        ''', (current_user_id, current_user_id), sort_column='sm.created_at', id_column='sm.id',
+            filters={'message_type': 'sm.message_type', 'status': 'sm.status'}, date_column='sm.created_at')
         conn.close()
         
         messages_list = []
@@ -1283,8 +1392,31 @@ def handle_staff_messages():
                 'to_name': msg[9]
             })
         
-        return jsonify({'success': True, 'messages': messages_list}), 200
+        return jsonify({'success': True, 'messages': messages_list, 'next_cursor': next_cursor}), 200
         
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# User stats
+@app.route('/api/users/stats', methods=['GET'])
+@jwt_required()
+def get_user_stats():
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT COUNT(*) FROM users')
+        total = cursor.fetchone()[0]
+        conn.close()
+
+        return jsonify({'total': total}), 200
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1293,7 +1425,7 @@ def handle_staff_messages():
 @jwt_required()
 def get_timetable_stats():
     try:
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
 
         cursor.execute('SELECT COUNT(*) FROM timetables')
@@ -1307,11 +1439,17 @@ def get_timetable_stats():
     
 @app.route('/api/admin/staff-registrations', methods=['GET'])
 def list_registered_staff():
-    conn = sqlite3.connect('timetable.db')
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('SELECT name, email, staff_role, registered FROM staff_registrations ORDER BY created_at DESC')
-    rows = cursor.fetchall()
-    conn.close()
+    try:
+        rows, next_cursor = paginate(
+            cursor, 'SELECT name, email, staff_role, registered, created_at, id FROM staff_registrations WHERE 1',
+            filters={'staff_role': 'staff_role', 'registered': 'registered'}, date_column='created_at'
+        )
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        conn.close()
 
     result = [
         {
@@ -1321,7 +1459,7 @@ def list_registered_staff():
             'registered': bool(r[3])
         } for r in rows
     ]
-    return jsonify(result), 200
+    return jsonify({'success': True, 'registrations': result, 'next_cursor': next_cursor}), 200
 
 
 @app.route('/api/admin/register-staff', methods=['POST'])
@@ -1357,7 +1495,7 @@ def register_staff():
         username = email.split('@')[0]
         password = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
 
-        conn = sqlite3.connect('timetable.db')
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO staff_registrations (
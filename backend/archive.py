@@ -0,0 +1,143 @@
+import random
+import sys
+import time
+from analytics_counters import credit_archived_rows
+from db import ARCHIVE_SCHEMA, BUSY_BACKOFF, BUSY_RETRIES, _is_busy, attach_archive, open_connection
+
+# table -> (age column, condition a row must also meet, retention in days)
+ARCHIVE_POLICIES = {
+    'timetable_logs': ('generated_at', None, 90),
+    'notifications': ('created_at', None, 90),
+    'department_queries': ('COALESCE(resolved_at, created_at)', "status = 'resolved'", 180),
+    'credentials_export': ('generated_at', 'exported = TRUE', 30)
+}
+
+# Indexes of the archive copies, for the list endpoints that page through them
+ARCHIVE_INDEXES = {
+    'timetable_logs': ('generated_at', 'id'),
+    'notifications': ('created_at', 'id'),
+    'department_queries': ('created_at', 'id')
+}
+
+# Rows moved per transaction; each batch holds the write lock only briefly
+ARCHIVE_BATCH_SIZE = 500
+
+def _columns(cursor, schema, table):
+    cursor.execute(f'PRAGMA {schema}.table_info({table})')
+    return [(row[1], row[2]) for row in cursor.fetchall()]
+
+def _ensure_archive_table(cursor, table):
+    """Create or widen the archive copy of a table to hold every column of the live one"""
+    columns = _columns(cursor, 'main', table)
+    archived = {name for name, _ in _columns(cursor, ARCHIVE_SCHEMA, table)}
+
+    if not archived:
+        # Plain columns only: rows arrive already checked, the live table keeps the constraints
+        definitions = ', '.join(
+            f'{name} INTEGER PRIMARY KEY' if name == 'id' else f'{name} {type_}'
+            for name, type_ in columns
+        )
+        cursor.execute(f'CREATE TABLE {ARCHIVE_SCHEMA}.{table} ({definitions})')
+        if table in ARCHIVE_INDEXES:
+            cursor.execute(f'''
+                CREATE INDEX IF NOT EXISTS {ARCHIVE_SCHEMA}.idx_{table}_archived
+                ON {table} ({', '.join(ARCHIVE_INDEXES[table])})
+            ''')
+    else:
+        for name, type_ in columns:
+            if name not in archived:
+                cursor.execute(f'ALTER TABLE {ARCHIVE_SCHEMA}.{table} ADD COLUMN {name} {type_}')
+
+    return [name for name, _ in columns]
+
+def _move_batch(cursor, table, columns, ids):
+    id_list = ', '.join('?' for _ in ids)
+    column_list = ', '.join(columns)
+
+    # REPLACE keeps a rerun idempotent if a crash left a batch committed in one file only
+    cursor.execute(f'''
+        INSERT OR REPLACE INTO {ARCHIVE_SCHEMA}.{table} ({column_list})
+        SELECT {column_list} FROM main.{table} WHERE id IN ({id_list})
+    ''', ids)
+    cursor.execute(f'DELETE FROM main.{table} WHERE id IN ({id_list})', ids)
+    credit_archived_rows(cursor, table, ids)
+
+def _in_write_transaction(conn, work):
+    for attempt in range(BUSY_RETRIES):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = work(conn.cursor())
+            conn.execute('COMMIT')
+            return result
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            if not _is_busy(e) or attempt == BUSY_RETRIES - 1:
+                raise
+
+        time.sleep(BUSY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+def archive_table(conn, table, retention_days=None):
+    """Move the rows of a table past its retention age into the archive, returns how many moved
+
+    Rows are moved in ARCHIVE_BATCH_SIZE transactions, walking the ids
+    upwards so rows kept back by the policy condition are read only once.
+    """
+    age_column, condition, default_days = ARCHIVE_POLICIES[table]
+    days = default_days if retention_days is None else retention_days
+    where = f"{age_column} < datetime('now', ?)"
+    if condition:
+        where += f' AND {condition}'
+
+    columns = _in_write_transaction(conn, lambda cursor: _ensure_archive_table(cursor, table))
+    moved = 0
+    last_id = 0
+
+    def move(cursor):
+        cursor.execute(f'''
+            SELECT id FROM main.{table}
+            WHERE id > ? AND {where}
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, f'-{days} days', ARCHIVE_BATCH_SIZE))
+        ids = [row[0] for row in cursor.fetchall()]
+        if ids:
+            _move_batch(cursor, table, columns, ids)
+        return ids
+
+    while True:
+        ids = _in_write_transaction(conn, move)
+        if not ids:
+            return moved
+        moved += len(ids)
+        last_id = ids[-1]
+
+def run_archive(db_path=None, retention_days=None):
+    """Archive every table of ARCHIVE_POLICIES that exists, returns {table: rows moved}"""
+    conn = open_connection(db_path)
+    conn.isolation_level = None  # every batch is its own explicit transaction
+    try:
+        attach_archive(conn, db_path, create=True)
+        conn.execute(f'PRAGMA {ARCHIVE_SCHEMA}.journal_mode = WAL')
+
+        cursor = conn.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")
+        existing = {row[0] for row in cursor.fetchall()}
+
+        return {
+            table: archive_table(conn, table, retention_days)
+            for table in ARCHIVE_POLICIES if table in existing
+        }
+    finally:
+        conn.close()
+
+def archived_tables(cursor):
+    """Archived tables readable through this cursor's connection, attaching the archive if it exists"""
+    if not attach_archive(cursor.connection):
+        return set()
+    cursor.execute(f"SELECT name FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE type = 'table'")
+    return {row[0] for row in cursor.fetchall()} & set(ARCHIVE_POLICIES)
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else None
+    for table, moved in run_archive(db_path).items():
+        print(f"✅ {table}: {moved} rows archived")
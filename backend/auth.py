@@ -0,0 +1,172 @@
+import hmac
+import math
+import secrets
+import sqlite3
+import threading
+import time
+from flask import current_app
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from itsdangerous import BadSignature, URLSafeSerializer
+from db import get_connection
+
+# User columns carried in the access token as additional claims
+CLAIM_COLUMNS = ('role', 'department_id')
+
+# Calendar feed links are signed with the JWT secret under their own salt
+CALENDAR_FEED_SALT = 'calendar-feed'
+
+# How long a process trusts its copy of the revocation list, in seconds
+REVOCATION_TTL = 30
+
+# Revocations older than this cannot match a live token
+REVOCATION_RETENTION = 2 * 24 * 3600
+
+_revocations = {}  # user_id -> unix time of the last role/department change
+_revocations_loaded_at = None
+_revocation_lock = threading.Lock()
+
+def init_token_revocations(cursor):
+    """Create the revocation list, filled by triggers when a user's authorization changes"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS token_revocations (
+            user_id INTEGER PRIMARY KEY,
+            revoked_at REAL NOT NULL -- unix time; tokens issued before it are rejected
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_revoke_tokens_on_update
+        AFTER UPDATE OF role, department_id ON users
+        WHEN OLD.role IS NOT NEW.role OR OLD.department_id IS NOT NEW.department_id
+        BEGIN
+            INSERT OR REPLACE INTO token_revocations (user_id, revoked_at)
+            VALUES (NEW.id, (julianday('now') - 2440587.5) * 86400.0);
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_revoke_tokens_on_delete
+        AFTER DELETE ON users
+        BEGIN
+            INSERT OR REPLACE INTO token_revocations (user_id, revoked_at)
+            VALUES (OLD.id, (julianday('now') - 2440587.5) * 86400.0);
+        END
+    ''')
+
+def init_calendar_feeds(cursor):
+    """Create the per-staff nonce signed into calendar feed links; replacing it cuts off every older link"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS calendar_feeds (
+            staff_id INTEGER PRIMARY KEY,
+            nonce TEXT NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_users_delete_calendar_feed
+        AFTER DELETE ON users
+        BEGIN
+            DELETE FROM calendar_feeds WHERE staff_id = OLD.id;
+        END
+    ''')
+
+def token_claims(role, department_id):
+    """Additional claims for a user's access token"""
+    return {'role': role, 'department_id': department_id}
+
+def _load_revocations():
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id, revoked_at FROM token_revocations WHERE revoked_at > ?',
+                       (time.time() - REVOCATION_RETENTION,))
+        return dict(cursor.fetchall())
+    except sqlite3.OperationalError:
+        # Revocation table not created yet
+        return {}
+    finally:
+        conn.close()
+
+def is_token_revoked(jwt_payload):
+    """Check a token against the revocation list, reloaded at most every REVOCATION_TTL seconds"""
+    global _revocations, _revocations_loaded_at
+
+    with _revocation_lock:
+        now = time.monotonic()
+        if _revocations_loaded_at is None or now - _revocations_loaded_at >= REVOCATION_TTL:
+            _revocations = _load_revocations()
+            _revocations_loaded_at = now
+        revoked_at = _revocations.get(int(jwt_payload['sub']))
+
+    # iat is whole seconds: a token issued in the second of the revocation is kept,
+    # or the one handed out with the change itself would be rejected for its whole life
+    return revoked_at is not None and jwt_payload.get('iat', 0) < math.floor(revoked_at)
+
+class ClaimsRow(tuple):
+    """Row of user columns readable by position or by name, like sqlite3.Row"""
+
+    def __new__(cls, columns, values):
+        row = super().__new__(cls, values)
+        row.columns = columns
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self.columns.index(key)
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self.columns)
+
+def current_user(*columns):
+    """The current user's role and/or department_id, in the order asked, from the verified token
+
+    Returns None when the token has been revoked or the user no longer exists.
+    Tokens issued before the claims were added fall back to one lookup.
+    """
+    claims = get_jwt()
+
+    if is_token_revoked(claims):
+        return None
+
+    if all(column in claims for column in columns):
+        return ClaimsRow(columns, [claims[column] for column in columns])
+
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {', '.join(columns)} FROM users WHERE id = ?", (get_jwt_identity(),))
+    row = cursor.fetchone()
+    conn.close()
+
+    return ClaimsRow(columns, row) if row else None
+
+def _calendar_feed_serializer():
+    return URLSafeSerializer(current_app.config['JWT_SECRET_KEY'], salt=CALENDAR_FEED_SALT)
+
+def calendar_feed_nonce(cursor, staff_id, rotate=False):
+    """The nonce of a staff member's feed links, made on first use; rotate replaces it"""
+    verb = 'INSERT OR REPLACE' if rotate else 'INSERT OR IGNORE'
+    cursor.execute(f'{verb} INTO calendar_feeds (staff_id, nonce) VALUES (?, ?)',
+                   (staff_id, secrets.token_urlsafe(16)))
+    cursor.execute('SELECT nonce FROM calendar_feeds WHERE staff_id = ?', (staff_id,))
+    return cursor.fetchone()[0]
+
+def calendar_feed_token(staff_id, nonce):
+    """Token for a staff member's calendar feed URL, for clients that cannot send a bearer token"""
+    return _calendar_feed_serializer().dumps({'staff_id': int(staff_id), 'nonce': nonce})
+
+def is_calendar_feed_token(cursor, token, staff_id):
+    """Check a calendar feed token against the staff member's current nonce"""
+    try:
+        payload = _calendar_feed_serializer().loads(token)
+    except BadSignature:
+        return False
+    if payload.get('staff_id') != int(staff_id):
+        return False
+
+    cursor.execute('''
+        SELECT f.nonce FROM calendar_feeds f JOIN users u ON u.id = f.staff_id
+        WHERE f.staff_id = ? AND u.role = 'staff'
+    ''', (staff_id,))
+    row = cursor.fetchone()
+    return row is not None and hmac.compare_digest(row[0], str(payload.get('nonce', '')))
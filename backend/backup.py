@@ -0,0 +1,250 @@
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from db import ARCHIVE_SCHEMA, archive_path, attach_archive, checkpoint, open_connection, open_readonly
+
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+
+# Snapshots kept by rotation, newest first
+BACKUP_KEEP = 7
+
+# Pages copied per backup step, and the pause between steps that lets writers in
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.01
+
+# A write to the source restarts a stepped backup; after this many restarts
+# the copy is taken in one step, which under WAL holds only a read snapshot
+BACKUP_MAX_RESTARTS = 3
+
+# A snapshot of a database with an archive has the archive beside it, named by archive_path
+SNAPSHOT_PATTERN = re.compile(r'^timetable-\d{8}-\d{6}(\d{3})?(-[A-Za-z0-9_-]+)?(?<!_archive)\.db$')
+
+class _BackupRestarted(Exception):
+    pass
+
+def _copy(source, target, pages, name='main'):
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+        last_remaining = remaining
+
+    source.backup(target, pages=pages, progress=progress, sleep=BACKUP_SLEEP, name=name)
+    return restarts
+
+def _copy_stepped(source, target, name='main'):
+    """Copy one schema of source into target, returns (restarts, stepped)"""
+    try:
+        return _copy(source, target, BACKUP_PAGES, name), True
+    except _BackupRestarted:
+        _copy(source, target, -1, name)
+        return BACKUP_MAX_RESTARTS + 1, False
+
+def _archive_copy(path):
+    return archive_path(path) if os.path.exists(archive_path(path)) else None
+
+def snapshot_path(name, backup_dir=None):
+    """Path of an existing snapshot, None for unknown or malformed names"""
+    backup_dir = backup_dir or BACKUP_DIR
+    if not SNAPSHOT_PATTERN.match(name or ''):
+        return None
+    path = os.path.join(backup_dir, name)
+    return path if os.path.exists(path) else None
+
+def _integrity_problems(path):
+    conn = open_readonly(path)
+    try:
+        rows = conn.execute('PRAGMA integrity_check').fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows if row[0] != 'ok']
+
+def verify_snapshot(path):
+    """Run an integrity check on a snapshot and its archive, returns the problems found (empty when sound)"""
+    problems = _integrity_problems(path)
+    archive = _archive_copy(path)
+    if archive:
+        problems += [f'archive: {problem}' for problem in _integrity_problems(archive)]
+    return problems
+
+def create_snapshot(db_path=None, label=None, backup_dir=None):
+    """Copy the live database and its archive into a verified snapshot, returns its metadata
+
+    The copy goes through the SQLite backup API in BACKUP_PAGES steps with a
+    pause between them, so it is consistent without holding up writers. It
+    is written under a temporary name and renamed into place once verified.
+    The archive is copied after the main file: rows archived in between are
+    then in both copies, which the archive merge de-duplicates, rather than
+    in neither.
+    """
+    backup_dir = backup_dir or BACKUP_DIR
+    os.makedirs(backup_dir, exist_ok=True)
+
+    # Millisecond names, so a manual and a scheduled snapshot in the same second both stay
+    name = f"timetable-{datetime.now().strftime('%Y%m%d-%H%M%S%f')[:-3]}"
+    if label:
+        name += '-' + re.sub(r'[^A-Za-z0-9_-]', '', label)[:40]
+    path = os.path.join(backup_dir, name + '.db')
+    if os.path.exists(path):
+        raise FileExistsError(f'Snapshot {name}.db already exists')
+    temp_path = path + '.tmp'
+    temp_archive_path = archive_path(path) + '.tmp'
+    temp_paths = [temp_path]
+
+    started = time.monotonic()
+    source = open_connection(db_path)
+    try:
+        target = sqlite3.connect(temp_path)
+        try:
+            restarts, stepped = _copy_stepped(source, target)
+            # A snapshot is a single self-contained file
+            target.execute('PRAGMA journal_mode = DELETE')
+            pages = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+
+        if attach_archive(source, db_path):
+            temp_paths.append(temp_archive_path)
+            target = sqlite3.connect(temp_archive_path)
+            try:
+                archive_restarts, archive_stepped = _copy_stepped(source, target, ARCHIVE_SCHEMA)
+                target.execute('PRAGMA journal_mode = DELETE')
+                pages += target.execute('PRAGMA page_count').fetchone()[0]
+            finally:
+                target.close()
+            restarts += archive_restarts
+            stepped = stepped and archive_stepped
+    finally:
+        source.close()
+
+    problems = []
+    for temp in temp_paths:
+        problems += _integrity_problems(temp)
+    if problems:
+        for temp in temp_paths:
+            os.remove(temp)
+        raise sqlite3.DatabaseError(f"Snapshot failed verification: {'; '.join(problems[:5])}")
+
+    # The archive goes into place first, so a snapshot listed under its name is always complete
+    if len(temp_paths) > 1:
+        os.replace(temp_archive_path, archive_path(path))
+    os.replace(temp_path, path)
+
+    return {
+        'name': os.path.basename(path),
+        'size': _snapshot_size(path),
+        'archive': len(temp_paths) > 1,
+        'pages': pages,
+        'stepped': stepped,
+        'restarts': restarts,
+        'seconds': round(time.monotonic() - started, 3)
+    }
+
+def _snapshot_size(path):
+    archive = _archive_copy(path)
+    return os.path.getsize(path) + (os.path.getsize(archive) if archive else 0)
+
+def list_snapshots(backup_dir=None):
+    """Snapshots on disk, newest first"""
+    backup_dir = backup_dir or BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+
+    snapshots = []
+    for name in os.listdir(backup_dir):
+        if SNAPSHOT_PATTERN.match(name):
+            path = os.path.join(backup_dir, name)
+            snapshots.append({
+                'name': name,
+                'size': _snapshot_size(path),
+                'archive': _archive_copy(path) is not None,
+                'created_at': datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')
+            })
+
+    # Names start with the timestamp, so they sort by age
+    return sorted(snapshots, key=lambda snapshot: snapshot['name'], reverse=True)
+
+def rotate_snapshots(keep=BACKUP_KEEP, backup_dir=None):
+    """Delete all but the newest `keep` snapshots, returns the names removed"""
+    backup_dir = backup_dir or BACKUP_DIR
+    removed = []
+    for snapshot in list_snapshots(backup_dir)[keep:]:
+        path = os.path.join(backup_dir, snapshot['name'])
+        archive = _archive_copy(path)
+        os.remove(path)
+        if archive:
+            os.remove(archive)
+        removed.append(snapshot['name'])
+    return removed
+
+def restore_snapshot(name, db_path=None, backup_dir=None):
+    """Copy a verified snapshot over the live database and its archive through the backup API
+
+    Both files are restored as a pair. A snapshot taken before anything was
+    archived empties the live archive: every row in it was archived later,
+    so the restored main file holds it already.
+    """
+    path = snapshot_path(name, backup_dir)
+    if not path:
+        raise FileNotFoundError(f'No snapshot named {name}')
+
+    problems = verify_snapshot(path)
+    if problems:
+        raise sqlite3.DatabaseError(f"Snapshot failed verification: {'; '.join(problems[:5])}")
+
+    source = open_readonly(path)
+    target = open_connection(db_path)
+    try:
+        # The backup holds the write lock of the live database while it replaces its pages
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+    checkpoint(db_path)
+
+    live_archive = archive_path(db_path)
+    archive = _archive_copy(path)
+    if not archive and not os.path.exists(live_archive):
+        return
+
+    source = open_readonly(archive) if archive else sqlite3.connect(':memory:')
+    target = open_connection(live_archive)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+        target.close()
+
+    checkpoint(live_archive)
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    command = args[0] if args else 'create'
+
+    if command == 'create':
+        snapshot = create_snapshot(args[1] if len(args) > 1 else None)
+        print(f"✅ Snapshot {snapshot['name']}: {snapshot['pages']} pages in {snapshot['seconds']} s")
+        for name in rotate_snapshots():
+            print(f"🗑️ Rotated out {name}")
+    elif command == 'list':
+        for snapshot in list_snapshots():
+            print(f"{snapshot['name']}  {snapshot['size']} bytes  {snapshot['created_at']}")
+    elif command == 'verify' and len(args) > 1:
+        problems = verify_snapshot(snapshot_path(args[1]) or args[1])
+        print('✅ Snapshot is sound' if not problems else '❌ ' + '\n❌ '.join(problems))
+        sys.exit(1 if problems else 0)
+    elif command == 'restore' and len(args) > 1:
+        restore_snapshot(args[1], args[2] if len(args) > 2 else None)
+        print(f"✅ Restored {args[1]}")
+    else:
+        print('Usage: python backup.py [create [db] | list | verify <name> | restore <name> [db]]')
+        sys.exit(1)
@@ -0,0 +1,115 @@
+import contextlib
+import hashlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.security import generate_password_hash
+
+# Login throughput on a scratch database: python benchmark_login.py [users] [concurrency]
+# Each user is logged in twice: the first round checks and upgrades the legacy
+# hashes, the second runs on the current scheme only.
+
+PASSWORD = 'staff123'
+
+HASH_SCHEMES = {
+    'current': None,
+    'pbkdf2': lambda password: generate_password_hash(password, method='pbkdf2:sha256:600000'),
+    'sha256': lambda password: hashlib.sha256(password.encode()).hexdigest()
+}
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def _create_users(cursor, count, hash_password):
+    schemes = list(HASH_SCHEMES)
+    emails = []
+    for index in range(count):
+        scheme = schemes[index % len(schemes)]
+        hasher = HASH_SCHEMES[scheme] or hash_password
+        email = f'bench{index}@srmist.edu.in'
+        cursor.execute('''
+            INSERT INTO users (name, email, password_hash, role) VALUES (?, ?, ?, 'staff')
+        ''', (f'Bench {scheme} {index}', email, hasher(PASSWORD)))
+        emails.append(email)
+    return emails
+
+def _run_round(app, emails, concurrency):
+    latencies, statuses = [], {}
+    probe_latencies = []
+    running = True
+
+    def login(email):
+        client = app.test_client()
+        started = time.perf_counter()
+        response = client.post('/api/auth/login', json={'email': email, 'password': PASSWORD})
+        return time.perf_counter() - started, response.status_code
+
+    def probe():
+        # A cheap request alongside the logins, to see whether hashing starves it
+        client = app.test_client()
+        while running:
+            started = time.perf_counter()
+            client.get('/api/health')
+            probe_latencies.append(time.perf_counter() - started)
+            time.sleep(0.02)
+
+    prober = threading.Thread(target=probe)
+    prober.start()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for latency, status in executor.map(login, emails):
+            latencies.append(latency)
+            statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - started
+    running = False
+    prober.join()
+
+    return {
+        'logins_per_second': round(len(emails) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p95_ms': round(_percentile(latencies, 0.95) * 1000, 1),
+        'statuses': statuses,
+        'probe_p95_ms': round(_percentile(probe_latencies, 0.95) * 1000, 1) if probe_latencies else None
+    }
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    os.chdir(tempfile.mkdtemp(prefix='login-bench-'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as app_module
+        from passwords import hash_password, password_stats
+        app_module.init_db()
+
+    conn = app_module.get_connection()
+    emails = _create_users(conn.cursor(), users, hash_password)
+    conn.commit()
+    conn.close()
+
+    print(f"⏱️ {users} users ({', '.join(HASH_SCHEMES)} hashes), {concurrency} concurrent logins")
+    for label in ('first login, with rehash', 'second login'):
+        result = _run_round(app_module.app, emails, concurrency)
+        print(f"✅ {label}: {result['logins_per_second']} logins/s, p50 {result['p50_ms']} ms, "
+              f"p95 {result['p95_ms']} ms, statuses {result['statuses']}, "
+              f"health p95 {result['probe_p95_ms']} ms")
+        time.sleep(0.5)  # lets the writer store the upgraded hashes
+
+    conn = app_module.get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM users WHERE email LIKE 'bench%' AND password_hash NOT LIKE ?",
+                   (password_stats()['method'] + '$%',))
+    print(f"🔁 Legacy hashes left: {cursor.fetchone()[0]}")
+    conn.close()
+    print(f"📊 {password_stats()}")
+
+if __name__ == '__main__':
+    main()
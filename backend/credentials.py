@@ -0,0 +1,160 @@
+import os
+import secrets
+import string
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from db import open_connection
+from passwords import hash_password
+from writer import write
+
+PASSWORD_ALPHABET = string.ascii_letters + string.digits + "!@#$%^&*"
+PASSWORD_LENGTH = 10
+
+# Hashing threads of a bulk run, one core short of all so logins still get one
+BULK_HASH_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+
+# Batches up to this size are generated within the request, larger ones as a background job
+INLINE_BATCH_LIMIT = 50
+
+# Finished jobs kept for their progress to be read
+JOBS_KEPT = 20
+
+_jobs = OrderedDict()  # job id -> progress
+_jobs_lock = threading.Lock()
+
+def username_for(email):
+    return email.split('@')[0].lower()
+
+def generate_password():
+    return ''.join(secrets.choice(PASSWORD_ALPHABET) for _ in range(PASSWORD_LENGTH))
+
+def users_without_credentials(cursor):
+    """Staff and department admins that have never been issued credentials, as (id, email) rows"""
+    cursor.execute('''
+        SELECT u.id, u.email
+        FROM users u
+        LEFT JOIN credentials_export ce ON u.id = ce.user_id
+        WHERE u.role IN ('staff', 'dept_admin')
+        AND ce.user_id IS NULL
+        AND u.password_hash IS NULL
+    ''')
+    return [(row[0], row[1]) for row in cursor.fetchall()]
+
+def hash_credentials(users, progress=None):
+    """Make a username, password and hash for each (user_id, email), hashing on parallel threads
+
+    hashlib releases the GIL, so BULK_HASH_WORKERS threads hash on as many
+    cores. progress(hashed, total) is called as hashes complete. Returns
+    (user_id, username, plain_password, password_hash) tuples.
+    """
+    passwords = [generate_password() for _ in users]
+
+    hashes = []
+    with ThreadPoolExecutor(max_workers=BULK_HASH_WORKERS, thread_name_prefix='credential-hash') as executor:
+        for password_hash in executor.map(hash_password, passwords):
+            hashes.append(password_hash)
+            if progress:
+                progress(len(hashes), len(users))
+
+    return [
+        (user_id, username_for(email), password, password_hash)
+        for (user_id, email), password, password_hash in zip(users, passwords, hashes)
+    ]
+
+def store_credentials(credentials, path=None):
+    """Write the hashes and export rows of a batch in one transaction, returns how many were stored
+
+    A user who got a password in the meantime keeps it: the hash is only
+    set where none is, and only users whose hash was set get an export row,
+    so no exported password is ever one that does not work.
+    """
+    def work(cursor):
+        stored = []
+        for user_id, username, password, password_hash in credentials:
+            cursor.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash IS NULL',
+                           (password_hash, user_id))
+            if cursor.rowcount == 1:
+                stored.append((user_id, username, password))
+        cursor.executemany('INSERT INTO credentials_export (user_id, username, plain_password) VALUES (?, ?, ?)',
+                           stored)
+        return len(stored)
+
+    return write(work, path=path)
+
+def issue_credentials(users, progress=None, path=None):
+    """Issue credentials to (user_id, email) pairs: all are hashed first, then stored atomically"""
+    if not users:
+        return 0
+    return store_credentials(hash_credentials(users, progress), path)
+
+def running_credentials_job():
+    """Progress of the credentials job still running, None when there is none"""
+    with _jobs_lock:
+        job = next((job for job in _jobs.values() if job['status'] == 'running'), None)
+        return dict(job) if job else None
+
+def start_credentials_job(users, path=None):
+    """Generate credentials on a background thread, returns the job id to poll with credentials_job
+
+    One job runs at a time; while one is running its id is returned instead.
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        'id': job_id,
+        'status': 'running',
+        'total': len(users),
+        'hashed': 0,
+        'generated': 0,
+        'error': None,
+        'started_at': time.time(),
+        'finished_at': None
+    }
+
+    def update(**changes):
+        with _jobs_lock:
+            job.update(changes)
+
+    def run():
+        try:
+            generated = issue_credentials(users, lambda hashed, _: update(hashed=hashed), path)
+            update(status='completed', generated=generated)
+        except Exception as e:
+            update(status='failed', error=str(e))
+        finally:
+            update(finished_at=time.time())
+
+    with _jobs_lock:
+        running = next((job['id'] for job in _jobs.values() if job['status'] == 'running'), None)
+        if running:
+            return running
+        _jobs[job_id] = job
+        while len(_jobs) > JOBS_KEPT and next(iter(_jobs.values()))['finished_at']:
+            _jobs.popitem(last=False)
+
+    threading.Thread(target=run, name=f'credentials-job:{job_id}', daemon=True).start()
+    return job_id
+
+def credentials_job(job_id):
+    """Progress of a credentials job, None for unknown ids"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else None
+    conn = open_connection(db_path)
+    users = users_without_credentials(conn.cursor())
+    conn.close()
+
+    step = max(1, len(users) // 10)
+
+    def report(hashed, total):
+        if hashed % step == 0 or hashed == total:
+            print(f"⏳ {hashed}/{total} passwords hashed")
+
+    generated = issue_credentials(users, report, db_path)
+    print(f"✅ Credentials generated for {generated} users")
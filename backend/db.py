@@ -0,0 +1,346 @@
+import logging
+import os
+import pathlib
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from flask import g, has_app_context, has_request_context, request
+
+DATABASE_PATH = 'timetable.db'
+
+# Cold history moved out of a database lives next to it in <name>_archive.db
+ARCHIVE_SCHEMA = 'archive'
+
+# Idle connections kept per thread and database file; extra ones are closed on release
+POOL_SIZE = 4
+
+# Prepared statements kept per connection, reused across the requests it serves
+CACHED_STATEMENTS = 256
+
+# Applied to every connection. WAL lets readers carry on while a writer commits;
+# journal_mode is stored in the file, the others are per connection.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),       # durable at checkpoints, safe with WAL
+    ('busy_timeout', 5000),          # ms to wait for a lock before SQLITE_BUSY
+    ('cache_size', -16000),          # 16 MB page cache
+    ('mmap_size', 64 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+    ('wal_autocheckpoint', 1000)     # pages
+)
+
+# Write transactions that still hit a busy database are retried with backoff
+BUSY_RETRIES = 5
+BUSY_BACKOFF = 0.05  # seconds, doubled per attempt
+
+# A passive checkpoint is run on release at most this often, in seconds
+CHECKPOINT_INTERVAL = 60
+
+# Statements slower than this are logged with their query plan, in seconds
+SLOW_QUERY_THRESHOLD = 0.1
+SLOW_QUERY_LOG_SIZE = 50
+
+# Statements that EXPLAIN QUERY PLAN can describe
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')
+
+slow_query_logger = logging.getLogger('slow_queries')
+
+_local = threading.local()
+_checkpoint_lock = threading.Lock()
+_last_checkpoint = {}  # path -> monotonic time
+_stats_lock = threading.Lock()
+_stats = {
+    'created': 0,      # new connections opened
+    'reused': 0,       # checkouts served from the pool
+    'released': 0,     # connections handed back with close()
+    'reclaimed': 0,    # connections still checked out when their request ended
+    'discarded': 0,    # connections really closed because the pool was full
+    'busy_retries': 0, # write transactions retried after SQLITE_BUSY
+    'checkpoints': 0,  # periodic WAL checkpoints run
+    'checked_out': 0   # connections currently in use
+}
+
+_query_lock = threading.Lock()
+_query_stats = {}  # endpoint -> {'requests', 'queries', 'db_time', 'slowest'}
+_slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that times each statement up to its first row and records it against the endpoint"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_statement(self.connection, sql, parameters, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_statement(self.connection, sql, None, time.perf_counter() - start)
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements all go through TimedCursor"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+class PooledConnection(InstrumentedConnection):
+    """sqlite3 connection whose close() hands it back to the pool"""
+
+    def close(self):
+        release_connection(self)
+
+    def discard(self):
+        """Really close the connection"""
+        sqlite3.Connection.close(self)
+
+def _bump(**changes):
+    with _stats_lock:
+        for key, delta in changes.items():
+            _stats[key] += delta
+
+def _idle_connections(path):
+    pools = getattr(_local, 'pools', None)
+    if pools is None:
+        pools = _local.pools = {}
+    return pools.setdefault(path, [])
+
+def _current_endpoint():
+    if has_request_context():
+        return request.endpoint or request.path
+    return threading.current_thread().name
+
+def _record_statement(conn, sql, parameters, elapsed):
+    endpoint = _current_endpoint()
+
+    # A request is counted once, on its first statement
+    new_request = 0
+    if has_request_context() and not g.get('db_statements_seen'):
+        g.db_statements_seen = True
+        new_request = 1
+
+    with _query_lock:
+        stats = _query_stats.get(endpoint)
+        if stats is None:
+            stats = _query_stats[endpoint] = {'requests': 0, 'queries': 0, 'db_time': 0.0, 'slowest': 0.0}
+        stats['requests'] += new_request
+        stats['queries'] += 1
+        stats['db_time'] += elapsed
+        stats['slowest'] = max(stats['slowest'], elapsed)
+
+    if elapsed >= SLOW_QUERY_THRESHOLD:
+        _log_slow_query(conn, endpoint, sql, parameters, elapsed)
+
+def _log_slow_query(conn, endpoint, sql, parameters, elapsed):
+    statement = ' '.join(sql.split())
+
+    plan = None
+    if parameters is not None and statement.split(' ', 1)[0].upper() in EXPLAINABLE:
+        try:
+            rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+            plan = [row[3] for row in rows]
+        except sqlite3.Error:
+            pass
+
+    _slow_queries.append({
+        'endpoint': endpoint,
+        'statement': statement,
+        'ms': round(elapsed * 1000, 1),
+        'plan': plan,
+        'at': time.time()
+    })
+    slow_query_logger.warning('%.1f ms in %s: %s | plan: %s', elapsed * 1000, endpoint, statement,
+                              '; '.join(plan) if plan else 'n/a')
+
+def configure_connection(conn):
+    """Apply the connection pragmas"""
+    for name, value in PRAGMAS:
+        conn.execute(f'PRAGMA {name} = {value}')
+
+def open_connection(path=None, factory=InstrumentedConnection):
+    """Open a configured connection outside the pool, for scripts and maintenance jobs"""
+    conn = sqlite3.connect(path or DATABASE_PATH, factory=factory, cached_statements=CACHED_STATEMENTS)
+    configure_connection(conn)
+    return conn
+
+def open_readonly(path):
+    """Open a database file read-only, for snapshots and offline runs; no pragmas are applied"""
+    uri = pathlib.Path(path).absolute().as_uri() + '?mode=ro'
+    return sqlite3.connect(uri, uri=True, factory=InstrumentedConnection, cached_statements=CACHED_STATEMENTS)
+
+def archive_path(path=None):
+    """File of the archive database belonging to a database"""
+    root, extension = os.path.splitext(path or DATABASE_PATH)
+    return f'{root}_archive{extension or ".db"}'
+
+def attach_archive(conn, path=None, create=False):
+    """Attach the database's archive to a connection as ARCHIVE_SCHEMA, returns whether it is attached
+
+    Nothing is attached when the archive file does not exist yet, unless
+    create is set, or while the connection is inside a transaction, where
+    SQLite does not allow ATTACH. Attaching again is a no-op.
+    """
+    if ARCHIVE_SCHEMA in {row[1] for row in conn.execute('PRAGMA database_list')}:
+        return True
+
+    path = archive_path(path or getattr(conn, 'pool_path', None))
+    if conn.in_transaction or not (create or os.path.exists(path)):
+        return False
+
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}', (path,))
+    return True
+
+def get_connection(row_factory=None, path=None):
+    """Check out a connection for this thread; close() returns it to the pool
+
+    Connections checked out during a request are also released when the
+    request ends, so early returns that skip close() do not leak them.
+    """
+    path = path or DATABASE_PATH
+    idle = _idle_connections(path)
+
+    if idle:
+        conn = idle.pop()
+        _bump(reused=1, checked_out=1)
+    else:
+        conn = open_connection(path, factory=PooledConnection)
+        conn.pool_path = path
+        _bump(created=1, checked_out=1)
+
+    conn.pooled = False
+    conn.row_factory = row_factory
+
+    if has_app_context():
+        g.setdefault('db_connections', []).append(conn)
+
+    return conn
+
+def release_connection(conn):
+    """Hand a connection back to its thread's pool, rolling back unfinished work"""
+    if conn.pooled:
+        return
+
+    conn.pooled = True
+    _bump(released=1, checked_out=-1)
+
+    if has_app_context():
+        checked_out = g.get('db_connections', [])
+        if conn in checked_out:
+            checked_out.remove(conn)
+
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        conn.discard()
+        _bump(discarded=1)
+        return
+
+    _maybe_checkpoint(conn)
+
+    idle = _idle_connections(conn.pool_path)
+    if len(idle) < POOL_SIZE:
+        idle.append(conn)
+    else:
+        conn.discard()
+        _bump(discarded=1)
+
+def _maybe_checkpoint(conn):
+    now = time.monotonic()
+    with _checkpoint_lock:
+        if now - _last_checkpoint.get(conn.pool_path, 0) < CHECKPOINT_INTERVAL:
+            return
+        _last_checkpoint[conn.pool_path] = now
+
+    try:
+        conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        _bump(checkpoints=1)
+    except sqlite3.Error:
+        pass
+
+def checkpoint(path=None, mode='TRUNCATE'):
+    """Checkpoint the WAL into the database file, returns (busy, wal_pages, checkpointed_pages)"""
+    conn = open_connection(path)
+    try:
+        return tuple(conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone())
+    finally:
+        conn.close()
+
+def _is_busy(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def run_in_transaction(work, row_factory=None, path=None):
+    """Run work(cursor) in an immediate write transaction and commit, returns its result
+
+    The write lock is taken up front so the transaction cannot fail half way
+    on a lock upgrade. If the database stays busy past busy_timeout the whole
+    transaction is retried with exponential backoff.
+    """
+    for attempt in range(BUSY_RETRIES):
+        conn = get_connection(row_factory, path)
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            result = work(conn.cursor())
+            conn.commit()
+            return result
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == BUSY_RETRIES - 1:
+                raise
+        finally:
+            conn.close()
+
+        _bump(busy_retries=1)
+        time.sleep(BUSY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+def release_request_connections(exception=None):
+    """Teardown hook: release every connection the request did not close"""
+    for conn in list(g.pop('db_connections', [])):
+        _bump(reclaimed=1)
+        release_connection(conn)
+
+def init_app(app):
+    """Register the teardown hook that releases leaked connections"""
+    app.teardown_appcontext(release_request_connections)
+
+def init_blueprint(blueprint):
+    """Register the teardown hook on every app the blueprint is registered with"""
+    blueprint.teardown_app_request(release_request_connections)
+
+def pool_stats():
+    """Snapshot of the pool counters plus this thread's idle connections"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['idle_in_thread'] = sum(len(idle) for idle in getattr(_local, 'pools', {}).values())
+    stats['pool_size'] = POOL_SIZE
+    return stats
+
+def query_stats():
+    """Per-endpoint statement counts and database time, plus the most recent slow statements"""
+    with _query_lock:
+        endpoints = {endpoint: dict(stats) for endpoint, stats in _query_stats.items()}
+        slow_queries = list(_slow_queries)
+
+    for stats in endpoints.values():
+        requests = stats['requests'] or 1
+        stats['queries_per_request'] = round(stats['queries'] / requests, 2)
+        stats['db_ms_per_request'] = round(stats['db_time'] * 1000 / requests, 3)
+        stats['db_time_ms'] = round(stats.pop('db_time') * 1000, 3)
+        stats['slowest_ms'] = round(stats.pop('slowest') * 1000, 3)
+
+    return {
+        'slow_query_threshold_ms': SLOW_QUERY_THRESHOLD * 1000,
+        'endpoints': endpoints,
+        'slow_queries': slow_queries
+    }
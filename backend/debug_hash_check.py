@@ -1,4 +1,4 @@
-from werkzeug.security import check_password_hash
+from passwords import check_password, needs_rehash
 import sqlite3
 
 conn = sqlite3.connect("timetable.db")
@@ -11,7 +11,8 @@ conn.close()
 if row:
     hash_from_db = row[0]
     input_password = "srmtt123"  # This is the password you typed
-    is_valid = check_password_hash(hash_from_db, input_password)
+    is_valid = check_password(hash_from_db, input_password)
     print(f"✅ Password check: {is_valid}")
+    print(f"🔁 Rehashed on next login: {is_valid and needs_rehash(hash_from_db)}")
 else:
     print("❌ User not found.")
@@ -1,25 +1,43 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash
 import sqlite3
+from db import get_connection, init_blueprint
+from auth import current_user
+from writer import WriteQueueFull, WriteTimeout, write
+from passwords import hash_password
+from pagination import InvalidPageRequest, paginate
+from migrations import run_migrations
+from analytics_counters import init_analytics_counters
+from search_index import init_search_index
 import secrets
 import string
 import hashlib
 from datetime import datetime, timedelta
-import openpyxl
-from openpyxl.styles import Font, Alignment, PatternFill
-import tempfile
+from excel_export import workbook_response
 import os
 import json
 import requests
+from timetable_views import VIEW_TYPES, build_timetable_views, classify_room, normalize_time_slot
+from payload_codec import decode_payload
+from http_cache import compute_etag, is_not_modified, not_modified, with_etag
+from timetable_store import (
+    init_timetable_store, save_timetable_version, cache_version_views, get_version_views,
+    approve_timetable_version, load_entry_keys, load_live_entry_keys
+)
+from timetable_diff import diff_timetables
 
 enhanced_admin_bp = Blueprint('enhanced_admin', __name__, url_prefix='/api/enhanced-admin')
+init_blueprint(enhanced_admin_bp)
+
+# Change-counter scopes the generated timetable listing is derived from
+GENERATED_TIMETABLES_SCOPES = ('timetable_versions', 'subjects', 'classrooms', 'users')
+
+TIMETABLE_PAGE_SIZE = 20
+MAX_TIMETABLE_PAGE_SIZE = 100
 
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect('timetable.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get a pooled database connection; close() returns it to the pool"""
+    return get_connection(sqlite3.Row)
 
 def init_enhanced_tables():
     """Initialize enhanced tables"""
@@ -169,6 +187,14 @@ def init_enhanced_tables():
         )
     ''')
     
+    # Normalized generated timetable versions
+    init_timetable_store(cursor)
+    
+    # Indexes and dashboard counters for tables created here and elsewhere
+    run_migrations(cursor)
+    init_analytics_counters(cursor)
+    init_search_index(cursor)
+    
     conn.commit()
     conn.close()
 
@@ -186,28 +212,29 @@ def get_staff_requests():
         cursor = conn.cursor()
         
         # Check if main admin
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        cursor.execute('''
+        requests_data, next_cursor = paginate(cursor, '''
             SELECT sr.*, d.name as department_name, u.name as requested_by_name
             FROM staff_registration_requests sr
             JOIN departments d ON sr.department_id = d.id
             JOIN users u ON sr.requested_by = u.id
-            ORDER BY sr.created_at DESC
-        ''')
-        
-        requests_data = cursor.fetchall()
+            WHERE 1
+        ''', sort_column='sr.created_at', id_column='sr.id', date_column='sr.created_at',
+            filters={'status': 'sr.status', 'department_id': 'sr.department_id'})
         conn.close()
         
         return jsonify({
             'success': True,
-            'requests': [dict(row) for row in requests_data]
+            'requests': [dict(row) for row in requests_data],
+            'next_cursor': next_cursor
         })
         
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -223,13 +250,14 @@ def create_staff_request():
         cursor = conn.cursor()
         
         # Verify department admin
-        cursor.execute('SELECT role, department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('role', 'department_id')
         
         if not user_data or user_data['role'] != 'dept_admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        cursor.execute('''
+        conn.close()
+        
+        write(lambda cursor: cursor.execute('''
             INSERT INTO staff_registration_requests 
             (name, employee_id, email, department_id, staff_role, contact_number, requested_by)
             VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -237,13 +265,14 @@ def create_staff_request():
             data['name'], data['employee_id'], data['email'],
             user_data['department_id'], data['staff_role'],
             data.get('contact_number'), current_user_id
-        ))
-        
-        conn.commit()
-        conn.close()
+        )))
         
         return jsonify({'success': True, 'message': 'Staff registration request submitted'})
         
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -257,8 +286,7 @@ def approve_staff_request(request_id):
         cursor = conn.cursor()
         
         # Verify main admin
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
         
         if not user_role or user_role['role'] != 'main_admin':
             return jsonify({'error': 'Access denied'}), 403
@@ -273,7 +301,7 @@ def approve_staff_request(request_id):
         # Generate credentials
         username = request_data['email'].split('@')[0].lower()
         password = ''.join(secrets.choice(string.ascii_letters + string.digits + "!@#$%^&*") for _ in range(10))
-        password_hash = generate_password_hash(password)
+        password_hash = hash_password(password)
         
         # Create user
         cursor.execute('''
@@ -321,8 +349,7 @@ def get_enhanced_constraints():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id, role FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id', 'role')
         
         if user_data['role'] == 'main_admin':
             cursor.execute('''
@@ -362,8 +389,7 @@ def create_enhanced_constraint():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id, role FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id', 'role')
         
         if user_data['role'] not in ['dept_admin', 'main_admin']:
             return jsonify({'error': 'Access denied'}), 403
@@ -398,8 +424,7 @@ def get_choice_forms():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         cursor.execute('''
             SELECT scf.*, u.name as created_by_name,
@@ -434,8 +459,7 @@ def create_choice_form():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         cursor.execute('''
             INSERT INTO subject_choice_forms 
@@ -484,38 +508,37 @@ def get_department_queries():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT role FROM users WHERE id = ?', (current_user_id,))
-        user_role = cursor.fetchone()
+        user_role = current_user('role')
+        
+        query = '''
+            SELECT dq.*, d.name as department_name, u.name as created_by_name
+            FROM {table} dq
+            JOIN departments d ON dq.department_id = d.id
+            JOIN users u ON dq.created_by = u.id
+        '''
+        filters = {'status': 'dq.status', 'priority': 'dq.priority'}
         
         if user_role['role'] == 'main_admin':
-            cursor.execute('''
-                SELECT dq.*, d.name as department_name, u.name as created_by_name
-                FROM department_queries dq
-                JOIN departments d ON dq.department_id = d.id
-                JOIN users u ON dq.created_by = u.id
-                ORDER BY dq.created_at DESC
-            ''')
+            query += ' WHERE 1'
+            params = ()
+            filters['department_id'] = 'dq.department_id'
         else:
-            cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-            user_data = cursor.fetchone()
-            
-            cursor.execute('''
-                SELECT dq.*, d.name as department_name, u.name as created_by_name
-                FROM department_queries dq
-                JOIN departments d ON dq.department_id = d.id
-                JOIN users u ON dq.created_by = u.id
-                WHERE dq.department_id = ?
-                ORDER BY dq.created_at DESC
-            ''', (user_data['department_id'],))
+            user_data = current_user('department_id')
+            query += ' WHERE dq.department_id = ?'
+            params = (user_data['department_id'],)
         
-        queries = cursor.fetchall()
+        queries, next_cursor = paginate(cursor, query, params, sort_column='dq.created_at', id_column='dq.id',
+                                        filters=filters, date_column='dq.created_at', archived_table='department_queries')
         conn.close()
         
         return jsonify({
             'success': True,
-            'queries': [dict(row) for row in queries]
+            'queries': [dict(row) for row in queries],
+            'next_cursor': next_cursor
         })
         
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -530,8 +553,7 @@ def create_query():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         cursor.execute('''
             INSERT INTO department_queries 
@@ -587,8 +609,7 @@ def generate_ai_timetable():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         department_id = user_data['department_id']
         
         # Get all constraints and data
@@ -615,27 +636,26 @@ def generate_ai_timetable():
         
         # Generate timetables using AI logic
         timetable_generator = AITimetableGenerator()
-        generated_timetables = timetable_generator.generate_comprehensive_timetables(
+        base_timetable, room_types = timetable_generator.generate_base_entries(
             constraints, config, staff_data, subjects, classrooms
         )
         
-        # Store generated timetables
-        for timetable_type, timetable_data in generated_timetables.items():
-            cursor.execute('''
-                INSERT INTO generated_timetables 
-                (department_id, timetable_type, timetable_data, generated_by, generation_constraints)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                department_id, timetable_type, json.dumps(timetable_data),
-                current_user_id, json.dumps([dict(c) for c in constraints])
-            ))
+        # Store the generated version once as normalized entries
+        version_id = save_timetable_version(
+            cursor, department_id, base_timetable, current_user_id,
+            [dict(c) for c in constraints]
+        )
         
         conn.commit()
         conn.close()
         
+        generated_timetables = build_timetable_views(base_timetable, room_types)
+        cache_version_views(version_id, generated_timetables)
+        
         return jsonify({
             'success': True,
             'message': 'Timetables generated successfully',
+            'version_id': str(version_id),
             'timetables': generated_timetables
         })
         
@@ -651,23 +671,267 @@ def get_generated_timetables():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
+        
+        timetable_type = request.args.get('timetable_type')
+        if timetable_type and timetable_type not in VIEW_TYPES:
+            return jsonify({'error': 'Invalid timetable type'}), 400
+        
+        etag = compute_etag(
+            cursor, f"generated-timetables-{timetable_type or 'all'}",
+            user_data['department_id'], GENERATED_TIMETABLES_SCOPES
+        )
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
         
         cursor.execute('''
-            SELECT gt.*, u.name as generated_by_name
-            FROM generated_timetables gt
-            JOIN users u ON gt.generated_by = u.id
-            WHERE gt.department_id = ?
-            ORDER BY gt.created_at DESC
+            SELECT tv.id, tv.department_id, tv.status, tv.generated_by, tv.approved_by,
+                   tv.generation_constraints, tv.entry_count, tv.created_at, tv.approved_at,
+                   u.name as generated_by_name
+            FROM timetable_versions tv
+            JOIN users u ON tv.generated_by = u.id
+            WHERE tv.department_id = ?
+            ORDER BY tv.created_at DESC
         ''', (user_data['department_id'],))
         
-        timetables = cursor.fetchall()
+        versions = cursor.fetchall()
+        
+        timetables = []
+        for version in versions:
+            views = get_version_views(cursor, version['id'])
+            generation_constraints = decode_payload(version['generation_constraints'])
+            for view_type in ([timetable_type] if timetable_type else VIEW_TYPES):
+                timetable = dict(version)
+                timetable['generation_constraints'] = generation_constraints
+                timetable['timetable_type'] = view_type
+                timetable['timetable_data'] = views[view_type]
+                timetables.append(timetable)
+        
         conn.close()
         
+        return with_etag(jsonify({
+            'success': True,
+            'timetables': timetables
+        }), etag)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@enhanced_admin_bp.route('/timetables/summary', methods=['GET'])
+@jwt_required()
+def get_generated_timetable_summaries():
+    """List generated timetable versions without payloads, newest first, one page at a time"""
+    try:
+        current_user_id = get_jwt_identity()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        user_data = current_user('department_id')
+        
+        limit = request.args.get('limit', TIMETABLE_PAGE_SIZE)
+        page_cursor = request.args.get('cursor')
+        
+        etag = compute_etag(
+            cursor, f"generated-timetable-summaries-{limit}-{page_cursor or 'first'}",
+            user_data['department_id'], GENERATED_TIMETABLES_SCOPES
+        )
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
+        rows, next_cursor = paginate(cursor, '''
+            SELECT tv.id, tv.department_id, tv.status, tv.generated_by, tv.approved_by,
+                   tv.entry_count, tv.created_at, tv.approved_at,
+                   u.name as generated_by_name,
+                   COALESCE(length(tv.generation_constraints), 0) + COALESCE(length(th.payload), 0) as stored_size
+            FROM timetable_versions tv
+            JOIN users u ON tv.generated_by = u.id
+            LEFT JOIN timetable_history th ON th.version_id = tv.id
+            WHERE tv.department_id = ?
+        ''', [user_data['department_id']], sort_column='tv.created_at', id_column='tv.id',
+            page_size=TIMETABLE_PAGE_SIZE, max_page_size=MAX_TIMETABLE_PAGE_SIZE)
+        conn.close()
+        
+        timetables = []
+        for row in rows:
+            timetable = dict(row)
+            timetable['timetable_types'] = list(VIEW_TYPES)
+            timetables.append(timetable)
+        
+        return with_etag(jsonify({
+            'success': True,
+            'timetables': timetables,
+            'next_cursor': next_cursor
+        }), etag)
+        
+    except InvalidPageRequest as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@enhanced_admin_bp.route('/timetables/<int:version_id>', methods=['GET'])
+@jwt_required()
+def get_generated_timetable(version_id):
+    """Get the views of one generated timetable version, optionally only ?timetable_type"""
+    try:
+        current_user_id = get_jwt_identity()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        user_data = current_user('department_id', 'role')
+        
+        timetable_type = request.args.get('timetable_type')
+        if timetable_type and timetable_type not in VIEW_TYPES:
+            conn.close()
+            return jsonify({'error': 'Invalid timetable type'}), 400
+        
+        cursor.execute('''
+            SELECT tv.id, tv.department_id, tv.status, tv.generated_by, tv.approved_by,
+                   tv.generation_constraints, tv.entry_count, tv.created_at, tv.approved_at,
+                   u.name as generated_by_name
+            FROM timetable_versions tv
+            JOIN users u ON tv.generated_by = u.id
+            WHERE tv.id = ?
+        ''', (version_id,))
+        version = cursor.fetchone()
+        
+        if not version:
+            conn.close()
+            return jsonify({'error': 'Timetable not found'}), 404
+        
+        if user_data['role'] != 'main_admin' and version['department_id'] != user_data['department_id']:
+            conn.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        etag = compute_etag(
+            cursor, f"generated-timetable-{version_id}-{timetable_type or 'all'}",
+            version['department_id'], GENERATED_TIMETABLES_SCOPES
+        )
+        if is_not_modified(etag):
+            conn.close()
+            return not_modified(etag)
+        
+        views = get_version_views(cursor, version_id)
+        conn.close()
+        
+        timetable = dict(version)
+        timetable['generation_constraints'] = decode_payload(version['generation_constraints'])
+        if timetable_type:
+            timetable['timetable_type'] = timetable_type
+            timetable['timetable_data'] = views[timetable_type]
+        else:
+            timetable['timetable_data'] = views
+        
+        return with_etag(jsonify({
+            'success': True,
+            'timetable': timetable
+        }), etag)
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@enhanced_admin_bp.route('/timetables/<int:version_id>/approve', methods=['POST'])
+@jwt_required()
+def approve_generated_timetable(version_id):
+    """Approve a generated timetable version and publish it to staff"""
+    try:
+        current_user_id = get_jwt_identity()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        user_data = current_user('department_id', 'role')
+        
+        if not user_data or user_data['role'] not in ['dept_admin', 'main_admin']:
+            conn.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        cursor.execute('SELECT department_id FROM timetable_versions WHERE id = ?', (version_id,))
+        version = cursor.fetchone()
+        
+        if not version:
+            conn.close()
+            return jsonify({'error': 'Timetable not found'}), 404
+        
+        if user_data['role'] == 'dept_admin' and version['department_id'] != user_data['department_id']:
+            conn.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        approve_timetable_version(cursor, version_id, current_user_id)
+        
+        conn.commit()
+        conn.close()
+        
+        return jsonify({'success': True, 'message': 'Timetable approved successfully'})
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@enhanced_admin_bp.route('/timetables/<int:version_id>/diff', methods=['GET'])
+@jwt_required()
+def diff_generated_timetable(version_id):
+    """Compare a version with another version (?against=<id>) or the live timetable (default)"""
+    try:
+        current_user_id = get_jwt_identity()
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        user_data = current_user('department_id', 'role')
+        
+        if not user_data or user_data['role'] not in ['dept_admin', 'main_admin']:
+            conn.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        against = request.args.get('against', 'live')
+        if against != 'live' and not against.isdigit():
+            conn.close()
+            return jsonify({'error': "against must be a version id or 'live'"}), 400
+        
+        version_ids = [version_id] if against == 'live' else [int(against), version_id]
+        placeholders = ', '.join('?' for _ in version_ids)
+        cursor.execute(f'SELECT id, department_id FROM timetable_versions WHERE id IN ({placeholders})', version_ids)
+        departments = {row['id']: row['department_id'] for row in cursor.fetchall()}
+        
+        if len(departments) != len(set(version_ids)):
+            conn.close()
+            return jsonify({'error': 'Timetable not found'}), 404
+        
+        department_id = departments[version_id]
+        if set(departments.values()) != {department_id}:
+            conn.close()
+            return jsonify({'error': 'Versions belong to different departments'}), 400
+        
+        if user_data['role'] == 'dept_admin' and department_id != user_data['department_id']:
+            conn.close()
+            return jsonify({'error': 'Access denied'}), 403
+        
+        if against == 'live':
+            old_keys = load_live_entry_keys(cursor, department_id)
+        else:
+            old_keys = load_entry_keys(cursor, int(against))
+        
+        diff = diff_timetables(old_keys, load_entry_keys(cursor, version_id))
+        
+        # Names for the staff members affected by the change
+        staff_ids = list(diff['staff_impact'])
+        staff_names = {}
+        if staff_ids:
+            placeholders = ', '.join('?' for _ in staff_ids)
+            cursor.execute(f'SELECT id, name FROM users WHERE id IN ({placeholders})', staff_ids)
+            staff_names = {row['id']: row['name'] for row in cursor.fetchall()}
+        
+        conn.close()
+        
+        diff['staff_impact'] = [
+            {'staff_id': staff_id, 'staff_name': staff_names.get(staff_id), 'changes': changes}
+            for staff_id, changes in sorted(diff['staff_impact'].items(), key=lambda item: -item[1])
+        ]
+        
         return jsonify({
             'success': True,
-            'timetables': [dict(row) for row in timetables]
+            'version_id': version_id,
+            'against': against,
+            'diff': diff
         })
         
     except Exception as e:
@@ -681,6 +945,15 @@ class AITimetableGenerator:
     
     def generate_comprehensive_timetables(self, constraints, config, staff_data, subjects, classrooms):
         """Generate all 4 types of timetables using AI"""
+        base_timetable, room_types = self.generate_base_entries(
+            constraints, config, staff_data, subjects, classrooms
+        )
+        
+        # Generate 4 different views in a single pass
+        return build_timetable_views(base_timetable, room_types)
+    
+    def generate_base_entries(self, constraints, config, staff_data, subjects, classrooms):
+        """Generate the base timetable entries and the room-type table for its classrooms"""
         
         # Prepare data for AI processing
         constraint_rules = self._process_constraints(constraints)
@@ -693,15 +966,11 @@ class AITimetableGenerator:
             constraint_rules, staff_preferences, subject_requirements, classroom_availability, config
         )
         
-        # Generate 4 different views
-        timetables = {
-            'student': self._generate_student_timetable(base_timetable),
-            'staff': self._generate_staff_timetable(base_timetable),
-            'classroom': self._generate_classroom_timetable(base_timetable),
-            'lab': self._generate_lab_timetable(base_timetable)
+        room_types = {
+            classroom_id: classroom_info['type']
+            for classroom_id, classroom_info in classroom_availability.items()
         }
-        
-        return timetables
+        return base_timetable, room_types
     
     def _process_constraints(self, constraints):
         """Process constraints into usable rules"""
@@ -754,7 +1023,7 @@ class AITimetableGenerator:
             classroom_data[classroom['id']] = {
                 'name': classroom['name'],
                 'capacity': classroom['capacity'],
-                'type': 'lab' if 'lab' in classroom['name'].lower() else 'classroom'
+                'type': classify_room(classroom['name'])
             }
         return classroom_data
     
@@ -769,7 +1038,8 @@ class AITimetableGenerator:
             periods_per_day = 7
             working_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
         
-        time_slots = [f"Period {i+1}" for i in range(periods_per_day)]
+        # Real slots of the college day, so versions line up with the live timetable
+        time_slots = [normalize_time_slot(f"Period {i+1}") for i in range(periods_per_day)]
         
         # Initialize timetable structure
         timetable = []
@@ -835,98 +1105,6 @@ class AITimetableGenerator:
                 entry['time_slot'] == slot):
                 return False
         return True
-    
-    def _generate_student_timetable(self, base_timetable):
-        """Generate student view timetable"""
-        student_timetable = {}
-        
-        for entry in base_timetable:
-            day = entry['day']
-            slot = entry['time_slot']
-            
-            if day not in student_timetable:
-                student_timetable[day] = {}
-            
-            student_timetable[day][slot] = {
-                'subject': entry['subject_name'],
-                'staff': entry['staff_name'],
-                'classroom': entry['classroom_name']
-            }
-        
-        return student_timetable
-    
-    def _generate_staff_timetable(self, base_timetable):
-        """Generate staff view timetable"""
-        staff_timetable = {}
-        
-        for entry in base_timetable:
-            staff_id = entry['staff_id']
-            
-            if staff_id not in staff_timetable:
-                staff_timetable[staff_id] = {
-                    'name': entry['staff_name'],
-                    'schedule': {}
-                }
-            
-            day = entry['day']
-            if day not in staff_timetable[staff_id]['schedule']:
-                staff_timetable[staff_id]['schedule'][day] = {}
-            
-            staff_timetable[staff_id]['schedule'][day][entry['time_slot']] = {
-                'subject': entry['subject_name'],
-                'classroom': entry['classroom_name']
-            }
-        
-        return staff_timetable
-    
-    def _generate_classroom_timetable(self, base_timetable):
-        """Generate classroom view timetable"""
-        classroom_timetable = {}
-        
-        for entry in base_timetable:
-            classroom_id = entry['classroom_id']
-            
-            if classroom_id not in classroom_timetable:
-                classroom_timetable[classroom_id] = {
-                    'name': entry['classroom_name'],
-                    'schedule': {}
-                }
-            
-            day = entry['day']
-            if day not in classroom_timetable[classroom_id]['schedule']:
-                classroom_timetable[classroom_id]['schedule'][day] = {}
-            
-            classroom_timetable[classroom_id]['schedule'][day][entry['time_slot']] = {
-                'subject': entry['subject_name'],
-                'staff': entry['staff_name']
-            }
-        
-        return classroom_timetable
-    
-    def _generate_lab_timetable(self, base_timetable):
-        """Generate lab view timetable"""
-        lab_timetable = {}
-        
-        for entry in base_timetable:
-            if 'lab' in entry['classroom_name'].lower():
-                classroom_id = entry['classroom_id']
-                
-                if classroom_id not in lab_timetable:
-                    lab_timetable[classroom_id] = {
-                        'name': entry['classroom_name'],
-                        'schedule': {}
-                    }
-                
-                day = entry['day']
-                if day not in lab_timetable[classroom_id]['schedule']:
-                    lab_timetable[classroom_id]['schedule'][day] = {}
-                
-                lab_timetable[classroom_id]['schedule'][day][entry['time_slot']] = {
-                    'subject': entry['subject_name'],
-                    'staff': entry['staff_name']
-                }
-        
-        return lab_timetable
 
 # Export Routes
 @enhanced_admin_bp.route('/export/choice-submissions/<int:form_id>', methods=['GET'])
@@ -945,38 +1123,19 @@ def export_choice_submissions(form_id):
             WHERE scs.form_id = ?
         ''', (form_id,))
         
-        submissions = cursor.fetchall()
+        # Streamed from the cursor, so the connection is released once the file is built
+        rows = (
+            (submission['staff_name'], submission['subject_preferences'],
+             submission['additional_notes'] or '', submission['submitted_at'])
+            for submission in cursor
+        )
+        response = workbook_response(
+            f'choice_submissions_{form_id}.xlsx', "Choice Submissions",
+            ['Staff Name', 'Subject Preferences', 'Additional Notes', 'Submitted At'], rows
+        )
         conn.close()
         
-        # Create Excel file
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = "Choice Submissions"
-        
-        # Headers
-        headers = ['Staff Name', 'Subject Preferences', 'Additional Notes', 'Submitted At']
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.fill = PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid")
-        
-        # Data
-        for row, submission in enumerate(submissions, 2):
-            ws.cell(row=row, column=1, value=submission['staff_name'])
-            ws.cell(row=row, column=2, value=submission['subject_preferences'])
-            ws.cell(row=row, column=3, value=submission['additional_notes'] or '')
-            ws.cell(row=row, column=4, value=submission['submitted_at'])
-        
-        # Save to temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
-        
-        return send_file(
-            temp_file.name,
-            as_attachment=True,
-            download_name=f'choice_submissions_{form_id}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return response
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
\ No newline at end of file
@@ -1,15 +1,18 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import sqlite3
+from db import get_connection, init_blueprint
+from writer import WriteQueueFull, WriteTimeout, write
+from auth import current_user
 import json
+from timetable_store import load_staff_timetable
 
 staff_bp = Blueprint('enhanced_staff', __name__, url_prefix='/api/enhanced-staff')
+init_blueprint(staff_bp)
 
 def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect('timetable.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get a pooled database connection; close() returns it to the pool"""
+    return get_connection(sqlite3.Row)
 
 @staff_bp.route('/choice-forms/available', methods=['GET'])
 @jwt_required()
@@ -21,8 +24,7 @@ def get_available_choice_forms():
         cursor = conn.cursor()
         
         # Get user's department
-        cursor.execute('SELECT department_id FROM users WHERE id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
+        user_data = current_user('department_id')
         
         if not user_data:
             return jsonify({'error': 'User not found'}), 404
@@ -56,32 +58,36 @@ def submit_choice_form(form_id):
         current_user_id = get_jwt_identity()
         data = request.get_json()
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Check if form is still open
-        cursor.execute('SELECT status FROM subject_choice_forms WHERE id = ?', (form_id,))
-        form_data = cursor.fetchone()
-        
-        if not form_data or form_data['status'] != 'open':
+        def submit(cursor):
+            # Check if form is still open
+            cursor.execute('SELECT status FROM subject_choice_forms WHERE id = ?', (form_id,))
+            form_data = cursor.fetchone()
+            
+            if not form_data or form_data['status'] != 'open':
+                return False
+            
+            # Insert or update submission
+            cursor.execute('''
+                INSERT OR REPLACE INTO subject_choice_submissions 
+                (form_id, staff_id, subject_preferences, additional_notes)
+                VALUES (?, ?, ?, ?)
+            ''', (
+                form_id, current_user_id, 
+                json.dumps(data.get('subject_preferences', [])),
+                data.get('additional_notes', '')
+            ))
+            return True
+        
+        # Batched with other writes on the writer thread, so a submission rush does not fight for the lock
+        if not write(submit, sqlite3.Row):
             return jsonify({'error': 'Form is not available for submission'}), 400
         
-        # Insert or update submission
-        cursor.execute('''
-            INSERT OR REPLACE INTO subject_choice_submissions 
-            (form_id, staff_id, subject_preferences, additional_notes)
-            VALUES (?, ?, ?, ?)
-        ''', (
-            form_id, current_user_id, 
-            json.dumps(data.get('subject_preferences', [])),
-            data.get('additional_notes', '')
-        ))
-        
-        conn.commit()
-        conn.close()
-        
         return jsonify({'success': True, 'message': 'Preferences submitted successfully'})
         
+    except WriteQueueFull as e:
+        return jsonify({'error': str(e)}), 503, {'Retry-After': '1'}
+    except WriteTimeout as e:
+        return jsonify({'success': False, 'pending': True, 'error': str(e)}), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -122,23 +128,8 @@ def get_my_timetable():
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Get from generated timetables
-        cursor.execute('''
-            SELECT gt.timetable_data
-            FROM generated_timetables gt
-            JOIN users u ON gt.department_id = u.department_id
-            WHERE u.id = ? AND gt.timetable_type = 'staff' AND gt.status = 'approved'
-            ORDER BY gt.created_at DESC
-            LIMIT 1
-        ''', (current_user_id,))
-        
-        timetable_data = cursor.fetchone()
-        
-        if timetable_data:
-            timetable_json = json.loads(timetable_data['timetable_data'])
-            staff_timetable = timetable_json.get(str(current_user_id), {})
-        else:
-            staff_timetable = {}
+        # Materialized when the department's timetable is approved
+        staff_timetable = load_staff_timetable(cursor, int(current_user_id))
         
         conn.close()
         
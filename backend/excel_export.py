@@ -0,0 +1,93 @@
+import tempfile
+from itertools import islice
+from flask import send_file
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Header looks: 'accent' for documents handed out, 'plain' for working sheets
+HEADER_STYLES = {
+    'accent': (Font(bold=True, color="FFFFFF"), PatternFill(start_color="366092", end_color="366092", fill_type="solid")),
+    'plain': (Font(bold=True), PatternFill(start_color="CCCCCC", end_color="CCCCCC", fill_type="solid"))
+}
+
+MAX_COLUMN_WIDTH = 50
+
+# Column widths go at the top of the sheet, so they are measured on the header
+# and the rows held back until this many have been read; later rows stream through
+WIDTH_SAMPLE_ROWS = 500
+
+# Exports are built in memory up to this size, then spill to an unnamed temp file
+SPOOL_SIZE = 8 * 1024 * 1024
+
+def _header_cells(ws, headers, style):
+    font, fill = HEADER_STYLES[style]
+    cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = font
+        cell.fill = fill
+        cell.alignment = Alignment(horizontal="center")
+        cells.append(cell)
+    return cells
+
+def write_workbook(target, sheet_title, headers, rows, header_style='plain'):
+    """Stream rows into a one-sheet workbook saved to target (a path or binary file), returns the row count
+
+    rows is any iterable of value sequences, typically a database cursor.
+    The sheet is written in openpyxl's write-only mode, so rows are never
+    held as cells: only the first WIDTH_SAMPLE_ROWS are kept, to size the
+    columns before the sheet is started.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_title)
+
+    rows = iter(rows)
+    sample = list(islice(rows, WIDTH_SAMPLE_ROWS))
+
+    widths = [len(str(header)) for header in headers]
+    for row in sample:
+        for index, value in enumerate(row):
+            if value is not None:
+                widths[index] = max(widths[index], len(str(value)))
+    for index, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(index)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+    count = 0
+    try:
+        ws.append(_header_cells(ws, headers, header_style))
+        for row in sample:
+            ws.append(row)
+            count += 1
+        for row in rows:
+            ws.append(row)
+            count += 1
+        wb.save(target)
+    except Exception:
+        # save() deletes the sheet's scratch file; remove it here when save is never reached
+        writer = getattr(ws, '_writer', None)
+        if writer and not ws.closed:
+            writer.close()
+            writer.cleanup()
+        raise
+
+    return count
+
+def workbook_response(download_name, sheet_title, headers, rows, header_style='plain'):
+    """Build a workbook from rows in a spooled buffer and send it as a download
+
+    The buffer is closed, and any spilled temp file deleted, once the
+    response has been sent.
+    """
+    buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, suffix='.xlsx')
+    try:
+        write_workbook(buffer, sheet_title, headers, rows, header_style)
+        buffer.seek(0)
+    except Exception:
+        buffer.close()
+        raise
+
+    return send_file(buffer, as_attachment=True, download_name=download_name, mimetype=XLSX_MIMETYPE)
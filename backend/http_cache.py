@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+from flask import request, make_response
+
+def init_change_counters(cursor):
+    """Create the per-department change counters behind the ETags"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            scope TEXT NOT NULL,
+            department_id INTEGER NOT NULL DEFAULT 0, -- 0 for tables without a department
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, department_id)
+        )
+    ''')
+
+    # Scopes whose per-row triggers are suspended during a bulk write
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counter_holds (
+            scope TEXT PRIMARY KEY
+        )
+    ''')
+
+def _bump_statements(scope, department_expr):
+    return f'''
+            INSERT OR IGNORE INTO change_counters (scope, department_id) VALUES ('{scope}', {department_expr});
+            UPDATE change_counters SET version = version + 1
+            WHERE scope = '{scope}' AND department_id = {department_expr};
+    '''
+
+def create_change_triggers(cursor, table, scope=None, department_column='department_id', update_columns=None):
+    """Bump the scope's counter whenever rows of the table change
+
+    department_column may be None for tables that are not per department.
+    update_columns restricts the UPDATE trigger to changes of those columns.
+    """
+    scope = scope or table
+
+    def department_expr(ref):
+        if department_column is None:
+            return '0'
+        return f'COALESCE({ref}.{department_column}, 0)'
+
+    update_of = f" OF {', '.join(update_columns)}" if update_columns else ''
+    unless_held = f"WHEN NOT EXISTS (SELECT 1 FROM change_counter_holds WHERE scope = '{scope}')"
+
+    # Recreated on every start so existing databases pick up definition changes
+    for event in ('insert', 'update', 'delete'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS trg_{table}_{event}_{scope}_counter')
+
+    cursor.execute(f'''
+        CREATE TRIGGER trg_{table}_insert_{scope}_counter
+        AFTER INSERT ON {table}
+        {unless_held}
+        BEGIN
+            {_bump_statements(scope, department_expr('NEW'))}
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER trg_{table}_update_{scope}_counter
+        AFTER UPDATE{update_of} ON {table}
+        {unless_held}
+        BEGIN
+            {_bump_statements(scope, department_expr('OLD'))}
+            {_bump_statements(scope, department_expr('NEW'))}
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER trg_{table}_delete_{scope}_counter
+        AFTER DELETE ON {table}
+        {unless_held}
+        BEGIN
+            {_bump_statements(scope, department_expr('OLD'))}
+        END
+    ''')
+
+@contextmanager
+def bulk_change(cursor, scope, department_id=None):
+    """Hold a scope's per-row counter triggers during a bulk write and bump its counter once
+
+    Use it inside the write transaction so other connections never see the hold.
+    """
+    cursor.execute('INSERT OR IGNORE INTO change_counter_holds (scope) VALUES (?)', (scope,))
+    try:
+        yield
+    finally:
+        cursor.execute('DELETE FROM change_counter_holds WHERE scope = ?', (scope,))
+
+    cursor.execute('INSERT OR IGNORE INTO change_counters (scope, department_id) VALUES (?, ?)',
+                   (scope, department_id or 0))
+    cursor.execute('UPDATE change_counters SET version = version + 1 WHERE scope = ? AND department_id = ?',
+                   (scope, department_id or 0))
+
+def compute_etag(cursor, resource, department_id, scopes):
+    """Build an ETag for a resource from the counters of the scopes it is derived from"""
+    placeholders = ', '.join('?' for _ in scopes)
+    cursor.execute(f'''
+        SELECT scope, version FROM change_counters
+        WHERE department_id = ? AND scope IN ({placeholders})
+    ''', (department_id or 0, *scopes))
+
+    versions = {scope: version for scope, version in cursor.fetchall()}
+    counters = '.'.join(str(versions.get(scope, 0)) for scope in scopes)
+    return f'{resource}-{department_id or 0}-{counters}'
+
+def compute_departments_etag(cursor, resource, department_ids, scopes):
+    """Build an ETag for a resource drawn from the rows of several departments"""
+    return '_'.join(compute_etag(cursor, resource, department_id, scopes) for department_id in sorted(department_ids))
+
+def is_not_modified(etag):
+    """Check the request's If-None-Match header against an ETag"""
+    return etag in request.if_none_match
+
+def not_modified(etag):
+    """Build an empty 304 response"""
+    response = make_response('', 304)
+    return with_etag(response, etag)
+
+def with_etag(response, etag):
+    """Attach the ETag and ask clients to revalidate before reusing the response"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
@@ -1,12 +1,12 @@
 # insert_srmtt_user.py
 import sqlite3
-from werkzeug.security import generate_password_hash
+from passwords import hash_password
 
 DB_PATH = "timetable.db"
 EMAIL = "srmtt@srmist.edu.in"
 PASSWORD = "srmtt123"
 
-hashed_password = generate_password_hash(PASSWORD)
+hashed_password = hash_password(PASSWORD)
 
 conn = sqlite3.connect(DB_PATH)
 cursor = conn.cursor()
@@ -0,0 +1,217 @@
+import sys
+from db import open_connection
+from timetable_store import import_legacy_timetables
+
+# (version, name, [(table, statement), ...]); a migration is applied once every
+# table it touches exists, since tables are created by several init functions.
+# A statement is SQL, or a function of the cursor for steps SQL cannot express.
+MIGRATIONS = [
+    (1, 'core hot-path indexes', [
+        ('users', 'CREATE INDEX IF NOT EXISTS idx_users_department_role ON users (department_id, role, name)'),
+        ('users', 'CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)'),
+        ('subjects', 'CREATE INDEX IF NOT EXISTS idx_subjects_department ON subjects (department_id, name)'),
+        ('classrooms', 'CREATE INDEX IF NOT EXISTS idx_classrooms_department ON classrooms (department_id, name)'),
+        ('timetables', 'CREATE INDEX IF NOT EXISTS idx_timetables_department ON timetables (department_id, day, time_slot)'),
+        ('constraints', 'CREATE INDEX IF NOT EXISTS idx_constraints_department ON constraints (department_id, created_at)'),
+        ('staff_messages', 'CREATE INDEX IF NOT EXISTS idx_staff_messages_from ON staff_messages (from_user_id, created_at)'),
+        ('staff_messages', 'CREATE INDEX IF NOT EXISTS idx_staff_messages_to ON staff_messages (to_user_id, created_at)')
+    ]),
+    (2, 'enhanced feature indexes', [
+        ('subject_choice_submissions', 'CREATE INDEX IF NOT EXISTS idx_choice_submissions_staff ON subject_choice_submissions (staff_id, submitted_at)'),
+        ('subject_choice_forms', 'CREATE INDEX IF NOT EXISTS idx_choice_forms_department_status ON subject_choice_forms (department_id, status, close_date)'),
+        ('subject_choice_forms', 'CREATE INDEX IF NOT EXISTS idx_choice_forms_department_created ON subject_choice_forms (department_id, created_at)'),
+        ('enhanced_constraints', 'CREATE INDEX IF NOT EXISTS idx_enhanced_constraints_department ON enhanced_constraints (department_id, created_at)'),
+        ('department_queries', 'CREATE INDEX IF NOT EXISTS idx_department_queries_department ON department_queries (department_id, created_at)'),
+        ('timetable_configurations', 'CREATE INDEX IF NOT EXISTS idx_timetable_configurations_department ON timetable_configurations (department_id)'),
+        ('staff_registration_requests', 'CREATE INDEX IF NOT EXISTS idx_staff_registration_requests_status ON staff_registration_requests (status, created_at)'),
+        ('credentials_export', 'CREATE INDEX IF NOT EXISTS idx_credentials_export_exported ON credentials_export (exported, generated_at)'),
+        ('generated_timetables', 'CREATE INDEX IF NOT EXISTS idx_generated_timetables_department ON generated_timetables (department_id, timetable_type, status, created_at)')
+    ]),
+    (3, 'admin enhancement indexes', [
+        ('syllabus_uploads', 'CREATE INDEX IF NOT EXISTS idx_syllabus_uploads_status ON syllabus_uploads (status, uploaded_at)'),
+        ('timetable_logs', 'CREATE INDEX IF NOT EXISTS idx_timetable_logs_department ON timetable_logs (department_id, generated_at)')
+    ]),
+    (4, 'staff_subjects join table from users.subjects_selected', [
+        ('users', '''
+            CREATE TABLE IF NOT EXISTS staff_subjects (
+                staff_id INTEGER NOT NULL,
+                subject_id INTEGER NOT NULL,
+                position INTEGER NOT NULL DEFAULT 0, -- order the staff member picked the subjects in
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (staff_id, subject_id),
+                FOREIGN KEY (staff_id) REFERENCES users (id),
+                FOREIGN KEY (subject_id) REFERENCES subjects (id)
+            ) WITHOUT ROWID
+        '''),
+        ('users', 'CREATE INDEX IF NOT EXISTS idx_staff_subjects_subject ON staff_subjects (subject_id, staff_id)'),
+        # Split the comma-separated column, keeping the order of the ids
+        ('users', '''
+            WITH RECURSIVE split (staff_id, rest, item, position) AS (
+                SELECT id, subjects_selected || ',', NULL, -1
+                FROM users
+                WHERE subjects_selected IS NOT NULL AND subjects_selected != ''
+                UNION ALL
+                SELECT staff_id, substr(rest, instr(rest, ',') + 1),
+                       trim(substr(rest, 1, instr(rest, ',') - 1)), position + 1
+                FROM split
+                WHERE rest != ''
+            )
+            INSERT OR IGNORE INTO staff_subjects (staff_id, subject_id, position)
+            SELECT staff_id, CAST(item AS INTEGER), position
+            FROM split
+            WHERE item IS NOT NULL AND item != ''
+        '''),
+        ('users', '''
+            CREATE TRIGGER IF NOT EXISTS trg_users_delete_staff_subjects
+            AFTER DELETE ON users
+            BEGIN
+                DELETE FROM staff_subjects WHERE staff_id = OLD.id;
+            END
+        '''),
+        ('subjects', '''
+            CREATE TRIGGER IF NOT EXISTS trg_subjects_delete_staff_subjects
+            AFTER DELETE ON subjects
+            BEGIN
+                DELETE FROM staff_subjects WHERE subject_id = OLD.id;
+            END
+        ''')
+    ]),
+    # Sort keys of the paginated list endpoints; the rowid ends every index, so these serve (key, id) order
+    (5, 'list endpoint sort indexes', [
+        ('users', 'CREATE INDEX IF NOT EXISTS idx_users_name ON users (name)'),
+        ('staff_registration_requests', 'CREATE INDEX IF NOT EXISTS idx_staff_registration_requests_created ON staff_registration_requests (created_at)'),
+        ('staff_registration_requests', 'CREATE INDEX IF NOT EXISTS idx_staff_registration_requests_department ON staff_registration_requests (department_id, created_at)'),
+        ('staff_registrations', 'CREATE INDEX IF NOT EXISTS idx_staff_registrations_created ON staff_registrations (created_at)'),
+        ('department_queries', 'CREATE INDEX IF NOT EXISTS idx_department_queries_created ON department_queries (created_at)')
+    ]),
+    (6, 'admin enhancement list sort indexes', [
+        ('syllabus_uploads', 'CREATE INDEX IF NOT EXISTS idx_syllabus_uploads_uploaded ON syllabus_uploads (uploaded_at)'),
+        ('timetable_logs', 'CREATE INDEX IF NOT EXISTS idx_timetable_logs_generated ON timetable_logs (generated_at)')
+    ]),
+    # Per-staff and per-room timetable exports read in (day, time_slot) order
+    (7, 'timetable export indexes', [
+        ('timetables', 'CREATE INDEX IF NOT EXISTS idx_timetables_staff ON timetables (staff_id, day, time_slot)'),
+        ('timetables', 'CREATE INDEX IF NOT EXISTS idx_timetables_classroom ON timetables (classroom_id, day, time_slot)')
+    ]),
+    # Timetables generated before versions existed, so approved ones stay visible to staff
+    (8, 'generated_timetables into timetable versions', [
+        ('timetable_versions', import_legacy_timetables)
+    ]),
+    # Migration 8 first read the payloads as plain JSON and skipped rows that
+    # payload_codec had re-encoded; runs it already imported are not repeated
+    (9, 'generated_timetables re-encoded by payload_codec into timetable versions', [
+        ('timetable_versions', import_legacy_timetables)
+    ])
+]
+
+# Hot queries that must be answered through an index; checked with EXPLAIN QUERY PLAN
+HOT_QUERIES = [
+    ('department staff', "SELECT id, name FROM users WHERE department_id = ? AND role = 'staff' ORDER BY name", (1,)),
+    ('users by role', "SELECT COUNT(*) FROM users WHERE role = 'staff'", ()),
+    ('department subjects', 'SELECT id, name, code FROM subjects WHERE department_id = ? ORDER BY name', (1,)),
+    ('department classrooms', 'SELECT id, name FROM classrooms WHERE department_id = ? ORDER BY name', (1,)),
+    ('department timetable', 'SELECT * FROM timetables WHERE department_id = ? ORDER BY day, time_slot', (1,)),
+    ('staff messages', 'SELECT * FROM staff_messages WHERE from_user_id = ? OR to_user_id = ? ORDER BY created_at DESC', (1, 1)),
+    ('staff submissions', 'SELECT * FROM subject_choice_submissions WHERE staff_id = ? ORDER BY submitted_at DESC', (1,)),
+    ('open choice forms', "SELECT * FROM subject_choice_forms WHERE department_id = ? AND status = 'open' ORDER BY close_date", (1,)),
+    ('department queries', 'SELECT * FROM department_queries WHERE department_id = ? ORDER BY created_at DESC', (1,)),
+    ('pending credentials', 'SELECT * FROM credentials_export WHERE exported = FALSE ORDER BY generated_at DESC', ()),
+    ('timetable versions', 'SELECT id FROM timetable_versions WHERE department_id = ? ORDER BY created_at DESC', (1,)),
+    ('staff timetable', 'SELECT * FROM staff_timetable_entries WHERE staff_id = ?', (1,)),
+    ('subjects for staff', 'SELECT subject_id FROM staff_subjects WHERE staff_id = ? ORDER BY position', (1,)),
+    ('staff for subject', 'SELECT staff_id FROM staff_subjects WHERE subject_id = ?', (1,)),
+    ('users page', "SELECT id FROM users WHERE (name, id) > ('', 0) ORDER BY name, id LIMIT 50", ()),
+    ('staff requests page', 'SELECT id FROM staff_registration_requests ORDER BY created_at DESC, id DESC LIMIT 50', ()),
+    ('department queries page', 'SELECT id FROM department_queries ORDER BY created_at DESC, id DESC LIMIT 50', ()),
+    ('syllabus uploads page', 'SELECT id FROM syllabus_uploads ORDER BY uploaded_at DESC, id DESC LIMIT 50', ()),
+    ('timetable logs page', 'SELECT id FROM timetable_logs ORDER BY generated_at DESC, id DESC LIMIT 50', ()),
+    ('staff timetable export', 'SELECT * FROM timetables WHERE staff_id = ? ORDER BY day, time_slot', (1,)),
+    ('room timetable export', 'SELECT * FROM timetables WHERE classroom_id = ? ORDER BY day, time_slot', (1,))
+]
+
+def init_schema_migrations(cursor):
+    """Create the table recording applied migrations"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _existing_tables(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {row[0] for row in cursor.fetchall()}
+
+def run_migrations(cursor):
+    """Apply pending migrations whose tables exist, returns the versions applied"""
+    init_schema_migrations(cursor)
+
+    cursor.execute('SELECT version FROM schema_migrations')
+    applied = {row[0] for row in cursor.fetchall()}
+    tables = _existing_tables(cursor)
+
+    newly_applied = []
+    touched = set()
+    for version, name, statements in MIGRATIONS:
+        if version in applied or not all(table in tables for table, _ in statements):
+            continue
+
+        for table, statement in statements:
+            if callable(statement):
+                statement(cursor)
+            else:
+                cursor.execute(statement)
+            touched.add(table)
+        cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+        newly_applied.append(version)
+
+    # Fresh statistics so the planner picks the new indexes. Only the migrated
+    # tables: statistics on FTS5 shadow tables taken while they are small
+    # steer FTS5's internal lookups into scans as the index grows.
+    for table in sorted(touched):
+        cursor.execute(f'ANALYZE {table}')
+
+    return newly_applied
+
+def check_query_plans(cursor):
+    """Return (name, plan detail) for every hot query that falls back to a full table scan"""
+    tables = _existing_tables(cursor)
+    regressions = []
+
+    for name, query, params in HOT_QUERIES:
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN ' + query, params)
+        except Exception:
+            # Table not created in this database
+            continue
+
+        for row in cursor.fetchall():
+            detail = row[3]
+            words = detail.split()
+            if words[:1] == ['SCAN'] and len(words) > 1 and words[1] in tables and 'INDEX' not in detail:
+                regressions.append((name, detail))
+
+    return regressions
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    db_path = next((arg for arg in args if not arg.startswith('--')), 'timetable.db')
+
+    conn = open_connection(db_path)
+    cursor = conn.cursor()
+
+    applied = run_migrations(cursor)
+    conn.commit()
+    print(f"✅ Applied migrations: {applied or 'none pending'}")
+
+    if '--check' in args:
+        regressions = check_query_plans(cursor)
+        for name, detail in regressions:
+            print(f"❌ {name}: {detail}")
+        conn.close()
+        if regressions:
+            sys.exit(1)
+        print(f"✅ All {len(HOT_QUERIES)} hot queries use an index")
+    else:
+        conn.close()
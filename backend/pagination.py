@@ -0,0 +1,101 @@
+from datetime import datetime
+from flask import request
+from archive import archived_tables
+from db import ARCHIVE_SCHEMA
+
+# Rows per page when the client does not ask, and the most it may ask for
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class InvalidPageRequest(ValueError):
+    """Raised for a malformed cursor, limit or date filter"""
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise InvalidPageRequest(f'{name} must be a YYYY-MM-DD date')
+    return value
+
+def _position(cursor, column):
+    columns = [description[0] for description in cursor.description]
+    return columns.index(column.split('.')[-1])
+
+def paginate(cursor, query, params=(), sort_column='created_at', id_column='id',
+             filters=None, date_column=None, descending=True, archived_table=None,
+             page_size=PAGE_SIZE, max_page_size=MAX_PAGE_SIZE):
+    """Run one page of a list query with the request's filters, returns (rows, next_cursor)
+
+    query is a SELECT ending in a WHERE clause ('WHERE 1' when it has no
+    condition of its own); the filter and page conditions are ANDed to it.
+    Pages are keyset paged on (sort_column, id_column): the cursor holds the
+    values of the last row of the previous page, so every page is one index
+    range read however deep it is. filters maps a request argument to the
+    column it must equal; ?from= and ?to= bound date_column, both inclusive.
+    """
+    limit = request.args.get('limit', page_size, type=int)
+    if limit < 1:
+        raise InvalidPageRequest('limit must be positive')
+    limit = min(limit, max_page_size)
+
+    conditions = []
+    params = list(params)
+
+    for arg, column in (filters or {}).items():
+        value = request.args.get(arg)
+        if value:
+            conditions.append(f'{column} = ?')
+            params.append(value)
+
+    if date_column:
+        date_from, date_to = _date_arg('from'), _date_arg('to')
+        if date_from:
+            conditions.append(f'{date_column} >= ?')
+            params.append(date_from)
+        if date_to:
+            conditions.append(f"{date_column} < date(?, '+1 day')")
+            params.append(date_to)
+
+    page_cursor = request.args.get('cursor')
+    if page_cursor:
+        try:
+            sort_value, last_id = page_cursor.rsplit('|', 1)
+            last_id = int(last_id)
+        except ValueError:
+            raise InvalidPageRequest('Invalid cursor')
+        # Row-value comparison, which SQLite answers with a range on the sort index
+        conditions.append(f"({sort_column}, {id_column}) {'<' if descending else '>'} (?, ?)")
+        params.extend([sort_value, last_id])
+
+    direction = 'DESC' if descending else 'ASC'
+    page_query = (
+        query + ''.join(f' AND {condition}' for condition in conditions) +
+        f' ORDER BY {sort_column} {direction}, {id_column} {direction} LIMIT ?'
+    )
+
+    if not archived_table:
+        cursor.execute(page_query, params + [limit + 1])
+        rows = cursor.fetchall()
+    else:
+        archived = archived_table in archived_tables(cursor)
+        cursor.execute(page_query.format(table=f'main.{archived_table}'), params + [limit + 1])
+        rows = cursor.fetchall()
+
+        if archived:
+            # Both reads are ranges of their own sort index; merge them into one page
+            cursor.execute(page_query.format(table=f'{ARCHIVE_SCHEMA}.{archived_table}'), params + [limit + 1])
+            sort_index, id_index = _position(cursor, sort_column), _position(cursor, id_column)
+            live_ids = {row[id_index] for row in rows}
+            rows += [row for row in cursor.fetchall() if row[id_index] not in live_ids]
+            rows.sort(key=lambda row: (row[sort_index], row[id_index]), reverse=descending)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f'{last[_position(cursor, sort_column)]}|{last[_position(cursor, id_column)]}'
+
+    return rows, next_cursor
@@ -0,0 +1,115 @@
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# Scheme of every new hash, as a werkzeug method string. scrypt at N=2^15, r=8
+# costs 50-150 ms of one core and 32 MB per hash; raise N when the hardware allows.
+PASSWORD_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+SALT_LENGTH = 16
+
+# Hashes computed at once. hashlib releases the GIL while hashing, so workers
+# run in parallel up to the core count while other requests keep theirs.
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Hashes waiting for a worker before new ones are turned away
+HASH_QUEUE_SIZE = 64
+
+# Seconds a request waits for its hash
+HASH_TIMEOUT = 10
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_SIZE)
+_stats_lock = threading.Lock()
+_stats = {
+    'verified': 0,   # passwords checked on the pool
+    'rejected': 0,   # checks turned away because the pool was full
+    'rehashed': 0,   # matching passwords whose hash used an older scheme
+    'in_flight': 0   # checks queued or running
+}
+
+class PasswordPoolBusy(Exception):
+    """Raised when too many password hashes are already waiting for a worker"""
+
+def _bump(**changes):
+    with _stats_lock:
+        for key, delta in changes.items():
+            _stats[key] += delta
+
+def hash_password(password):
+    """Hash a password with the current scheme"""
+    return generate_password_hash(password, method=PASSWORD_METHOD, salt_length=SALT_LENGTH)
+
+def _is_unsalted_sha256(stored_hash):
+    # Written by the old credential generator: a bare hex digest
+    return len(stored_hash) == 64 and all(char in '0123456789abcdef' for char in stored_hash)
+
+def check_password(stored_hash, password):
+    """Check a password against a hash of any scheme this app has stored"""
+    if not stored_hash:
+        return False
+    if _is_unsalted_sha256(stored_hash):
+        return hmac.compare_digest(stored_hash, hashlib.sha256(password.encode()).hexdigest())
+    try:
+        return check_password_hash(stored_hash, password)
+    except ValueError:
+        # Malformed hash or unknown method
+        return False
+
+def needs_rehash(stored_hash):
+    """Whether a hash was made with another scheme or cost than PASSWORD_METHOD"""
+    return stored_hash.split('$', 1)[0] != PASSWORD_METHOD
+
+def _verify(stored_hash, password):
+    if not check_password(stored_hash, password):
+        return False, None
+    if needs_rehash(stored_hash):
+        return True, hash_password(password)
+    return True, None
+
+def _on_pool(function, *args):
+    if not _slots.acquire(blocking=False):
+        _bump(rejected=1)
+        raise PasswordPoolBusy('Too many logins in progress, try again shortly')
+
+    _bump(in_flight=1)
+    try:
+        future = _executor.submit(function, *args)
+    except Exception:
+        _slots.release()
+        _bump(in_flight=-1)
+        raise
+
+    def done(_):
+        _slots.release()
+        _bump(in_flight=-1)
+
+    future.add_done_callback(done)
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeout:
+        # The queue is too long to clear in time: the same overload as a full one
+        future.cancel()
+        _bump(rejected=1)
+        raise PasswordPoolBusy('Too many logins in progress, try again shortly')
+
+def verify_password(stored_hash, password):
+    """Check a password on the hashing pool, returns (matches, new_hash)
+
+    new_hash is set when the password matches a hash of an older scheme:
+    the caller stores it so the account moves to the current one. Raises
+    PasswordPoolBusy instead of queueing past HASH_QUEUE_SIZE, or when the
+    check does not finish within HASH_TIMEOUT.
+    """
+    matches, new_hash = _on_pool(_verify, stored_hash, password)
+    _bump(verified=1, rehashed=1 if new_hash else 0)
+    return matches, new_hash
+
+def password_stats():
+    """Pool counters and settings"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update(method=PASSWORD_METHOD, workers=HASH_WORKERS, queue_size=HASH_QUEUE_SIZE)
+    return stats
@@ -0,0 +1,95 @@
+import json
+import sys
+import zlib
+from db import open_connection
+
+# Header byte of encoded payloads; rows written before the codec are plain JSON text
+FORMAT_JSON = b'\x00'
+FORMAT_ZLIB_JSON = b'\x01'
+
+COMPRESSION_LEVEL = 6
+
+# (table, column) pairs holding encoded payloads
+PAYLOAD_COLUMNS = [
+    ('generated_timetables', 'timetable_data'),
+    ('generated_timetables', 'generation_constraints'),
+    ('timetable_versions', 'generation_constraints'),
+]
+
+def encode_payload(value):
+    """Encode a JSON-serializable value for storage, compressing it when that is smaller"""
+    raw = json.dumps(value, separators=(',', ':')).encode('utf-8')
+    compressed = zlib.compress(raw, COMPRESSION_LEVEL)
+    if len(compressed) < len(raw):
+        return FORMAT_ZLIB_JSON + compressed
+    return FORMAT_JSON + raw
+
+def decode_payload(stored):
+    """Decode a stored payload, accepting both encoded blobs and legacy JSON text"""
+    if stored is None:
+        return None
+
+    if isinstance(stored, str):
+        return json.loads(stored)
+
+    stored = bytes(stored)
+    header, body = stored[:1], stored[1:]
+
+    if header == FORMAT_ZLIB_JSON:
+        return json.loads(zlib.decompress(body))
+    if header == FORMAT_JSON:
+        return json.loads(body)
+
+    # Legacy JSON that was stored as a blob
+    return json.loads(stored)
+
+def recompress_payloads(db_path='timetable.db', batch_size=200, vacuum=False):
+    """Re-encode every stored payload still in legacy JSON text, returns rows rewritten per column"""
+    conn = open_connection(db_path)
+    cursor = conn.cursor()
+    rewritten = {}
+
+    for table, column in PAYLOAD_COLUMNS:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+        if not cursor.fetchone():
+            continue
+
+        count = 0
+        last_id = 0
+        while True:
+            cursor.execute(f'''
+                SELECT id, {column} FROM {table}
+                WHERE id > ? AND typeof({column}) = 'text'
+                ORDER BY id
+                LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            updates = []
+            for row_id, value in rows:
+                try:
+                    updates.append((encode_payload(json.loads(value)), row_id))
+                except ValueError:
+                    print(f"⚠️ Skipping {table}.{column} row {row_id}: not valid JSON")
+
+            cursor.executemany(f'UPDATE {table} SET {column} = ? WHERE id = ?', updates)
+            conn.commit()
+
+            count += len(updates)
+            last_id = rows[-1][0]
+
+        rewritten[f'{table}.{column}'] = count
+
+    if vacuum:
+        conn.execute('VACUUM')
+
+    conn.close()
+    return rewritten
+
+if __name__ == '__main__':
+    db_path = next((arg for arg in sys.argv[1:] if not arg.startswith('--')), 'timetable.db')
+    results = recompress_payloads(db_path, vacuum='--vacuum' in sys.argv)
+    for column, count in results.items():
+        print(f"✅ {column}: {count} rows recompressed")
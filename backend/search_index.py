@@ -0,0 +1,185 @@
+import re
+import sys
+from db import open_connection
+
+# source -> (table, indexed columns, title column, date column)
+SEARCH_SOURCES = {
+    'queries': ('department_queries', ('title', 'description', 'resolution_notes'), 'title', 'created_at'),
+    'messages': ('staff_messages', ('subject', 'message'), 'subject', 'created_at'),
+    'notifications': ('notifications', ('title', 'message'), 'title', 'created_at'),
+    'syllabus': ('syllabus_uploads', ('original_filename', 'review_notes'), 'original_filename', 'uploaded_at')
+}
+
+# Rows a user may see per source, by role: (condition with {t} for the table, names of its params)
+VISIBILITY = {
+    'queries': {
+        'main_admin': ('1', ()),
+        'default': ('{t}.department_id = ?', ('department_id',))
+    },
+    'messages': {
+        'default': ('({t}.from_user_id = ? OR {t}.to_user_id = ?)', ('user_id', 'user_id'))
+    },
+    'notifications': {
+        'main_admin': ('1', ()),
+        'default': ("{t}.recipient_type IN ('all', ?)", ('role',))
+    },
+    'syllabus': {
+        'main_admin': ('1', ()),
+        'dept_admin': ('{t}.department_id = ?', ('department_id',)),
+        'default': ('{t}.uploaded_by = ?', ('user_id',))
+    }
+}
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+def _fts_table(table):
+    return f'{table}_fts'
+
+def _create_index(cursor, table, columns):
+    fts = _fts_table(table)
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'NEW.{column}' for column in columns)
+    old_values = ', '.join(f'OLD.{column}' for column in columns)
+
+    # External content table: the index stores terms only, text is read from the table
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts}
+        USING fts5({column_list}, content='{table}', content_rowid='id', tokenize='porter unicode61')
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_insert
+        AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO {fts} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_delete
+        AFTER DELETE ON {table}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+        END
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_fts_update
+        AFTER UPDATE OF {column_list} ON {table}
+        BEGIN
+            INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+            INSERT INTO {fts} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+        END
+    ''')
+
+def init_search_index(cursor):
+    """Create the full-text index and sync triggers of every source whose table exists
+
+    An index is filled from its table in the transaction that creates it.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    existing = {row[0] for row in cursor.fetchall()}
+
+    for table, columns, _, _ in SEARCH_SOURCES.values():
+        if table not in existing or _fts_table(table) in existing:
+            continue
+
+        _create_index(cursor, table, columns)
+        cursor.execute(f"INSERT INTO {_fts_table(table)} ({_fts_table(table)}) VALUES ('rebuild')")
+
+def fts_query(text):
+    """Turn user input into an FTS5 query: every word must match, the last one as a prefix
+
+    Words are quoted so FTS5 operators and punctuation in the input are taken literally.
+    """
+    words = re.findall(r'\w+', text or '')
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+def search(cursor, text, user_id, role, department_id, sources=None, limit=SEARCH_LIMIT):
+    """Ranked matches across sources the user can see, best first
+
+    Each source is matched through its FTS index, filtered by the user's
+    visibility rules and cut to `limit` rows before the results are merged.
+    """
+    query = fts_query(text)
+    if not query:
+        return []
+
+    params_by_name = {'user_id': user_id, 'role': role, 'department_id': department_id}
+    results = []
+
+    for source in sources or SEARCH_SOURCES:
+        table, _, title_column, date_column = SEARCH_SOURCES[source]
+        fts = _fts_table(table)
+        rules = VISIBILITY[source]
+        condition, param_names = rules.get(role, rules['default'])
+
+        try:
+            cursor.execute(f'''
+                SELECT {table}.id, {table}.{title_column}, {table}.{date_column},
+                       snippet({fts}, -1, '[', ']', '…', 12), bm25({fts})
+                FROM {fts}
+                JOIN {table} ON {table}.id = {fts}.rowid
+                WHERE {fts} MATCH ? AND {condition.format(t=table)}
+                ORDER BY bm25({fts})
+                LIMIT ?
+            ''', (query, *[params_by_name[name] for name in param_names], limit))
+        except Exception as e:
+            if 'no such table' in str(e):
+                # Source not created in this database
+                continue
+            raise
+
+        for row in cursor.fetchall():
+            results.append({
+                'type': source,
+                'id': str(row[0]),
+                'title': row[1],
+                'created_at': row[2],
+                'snippet': row[3],
+                'score': row[4]
+            })
+
+    # bm25 is lower for better matches
+    results.sort(key=lambda result: result['score'])
+    return results[:limit]
+
+def rebuild_search_index(db_path='timetable.db'):
+    """Rebuild and merge every full-text index, returns {table: rows indexed}"""
+    conn = open_connection(db_path)
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+
+    init_search_index(cursor)
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    existing = {row[0] for row in cursor.fetchall()}
+
+    # Planner statistics on the shadow tables make FTS5's own lookups scan; drop any a manual ANALYZE left
+    if 'sqlite_stat1' in existing:
+        for table, _, _, _ in SEARCH_SOURCES.values():
+            cursor.execute('DELETE FROM sqlite_stat1 WHERE tbl LIKE ?', (_fts_table(table) + '%',))
+
+    indexed = {}
+    for table, _, _, _ in SEARCH_SOURCES.values():
+        fts = _fts_table(table)
+        if fts not in existing:
+            continue
+        cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('optimize')")
+        cursor.execute(f'SELECT COUNT(*) FROM {table}')
+        indexed[table] = cursor.fetchone()[0]
+
+    conn.commit()
+    conn.close()
+    return indexed
+
+if __name__ == '__main__':
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'timetable.db'
+    for table, rows in rebuild_search_index(db_path).items():
+        print(f"✅ {table}: {rows} rows indexed")
@@ -1,8 +1,9 @@
-import sqlite3
-from werkzeug.security import generate_password_hash
+from db import open_connection
+from passwords import hash_password
+from staff_subjects import set_staff_subjects
 
 def seed_database():
-    conn = sqlite3.connect('timetable.db')
+    conn = open_connection()
     cursor = conn.cursor()
 
     # Insert Departments
@@ -64,11 +65,13 @@ def seed_database():
     for name, email, password, role, dept_id, staff_role, subj_sel, subj_locked in users:
         cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
         if not cursor.fetchone():
-            hashed = generate_password_hash(password)
+            hashed = hash_password(password)
             cursor.execute('''
-                INSERT INTO users (name, email, password_hash, role, department_id, staff_role, subjects_selected, subjects_locked)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (name, email, hashed, role, dept_id, staff_role, subj_sel, subj_locked))
+                INSERT INTO users (name, email, password_hash, role, department_id, staff_role, subjects_locked)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (name, email, hashed, role, dept_id, staff_role, subj_locked))
+            if subj_sel:
+                set_staff_subjects(cursor, cursor.lastrowid, subj_sel.split(','))
 
     conn.commit()
     conn.close()
@@ -0,0 +1,31 @@
+def subjects_for_staff(cursor, staff_id):
+    """Subject ids a staff member teaches, in the order they were picked"""
+    cursor.execute('''
+        SELECT subject_id FROM staff_subjects
+        WHERE staff_id = ?
+        ORDER BY position
+    ''', (staff_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+def department_staff_subjects(cursor, department_id):
+    """Map of staff id -> subject ids for every staff member of a department"""
+    cursor.execute('''
+        SELECT ss.staff_id, ss.subject_id
+        FROM users u
+        JOIN staff_subjects ss ON ss.staff_id = u.id
+        WHERE u.department_id = ? AND u.role = 'staff'
+        ORDER BY ss.staff_id, ss.position
+    ''', (department_id,))
+
+    staff_subjects = {}
+    for staff_id, subject_id in cursor.fetchall():
+        staff_subjects.setdefault(staff_id, []).append(subject_id)
+    return staff_subjects
+
+def set_staff_subjects(cursor, staff_id, subject_ids):
+    """Replace the subjects a staff member teaches"""
+    cursor.execute('DELETE FROM staff_subjects WHERE staff_id = ?', (staff_id,))
+    cursor.executemany('''
+        INSERT OR IGNORE INTO staff_subjects (staff_id, subject_id, position)
+        VALUES (?, ?, ?)
+    ''', [(staff_id, int(subject_id), position) for position, subject_id in enumerate(subject_ids)])
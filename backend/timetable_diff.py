@@ -0,0 +1,83 @@
+from collections import Counter, defaultdict, deque
+
+# Entry keys are (day, time_slot, subject_id, staff_id, classroom_id) tuples
+ENTRY_FIELDS = ('day', 'time_slot', 'subject_id', 'staff_id', 'classroom_id')
+
+
+def _entry_dict(key):
+    return dict(zip(ENTRY_FIELDS, key))
+
+
+def _room_slot(key):
+    day, time_slot, subject_id, staff_id, classroom_id = key
+    return (day, time_slot, classroom_id)
+
+
+def _staff_slot(key):
+    day, time_slot, subject_id, staff_id, classroom_id = key
+    return (staff_id, day, time_slot)
+
+
+def _lesson(key):
+    day, time_slot, subject_id, staff_id, classroom_id = key
+    return (staff_id, subject_id)
+
+
+def _pair_by(old_keys, new_keys, key_func):
+    """Pair leftover old and new entries sharing key_func, returns (pairs, old_left, new_left)"""
+    buckets = defaultdict(deque)
+    for key in old_keys:
+        buckets[key_func(key)].append(key)
+
+    pairs = []
+    new_left = []
+    for key in new_keys:
+        bucket = buckets.get(key_func(key))
+        if bucket:
+            pairs.append((bucket.popleft(), key))
+        else:
+            new_left.append(key)
+
+    old_left = [key for bucket in buckets.values() for key in bucket]
+    return pairs, old_left, new_left
+
+
+def diff_timetables(old_keys, new_keys):
+    """Compare two sets of timetable entries in time linear in the entry count
+
+    Identical entries are dropped first. What is left is paired on the
+    (staff, day, slot) key, where the same staff member teaches something in
+    another room or subject at the same time, and then on the (staff, subject)
+    lesson, where a class moved to another day, slot or room. Unpaired entries
+    are reported as added or removed.
+    """
+    old_counts = Counter(old_keys)
+    new_counts = Counter(new_keys)
+    old_left = list((old_counts - new_counts).elements())
+    new_left = list((new_counts - old_counts).elements())
+
+    same_time, old_left, new_left = _pair_by(old_left, new_left, _staff_slot)
+    rescheduled, removed, added = _pair_by(old_left, new_left, _lesson)
+    moved = same_time + rescheduled
+
+    staff_impact = Counter()
+    for old, new in moved:
+        staff_impact[old[3]] += 1
+    for key in added + removed:
+        staff_impact[key[3]] += 1
+
+    # Two entries claiming the same room slot in the new timetable
+    room_slots = Counter(_room_slot(key) for key in new_keys)
+
+    return {
+        'moved': [{'from': _entry_dict(old), 'to': _entry_dict(new)} for old, new in moved],
+        'added': [_entry_dict(key) for key in added],
+        'removed': [_entry_dict(key) for key in removed],
+        'unchanged_count': sum((old_counts & new_counts).values()),
+        'staff_impact': dict(staff_impact),
+        'room_conflicts': [
+            {'day': day, 'time_slot': time_slot, 'classroom_id': classroom_id, 'count': count}
+            for (day, time_slot, classroom_id), count in room_slots.items()
+            if count > 1
+        ]
+    }
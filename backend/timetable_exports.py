@@ -0,0 +1,193 @@
+import csv
+import io
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+DAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+# Slots are written on a 12-hour clock without am/pm ('2:15-3:15'); hours before this are afternoon
+FIRST_MORNING_HOUR = 8
+
+SLOT_PATTERN = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$')
+
+# export scope -> timetables column it filters on; each has a (column, day, time_slot) index
+EXPORT_SCOPES = {
+    'department': 't.department_id',
+    'staff': 't.staff_id',
+    'room': 't.classroom_id'
+}
+
+CSV_COLUMNS = ['Day', 'Start', 'End', 'Time Slot', 'Subject', 'Code', 'Staff', 'Classroom']
+
+# Rows written per chunk of a streamed response
+ROWS_PER_CHUNK = 200
+
+# Calendar events are in the college's local time, which has no daylight saving
+CALENDAR_TIMEZONE = os.getenv('TIMETABLE_TIMEZONE', 'Asia/Kolkata')
+CALENDAR_UTC_OFFSET = os.getenv('TIMETABLE_UTC_OFFSET', '+0530')
+
+# Weekly events repeat for this many weeks from the week the timetable was saved
+TERM_WEEKS = 18
+
+# Rendered exports kept per ETag, so polling calendar clients are served without a query
+EXPORT_CACHE_SIZE = 64
+EXPORT_CACHE_MAX_BYTES = 512 * 1024
+
+_export_cache = OrderedDict()  # etag -> rendered body
+_export_cache_lock = threading.Lock()
+
+def _hour(hour):
+    hour = int(hour)
+    return hour + 12 if hour < FIRST_MORNING_HOUR else hour
+
+@lru_cache(maxsize=None)
+def slot_times(time_slot):
+    """Start and end of a time slot as (hour, minute) pairs on a 24-hour clock, None if it does not parse"""
+    match = SLOT_PATTERN.match(time_slot or '')
+    if not match:
+        return None
+    start_hour, start_minute, end_hour, end_minute = match.groups()
+    return (_hour(start_hour), int(start_minute)), (_hour(end_hour), int(end_minute))
+
+def export_rows(cursor, scope, entity_id):
+    """Run the export query of a department, staff member or room, returns the cursor to stream from"""
+    cursor.execute(f'''
+        SELECT t.id, t.day, t.time_slot, s.name, s.code, u.name, c.name, t.created_at
+        FROM timetables t
+        JOIN subjects s ON t.subject_id = s.id
+        JOIN users u ON t.staff_id = u.id
+        JOIN classrooms c ON t.classroom_id = c.id
+        WHERE {EXPORT_SCOPES[scope]} = ?
+        ORDER BY t.day, t.time_slot
+    ''', (entity_id,))
+    return cursor
+
+def _clock(hour_minute):
+    return '%02d:%02d' % hour_minute if hour_minute else ''
+
+def csv_chunks(rows):
+    """Render export rows as CSV, ROWS_PER_CHUNK rows per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+
+    for count, (_, day, time_slot, subject, code, staff, classroom, _) in enumerate(rows, 1):
+        start, end = slot_times(time_slot) or (None, None)
+        writer.writerow([day, _clock(start), _clock(end), time_slot, subject, code, staff, classroom])
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+def _escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def _fold(line):
+    """Fold a content line at 75 octets without splitting a UTF-8 character"""
+    parts, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > 75:
+            parts.append(current)
+            current, size = ' ', 1
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n'.join(parts) + '\r\n'
+
+def _lines(*lines):
+    return ''.join(_fold(line) for line in lines)
+
+def _calendar_header(name):
+    offset = CALENDAR_UTC_OFFSET
+    return _lines(
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//SRM Timetable//Timetable Export//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        f'X-WR-CALNAME:{_escape(name)}',
+        f'X-WR-TIMEZONE:{CALENDAR_TIMEZONE}',
+        'BEGIN:VTIMEZONE',
+        f'TZID:{CALENDAR_TIMEZONE}',
+        'BEGIN:STANDARD',
+        'DTSTART:19700101T000000',
+        f'TZOFFSETFROM:{offset}',
+        f'TZOFFSETTO:{offset}',
+        'END:STANDARD',
+        'END:VTIMEZONE'
+    )
+
+def _first_occurrence(saved_at, day):
+    """Date of the slot's weekday in the week the timetable was saved"""
+    saved = datetime.strptime(saved_at[:10], '%Y-%m-%d').date()
+    return saved - timedelta(days=saved.weekday()) + timedelta(days=DAYS.index(day))
+
+def ics_chunks(rows, calendar_name):
+    """Render export rows as an iCalendar feed of weekly recurring events, ROWS_PER_CHUNK events per chunk"""
+    yield _calendar_header(calendar_name)
+
+    chunk = []
+    for entry_id, day, time_slot, subject, code, staff, classroom, saved_at in rows:
+        times = slot_times(time_slot)
+        if not times or day not in DAYS or not saved_at:
+            continue
+
+        first = _first_occurrence(saved_at, day)
+        (start_hour, start_minute), (end_hour, end_minute) = times
+        start = datetime(first.year, first.month, first.day, start_hour, start_minute)
+        end = datetime(first.year, first.month, first.day, end_hour, end_minute)
+        stamp = datetime.strptime(saved_at[:19], '%Y-%m-%d %H:%M:%S')
+
+        chunk.append(_lines(
+            'BEGIN:VEVENT',
+            f'UID:timetable-{entry_id}@srm-timetable',
+            f"DTSTAMP:{stamp.strftime('%Y%m%dT%H%M%SZ')}",
+            f"DTSTART;TZID={CALENDAR_TIMEZONE}:{start.strftime('%Y%m%dT%H%M%S')}",
+            f"DTEND;TZID={CALENDAR_TIMEZONE}:{end.strftime('%Y%m%dT%H%M%S')}",
+            f'RRULE:FREQ=WEEKLY;COUNT={TERM_WEEKS}',
+            f'SUMMARY:{_escape(subject)} ({_escape(code)})',
+            f'LOCATION:{_escape(classroom)}',
+            f'DESCRIPTION:{_escape(staff)}',
+            'END:VEVENT'
+        ))
+        if len(chunk) == ROWS_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+
+    yield ''.join(chunk) + _lines('END:VCALENDAR')
+
+def cached_export(etag):
+    """Rendered body of an export for an ETag, None when not cached"""
+    with _export_cache_lock:
+        body = _export_cache.get(etag)
+        if body is not None:
+            _export_cache.move_to_end(etag)
+        return body
+
+def caching_chunks(etag, chunks):
+    """Pass chunks through, keeping the whole body for the ETag once it has been sent in full
+
+    The ETag carries the timetable's change counters, so an entry is never
+    stale: an edited timetable gets a new ETag. Bodies over
+    EXPORT_CACHE_MAX_BYTES are streamed but not kept.
+    """
+    parts, size = [], 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size <= EXPORT_CACHE_MAX_BYTES:
+            parts.append(chunk)
+        yield chunk
+
+    if size <= EXPORT_CACHE_MAX_BYTES:
+        with _export_cache_lock:
+            _export_cache[etag] = ''.join(parts)
+            _export_cache.move_to_end(etag)
+            while len(_export_cache) > EXPORT_CACHE_SIZE:
+                _export_cache.popitem(last=False)
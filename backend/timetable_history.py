@@ -0,0 +1,154 @@
+import sys
+from collections import Counter
+from payload_codec import encode_payload, decode_payload
+from db import open_connection, checkpoint
+
+# A full snapshot is written after this many consecutive deltas
+SNAPSHOT_INTERVAL = 10
+
+# Draft and rejected versions older than this lose their entry rows during compaction
+DEFAULT_RETENTION_DAYS = 30
+
+def init_timetable_history(cursor):
+    """Create the version history table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS timetable_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            version_id INTEGER UNIQUE NOT NULL,
+            department_id INTEGER NOT NULL,
+            kind TEXT NOT NULL CHECK (kind IN ('snapshot', 'delta')),
+            base_version_id INTEGER, -- previous version a delta applies to
+            chain_length INTEGER NOT NULL DEFAULT 0, -- deltas since the last snapshot
+            payload BLOB NOT NULL, -- encoded entries (snapshot) or added/removed entries (delta)
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (version_id) REFERENCES timetable_versions (id),
+            FOREIGN KEY (department_id) REFERENCES departments (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_timetable_history_department
+        ON timetable_history (department_id, version_id)
+    ''')
+
+def _entry_keys_from_rows(cursor, version_id):
+    cursor.execute('''
+        SELECT day, time_slot, subject_id, staff_id, classroom_id
+        FROM timetable_version_entries
+        WHERE version_id = ?
+        ORDER BY id
+    ''', (version_id,))
+    return [tuple(row) for row in cursor.fetchall()]
+
+def record_version_history(cursor, version_id, department_id, entry_keys):
+    """Record a new version as a delta against the department's previous version, or a snapshot"""
+    cursor.execute('''
+        SELECT version_id, chain_length FROM timetable_history
+        WHERE department_id = ? AND version_id < ?
+        ORDER BY version_id DESC
+        LIMIT 1
+    ''', (department_id, version_id))
+    previous = cursor.fetchone()
+
+    if previous and previous[1] + 1 < SNAPSHOT_INTERVAL:
+        previous_keys = Counter(rebuild_entry_keys(cursor, previous[0]))
+        current_keys = Counter(entry_keys)
+        payload = {
+            'added': list((current_keys - previous_keys).elements()),
+            'removed': list((previous_keys - current_keys).elements())
+        }
+        kind, base_version_id, chain_length = 'delta', previous[0], previous[1] + 1
+    else:
+        payload = [list(key) for key in entry_keys]
+        kind, base_version_id, chain_length = 'snapshot', None, 0
+
+    cursor.execute('''
+        INSERT INTO timetable_history
+        (version_id, department_id, kind, base_version_id, chain_length, payload)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (version_id, department_id, kind, base_version_id, chain_length, encode_payload(payload)))
+
+def rebuild_entry_keys(cursor, version_id):
+    """Rebuild a version's (day, time_slot, subject_id, staff_id, classroom_id) entries from history
+
+    Returns None when the version has no history record.
+    """
+    chain = []
+    current = version_id
+    while current is not None:
+        cursor.execute('''
+            SELECT kind, base_version_id, payload FROM timetable_history WHERE version_id = ?
+        ''', (current,))
+        record = cursor.fetchone()
+        if not record:
+            return None
+        chain.append(record)
+        current = record[1] if record[0] == 'delta' else None
+
+    snapshot = chain.pop()
+    entries = Counter(tuple(key) for key in decode_payload(snapshot[2]))
+
+    for kind, base_version_id, payload in reversed(chain):
+        delta = decode_payload(payload)
+        entries -= Counter(tuple(key) for key in delta['removed'])
+        entries += Counter(tuple(key) for key in delta['added'])
+
+    return list(entries.elements())
+
+def compact_timetable_history(db_path='timetable.db', retention_days=DEFAULT_RETENTION_DAYS):
+    """Backfill missing history and prune entry rows of old drafts, returns a summary"""
+    conn = open_connection(db_path)
+    cursor = conn.cursor()
+
+    # Versions written before the history store existed
+    cursor.execute('''
+        SELECT tv.id, tv.department_id
+        FROM timetable_versions tv
+        LEFT JOIN timetable_history th ON th.version_id = tv.id
+        WHERE th.id IS NULL
+        AND EXISTS (SELECT 1 FROM timetable_version_entries e WHERE e.version_id = tv.id)
+        ORDER BY tv.id
+    ''')
+    missing = cursor.fetchall()
+
+    for version_id, department_id in missing:
+        record_version_history(cursor, version_id, department_id, _entry_keys_from_rows(cursor, version_id))
+    conn.commit()
+
+    # Old drafts keep their version row and history, only the entry rows go
+    cursor.execute('''
+        SELECT tv.id FROM timetable_versions tv
+        JOIN timetable_history th ON th.version_id = tv.id
+        WHERE tv.status IN ('draft', 'rejected')
+        AND tv.created_at < datetime('now', ?)
+        AND EXISTS (SELECT 1 FROM timetable_version_entries e WHERE e.version_id = tv.id)
+    ''', (f'-{int(retention_days)} days',))
+    expired = [row[0] for row in cursor.fetchall()]
+
+    pruned_entries = 0
+    for version_id in expired:
+        cursor.execute('DELETE FROM timetable_version_entries WHERE version_id = ?', (version_id,))
+        pruned_entries += cursor.rowcount
+        conn.commit()
+
+    conn.close()
+
+    # Give the freed WAL pages back now rather than at the next autocheckpoint
+    checkpoint(db_path)
+
+    return {
+        'history_backfilled': len(missing),
+        'versions_pruned': len(expired),
+        'entries_pruned': pruned_entries
+    }
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    retention_days = DEFAULT_RETENTION_DAYS
+    if '--retention-days' in args:
+        retention_days = int(args[args.index('--retention-days') + 1])
+    db_path = args[0] if args and not args[0].startswith('--') else 'timetable.db'
+
+    summary = compact_timetable_history(db_path, retention_days)
+    print(f"✅ Backfilled history for {summary['history_backfilled']} versions")
+    print(f"✅ Pruned {summary['entries_pruned']} entries from {summary['versions_pruned']} old drafts")
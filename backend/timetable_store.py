@@ -0,0 +1,434 @@
+import threading
+import zlib
+from collections import OrderedDict
+from timetable_views import VIEW_TYPES, build_timetable_views, classify_room, normalize_time_slot
+from payload_codec import decode_payload, encode_payload
+from http_cache import init_change_counters, create_change_triggers, bulk_change
+from timetable_history import init_timetable_history, record_version_history, rebuild_entry_keys
+
+VIEW_CACHE_SIZE = 64
+
+_view_cache = OrderedDict()  # (version_id, staff_id) -> views
+_view_cache_lock = threading.Lock()
+
+def init_timetable_store(cursor):
+    """Create the normalized generated-timetable tables"""
+    # One row per generation run
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS timetable_versions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            department_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'draft' CHECK (status IN ('draft', 'approved', 'rejected')),
+            generated_by INTEGER NOT NULL,
+            approved_by INTEGER,
+            generation_constraints BLOB, -- encoded JSON of constraints used
+            entry_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            approved_at TIMESTAMP,
+            FOREIGN KEY (department_id) REFERENCES departments (id),
+            FOREIGN KEY (generated_by) REFERENCES users (id),
+            FOREIGN KEY (approved_by) REFERENCES users (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_timetable_versions_department_created
+        ON timetable_versions (department_id, created_at, id)
+    ''')
+
+    init_change_counters(cursor)
+    create_change_triggers(cursor, 'timetable_versions')
+
+    # One row per scheduled class of a version; views are derived from these
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS timetable_version_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            version_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            time_slot TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            staff_id INTEGER NOT NULL,
+            classroom_id INTEGER NOT NULL,
+            FOREIGN KEY (version_id) REFERENCES timetable_versions (id),
+            FOREIGN KEY (subject_id) REFERENCES subjects (id),
+            FOREIGN KEY (staff_id) REFERENCES users (id),
+            FOREIGN KEY (classroom_id) REFERENCES classrooms (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_timetable_version_entries_version
+        ON timetable_version_entries (version_id, staff_id)
+    ''')
+
+    # Snapshots and deltas between consecutive versions of a department
+    init_timetable_history(cursor)
+
+    # Per-staff copy of the approved version, rebuilt whenever a version is approved
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS staff_timetable_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            staff_id INTEGER NOT NULL,
+            department_id INTEGER NOT NULL,
+            version_id INTEGER NOT NULL,
+            staff_name TEXT NOT NULL,
+            day TEXT NOT NULL,
+            time_slot TEXT NOT NULL,
+            subject_name TEXT NOT NULL,
+            classroom_name TEXT NOT NULL,
+            FOREIGN KEY (staff_id) REFERENCES users (id),
+            FOREIGN KEY (department_id) REFERENCES departments (id),
+            FOREIGN KEY (version_id) REFERENCES timetable_versions (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_staff_timetable_entries_staff
+        ON staff_timetable_entries (staff_id)
+    ''')
+
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_staff_timetable_entries_department
+        ON staff_timetable_entries (department_id)
+    ''')
+
+def save_timetable_version(cursor, department_id, base_timetable, generated_by, constraints):
+    """Store a generated timetable once as normalized entry rows, returns the version id"""
+    cursor.execute('''
+        INSERT INTO timetable_versions
+        (department_id, generated_by, generation_constraints, entry_count)
+        VALUES (?, ?, ?, ?)
+    ''', (department_id, generated_by, encode_payload(constraints), len(base_timetable)))
+
+    version_id = cursor.lastrowid
+
+    entry_keys = [
+        (entry['day'], entry['time_slot'], int(entry['subject_id']), entry['staff_id'], entry['classroom_id'])
+        for entry in base_timetable
+    ]
+    _insert_entry_rows(cursor, version_id, entry_keys)
+    record_version_history(cursor, version_id, department_id, entry_keys)
+
+    return version_id
+
+def _insert_entry_rows(cursor, version_id, entry_keys):
+    cursor.executemany('''
+        INSERT INTO timetable_version_entries
+        (version_id, day, time_slot, subject_id, staff_id, classroom_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(version_id, *key) for key in entry_keys])
+
+def _has_entry_rows(cursor, version_id):
+    cursor.execute('SELECT 1 FROM timetable_version_entries WHERE version_id = ? LIMIT 1', (version_id,))
+    return cursor.fetchone() is not None
+
+def approve_timetable_version(cursor, version_id, approved_by):
+    """Approve a version, publish it as the live timetable and materialize its per-staff schedules
+
+    Returns False if the version is not found. Run it inside one write
+    transaction, like replace_live_timetable.
+    """
+    cursor.execute('SELECT department_id FROM timetable_versions WHERE id = ?', (version_id,))
+    version = cursor.fetchone()
+
+    if not version:
+        return False
+
+    department_id = version[0]
+
+    # Entry rows of old drafts are pruned by compaction; restore them from history
+    if not _has_entry_rows(cursor, version_id):
+        _insert_entry_rows(cursor, version_id, rebuild_entry_keys(cursor, version_id) or [])
+
+    cursor.execute('''
+        UPDATE timetable_versions
+        SET status = 'approved', approved_by = ?, approved_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    ''', (approved_by, version_id))
+
+    replace_live_timetable(cursor, department_id, [
+        dict(zip(('day', 'time_slot', 'subject_id', 'staff_id', 'classroom_id'), key))
+        for key in load_entry_keys(cursor, version_id)
+    ])
+
+    _materialize_staff_entries(cursor, department_id, version_id)
+
+    return True
+
+def _materialize_staff_entries(cursor, department_id, version_id):
+    cursor.execute('DELETE FROM staff_timetable_entries WHERE department_id = ?', (department_id,))
+
+    cursor.execute('''
+        INSERT INTO staff_timetable_entries
+        (staff_id, department_id, version_id, staff_name, day, time_slot, subject_name, classroom_name)
+        SELECT e.staff_id, ?, e.version_id, u.name, e.day, e.time_slot,
+               COALESCE(s.name, ''), c.name
+        FROM timetable_version_entries e
+        LEFT JOIN subjects s ON e.subject_id = s.id
+        JOIN users u ON e.staff_id = u.id
+        JOIN classrooms c ON e.classroom_id = c.id
+        WHERE e.version_id = ?
+        ORDER BY e.id
+    ''', (department_id, version_id))
+
+def _ids_by_name(cursor, table, department_id):
+    # The department's own rows win over a same-named row elsewhere
+    cursor.execute(f'SELECT name, id FROM {table} ORDER BY department_id = ?, id', (department_id,))
+    return {name: row_id for name, row_id in cursor.fetchall()}
+
+def _legacy_entry_keys(cursor, department_id, staff_view):
+    """Entry keys of a legacy staff view, whose cells carry subject and classroom names only"""
+    subject_ids = _ids_by_name(cursor, 'subjects', department_id)
+    classroom_ids = _ids_by_name(cursor, 'classrooms', department_id)
+    cursor.execute('SELECT id FROM users')
+    user_ids = {row[0] for row in cursor.fetchall()}
+
+    entry_keys = []
+    for staff_id, staff in staff_view.items():
+        for day, slots in (staff.get('schedule') or {}).items():
+            for time_slot, cell in slots.items():
+                subject_id = subject_ids.get(cell.get('subject'))
+                classroom_id = classroom_ids.get(cell.get('classroom'))
+                if int(staff_id) in user_ids and subject_id and classroom_id:
+                    entry_keys.append((day, time_slot, subject_id, int(staff_id), classroom_id))
+    return entry_keys
+
+def import_legacy_timetables(cursor):
+    """Load timetables stored as JSON views in generated_timetables into versions and entry rows
+
+    Each legacy run stored its staff view next to the other three; the staff
+    view is the one read back as entries. Subjects and classrooms are
+    matched by name, and cells that no longer match a row are dropped. The
+    newest approved run of a department without an approved version becomes
+    its staff timetable.
+
+    Runs already imported, matched on department, author and creation
+    time, are left alone, so the import can be repeated. Rows whose
+    payloads cannot be decoded are reported and stay in
+    generated_timetables. Returns (imported, skipped).
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'generated_timetables'")
+    if not cursor.fetchone():
+        return 0, 0
+
+    cursor.execute('''
+        SELECT id, department_id, timetable_data, status, generated_by, approved_by,
+               generation_constraints, created_at, approved_at
+        FROM generated_timetables
+        WHERE timetable_type = 'staff'
+        ORDER BY created_at, id
+    ''')
+    legacy = cursor.fetchall()
+
+    cursor.execute('SELECT department_id, generated_by, created_at FROM timetable_versions')
+    imported_runs = {tuple(row) for row in cursor.fetchall()}
+
+    cursor.execute('SELECT DISTINCT department_id FROM staff_timetable_entries')
+    published = {row[0] for row in cursor.fetchall()}
+    approved = {}
+    imported = skipped = 0
+
+    for (legacy_id, department_id, data, status, generated_by, approved_by,
+         constraints, created_at, approved_at) in legacy:
+        if (department_id, generated_by, created_at) in imported_runs:
+            continue
+
+        # Either column may be legacy JSON text or a blob re-encoded by payload_codec
+        try:
+            entry_keys = _legacy_entry_keys(cursor, department_id, decode_payload(data) or {})
+            constraints = decode_payload(constraints) or []
+        except (ValueError, AttributeError, zlib.error) as e:
+            print(f"⚠️ Skipping generated_timetables row {legacy_id}: {e}")
+            skipped += 1
+            continue
+
+        cursor.execute('''
+            INSERT INTO timetable_versions
+            (department_id, status, generated_by, approved_by, generation_constraints,
+             entry_count, created_at, approved_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (department_id, status, generated_by, approved_by, encode_payload(constraints),
+              len(entry_keys), created_at, approved_at))
+
+        version_id = cursor.lastrowid
+        _insert_entry_rows(cursor, version_id, entry_keys)
+        record_version_history(cursor, version_id, department_id, entry_keys)
+
+        imported += 1
+        if status == 'approved':
+            approved[department_id] = version_id
+
+    for department_id, version_id in approved.items():
+        if department_id not in published:
+            _materialize_staff_entries(cursor, department_id, version_id)
+
+    return imported, skipped
+
+def replace_live_timetable(cursor, department_id, entries):
+    """Replace a department's rows in the live timetables table with one bulk insert
+
+    Run it inside a single write transaction; with WAL, readers keep seeing
+    the previous timetable until the commit and never a half-written one.
+    """
+    rows = [
+        (
+            department_id, entry['day'], entry['time_slot'],
+            entry['subject_id'], entry['staff_id'], entry['classroom_id']
+        )
+        for entry in entries
+    ]
+
+    # One counter bump for the whole replacement instead of one per row
+    with bulk_change(cursor, 'timetables', department_id):
+        cursor.execute('DELETE FROM timetables WHERE department_id = ?', (department_id,))
+        cursor.executemany('''
+            INSERT INTO timetables (department_id, day, time_slot, subject_id, staff_id, classroom_id)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+    return len(rows)
+
+def load_staff_timetable(cursor, staff_id):
+    """Load one staff member's approved schedule in the staff-view format"""
+    cursor.execute('''
+        SELECT staff_name, day, time_slot, subject_name, classroom_name
+        FROM staff_timetable_entries
+        WHERE staff_id = ?
+        ORDER BY id
+    ''', (staff_id,))
+
+    rows = cursor.fetchall()
+
+    if not rows:
+        return {}
+
+    schedule = {}
+    for staff_name, day, time_slot, subject_name, classroom_name in rows:
+        schedule.setdefault(day, {})[time_slot] = {
+            'subject': subject_name,
+            'classroom': classroom_name
+        }
+
+    return {'name': rows[0][0], 'schedule': schedule}
+
+def load_version_entries(cursor, version_id, staff_id=None):
+    """Load the base timetable entries of a version, optionally for one staff member"""
+    query = '''
+        SELECT e.day, e.time_slot, e.subject_id, COALESCE(s.name, '') as subject_name,
+               e.staff_id, u.name as staff_name, e.classroom_id, c.name as classroom_name
+        FROM timetable_version_entries e
+        LEFT JOIN subjects s ON e.subject_id = s.id
+        JOIN users u ON e.staff_id = u.id
+        JOIN classrooms c ON e.classroom_id = c.id
+        WHERE e.version_id = ?
+    '''
+    params = [version_id]
+
+    if staff_id is not None:
+        query += ' AND e.staff_id = ?'
+        params.append(staff_id)
+
+    cursor.execute(query + ' ORDER BY e.id', params)
+    rows = cursor.fetchall()
+
+    if not rows and not _has_entry_rows(cursor, version_id):
+        rows = _rebuild_entry_rows(cursor, version_id, staff_id)
+
+    return [
+        {
+            'day': row[0],
+            'time_slot': row[1],
+            'subject_id': row[2],
+            'subject_name': row[3],
+            'staff_id': row[4],
+            'staff_name': row[5],
+            'classroom_id': row[6],
+            'classroom_name': row[7]
+        }
+        for row in rows
+    ]
+
+def _rebuild_entry_rows(cursor, version_id, staff_id=None):
+    """Rebuild entry rows with names for a version whose entry rows were pruned"""
+    entry_keys = rebuild_entry_keys(cursor, version_id) or []
+    if staff_id is not None:
+        entry_keys = [key for key in entry_keys if key[3] == staff_id]
+    if not entry_keys:
+        return []
+
+    names = {}
+    for table, position in (('subjects', 2), ('users', 3), ('classrooms', 4)):
+        ids = sorted({key[position] for key in entry_keys})
+        placeholders = ', '.join('?' for _ in ids)
+        cursor.execute(f'SELECT id, name FROM {table} WHERE id IN ({placeholders})', ids)
+        names[table] = {row[0]: row[1] for row in cursor.fetchall()}
+
+    return [
+        (
+            day, time_slot, subject_id, names['subjects'].get(subject_id, ''),
+            staff_id, names['users'][staff_id], classroom_id, names['classrooms'][classroom_id]
+        )
+        for day, time_slot, subject_id, staff_id, classroom_id in entry_keys
+        if staff_id in names['users'] and classroom_id in names['classrooms']
+    ]
+
+def load_entry_keys(cursor, version_id):
+    """Load a version's (day, time_slot, subject_id, staff_id, classroom_id) entries
+
+    'Period N' slots of older versions come back as the live timetable's
+    slots, so the keys compare with load_live_entry_keys.
+    """
+    cursor.execute('''
+        SELECT day, time_slot, subject_id, staff_id, classroom_id
+        FROM timetable_version_entries
+        WHERE version_id = ?
+        ORDER BY id
+    ''', (version_id,))
+    entry_keys = [tuple(row) for row in cursor.fetchall()]
+
+    if not entry_keys:
+        entry_keys = rebuild_entry_keys(cursor, version_id) or []
+
+    return [(day, normalize_time_slot(time_slot), *rest) for day, time_slot, *rest in entry_keys]
+
+def load_live_entry_keys(cursor, department_id):
+    """Load the department's entries from the live timetables table"""
+    cursor.execute('''
+        SELECT day, time_slot, subject_id, staff_id, classroom_id
+        FROM timetables
+        WHERE department_id = ?
+        ORDER BY id
+    ''', (department_id,))
+    return [tuple(row) for row in cursor.fetchall()]
+
+def cache_version_views(version_id, views, staff_id=None):
+    """Remember materialized views of a version; entry rows never change once written"""
+    with _view_cache_lock:
+        _view_cache[(version_id, staff_id)] = views
+        _view_cache.move_to_end((version_id, staff_id))
+        while len(_view_cache) > VIEW_CACHE_SIZE:
+            _view_cache.popitem(last=False)
+
+def get_version_views(cursor, version_id, staff_id=None):
+    """Get all views of a version, materializing them from entry rows on first use"""
+    key = (version_id, staff_id)
+    with _view_cache_lock:
+        views = _view_cache.get(key)
+        if views is not None:
+            _view_cache.move_to_end(key)
+            return views
+
+    entries = load_version_entries(cursor, version_id, staff_id)
+    room_types = {
+        entry['classroom_id']: classify_room(entry['classroom_name'])
+        for entry in entries
+    }
+    views = build_timetable_views(entries, room_types)
+    cache_version_views(version_id, views, staff_id)
+    return views
+
+def get_version_view(cursor, version_id, timetable_type, staff_id=None):
+    """Get one view ('student', 'staff', 'classroom' or 'lab') of a version"""
+    if timetable_type not in VIEW_TYPES:
+        raise ValueError(f'Unknown timetable type: {timetable_type}')
+    return get_version_views(cursor, version_id, staff_id)[timetable_type]
@@ -0,0 +1,95 @@
+import re
+
+VIEW_TYPES = ('student', 'staff', 'classroom', 'lab')
+
+# The college day, the slot labels of the live timetable and every generator
+TIME_SLOTS = (
+    '9:00-10:00', '10:00-11:00', '11:15-12:15',
+    '12:15-1:15', '2:15-3:15', '3:15-4:15', '4:30-5:30'
+)
+
+PERIOD_PATTERN = re.compile(r'^Period (\d+)$')
+
+
+def classify_room(name):
+    """Classify a room as 'lab' or 'classroom' from its name"""
+    return 'lab' if 'lab' in (name or '').lower() else 'classroom'
+
+
+def normalize_time_slot(time_slot):
+    """Map a 'Period N' label, written by older generator runs, to its slot in TIME_SLOTS"""
+    match = PERIOD_PATTERN.match(time_slot)
+    if match and 1 <= int(match.group(1)) <= len(TIME_SLOTS):
+        return TIME_SLOTS[int(match.group(1)) - 1]
+    return time_slot
+
+
+def build_timetable_views(base_timetable, room_types):
+    """Materialize the student, staff, classroom and lab views in a single pass"""
+    student_timetable = {}
+
+    # Staff and rooms are interned to dense indexes on first sight so that the
+    # per-entry work is a single dict probe plus list indexing.
+    staff_index = {}
+    staff_ids = []
+    staff_views = []
+    room_index = {}
+    room_ids = []
+    room_views = []
+
+    for entry in base_timetable:
+        day = entry['day']
+        slot = entry['time_slot']
+        subject_name = entry['subject_name']
+        staff_name = entry['staff_name']
+        classroom_name = entry['classroom_name']
+
+        student_days = student_timetable.get(day)
+        if student_days is None:
+            student_days = student_timetable[day] = {}
+        student_days[slot] = {
+            'subject': subject_name,
+            'staff': staff_name,
+            'classroom': classroom_name
+        }
+
+        staff_id = entry['staff_id']
+        idx = staff_index.get(staff_id)
+        if idx is None:
+            idx = staff_index[staff_id] = len(staff_ids)
+            staff_ids.append(staff_id)
+            staff_views.append({'name': staff_name, 'schedule': {}})
+        schedule = staff_views[idx]['schedule']
+        staff_days = schedule.get(day)
+        if staff_days is None:
+            staff_days = schedule[day] = {}
+        staff_days[slot] = {'subject': subject_name, 'classroom': classroom_name}
+
+        classroom_id = entry['classroom_id']
+        idx = room_index.get(classroom_id)
+        if idx is None:
+            idx = room_index[classroom_id] = len(room_ids)
+            room_ids.append(classroom_id)
+            room_views.append({'name': classroom_name, 'schedule': {}})
+        schedule = room_views[idx]['schedule']
+        room_days = schedule.get(day)
+        if room_days is None:
+            room_days = schedule[day] = {}
+        room_days[slot] = {'subject': subject_name, 'staff': staff_name}
+
+    classroom_timetable = dict(zip(room_ids, room_views))
+
+    # Lab schedules are exactly the classroom schedules of lab rooms, so they
+    # are selected from the room-type table instead of re-walking the entries.
+    lab_timetable = {
+        classroom_id: room_view
+        for classroom_id, room_view in classroom_timetable.items()
+        if room_types.get(classroom_id) == 'lab'
+    }
+
+    return {
+        'student': student_timetable,
+        'staff': dict(zip(staff_ids, staff_views)),
+        'classroom': classroom_timetable,
+        'lab': lab_timetable
+    }
@@ -0,0 +1,172 @@
+import queue
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import db
+
+# Pending writes per database; submitters wait up to WRITE_TIMEOUT for room
+WRITE_QUEUE_SIZE = 256
+
+# Writes committed together in one transaction
+WRITE_BATCH_SIZE = 64
+
+# Seconds a request waits for a free queue slot and then for its write to commit
+WRITE_TIMEOUT = 10
+
+_writers = {}  # database path -> Writer
+_writers_lock = threading.Lock()
+
+class WriteQueueFull(Exception):
+    """Raised when the writer is too far behind to accept another write"""
+
+class WriteTimeout(Exception):
+    """Raised when a write was already running at WRITE_TIMEOUT; it may still commit"""
+
+class Writer:
+    """Thread owning the only write connection to a database
+
+    Writes are closures taking a cursor. The thread drains whatever is
+    queued, up to WRITE_BATCH_SIZE, into one transaction and commits it
+    once, so concurrent requests never compete for the write lock. Each
+    write runs in its own savepoint: one that raises is rolled back alone
+    and its future gets the exception, the rest of the batch still commits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.stats = {'submitted': 0, 'committed': 0, 'failed': 0, 'batches': 0, 'busy_retries': 0}
+        self.stats_lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=f'sqlite-writer:{path}', daemon=True)
+        self.thread.start()
+
+    def submit(self, work, row_factory=None):
+        """Queue work(cursor), returns a Future resolved once its batch commits"""
+        future = Future()
+        try:
+            self.queue.put((work, row_factory, future), timeout=WRITE_TIMEOUT)
+        except queue.Full:
+            raise WriteQueueFull('Too many pending writes, try again shortly')
+        self._bump(submitted=1)
+        return future
+
+    def _bump(self, **changes):
+        with self.stats_lock:
+            for key, delta in changes.items():
+                self.stats[key] += delta
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return [item for item in batch if item[2].set_running_or_notify_cancel()]
+
+    def _run(self):
+        conn = db.open_connection(self.path)
+        conn.isolation_level = None  # transactions and savepoints are issued explicitly
+
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            try:
+                results = self._commit_batch(conn, batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                self._bump(failed=len(batch))
+                continue
+
+            failed = 0
+            for (_, _, future), (ok, outcome) in zip(batch, results):
+                if ok:
+                    future.set_result(outcome)
+                else:
+                    future.set_exception(outcome)
+                    failed += 1
+            self._bump(batches=1, committed=len(batch) - failed, failed=failed)
+
+    def _commit_batch(self, conn, batch):
+        # Another process can still hold the lock; retry the batch with backoff
+        for attempt in range(db.BUSY_RETRIES):
+            try:
+                return self._run_batch(conn, batch)
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                if not db._is_busy(e) or attempt == db.BUSY_RETRIES - 1:
+                    raise
+
+            self._bump(busy_retries=1)
+            time.sleep(db.BUSY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def _run_batch(self, conn, batch):
+        conn.execute('BEGIN IMMEDIATE')
+
+        results = []
+        for work, row_factory, _ in batch:
+            cursor = conn.cursor()
+            cursor.row_factory = row_factory
+            cursor.execute('SAVEPOINT write')
+            try:
+                result = work(cursor)
+            except sqlite3.OperationalError as e:
+                if db._is_busy(e):
+                    raise
+                cursor.execute('ROLLBACK TO write')
+                results.append((False, e))
+            except Exception as e:
+                cursor.execute('ROLLBACK TO write')
+                results.append((False, e))
+            else:
+                results.append((True, result))
+            cursor.execute('RELEASE write')
+
+        conn.execute('COMMIT')
+        return results
+
+def get_writer(path=None):
+    """The writer of a database, started on first use"""
+    path = path or db.DATABASE_PATH
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = Writer(path)
+        return _writers[path]
+
+def submit_write(work, row_factory=None, path=None):
+    """Queue work(cursor) on the database's writer, returns a Future
+
+    work must not commit or roll back; its batch is committed for it.
+    """
+    return get_writer(path).submit(work, row_factory)
+
+def write(work, row_factory=None, path=None):
+    """Run work(cursor) on the writer and wait for it to commit, returns its result
+
+    A write still queued at WRITE_TIMEOUT is cancelled and raises
+    WriteQueueFull, so it is safe to retry. One whose batch had already
+    started raises WriteTimeout: it may commit, and callers must not report
+    it as failed.
+    """
+    future = submit_write(work, row_factory, path)
+    try:
+        return future.result(timeout=WRITE_TIMEOUT)
+    except FutureTimeout:
+        if future.cancel():
+            raise WriteQueueFull('Too many pending writes, try again shortly')
+        raise WriteTimeout('The change is still being saved and may already be applied; reload before retrying')
+
+def writer_stats():
+    """Counters and queue depth of every writer started in this process"""
+    with _writers_lock:
+        writers = list(_writers.values())
+    return {
+        writer.path: dict(writer.stats, queued=writer.queue.qsize(), queue_size=WRITE_QUEUE_SIZE)
+        for writer in writers
+    }
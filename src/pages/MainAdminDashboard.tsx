@@ -22,10 +22,29 @@ interface UserProfile {
   department_name?: string;
 }
 
+// Users listed per page; more are fetched on demand
+const USERS_PAGE_SIZE = 50;
+
+const authHeaders = () => ({
+  Authorization: `Bearer ${localStorage.getItem('auth_token')}`,
+  'Content-Type': 'application/json',
+});
+
+const fetchUsersPage = async (cursor: string | null) => {
+  const query = cursor
+    ? `?limit=${USERS_PAGE_SIZE}&cursor=${encodeURIComponent(cursor)}`
+    : `?limit=${USERS_PAGE_SIZE}`;
+  const res = await fetch(`http://localhost:5000/api/users${query}`, { headers: authHeaders() });
+  const json = await res.json();
+  return { users: (json?.users || []) as UserProfile[], nextCursor: (json?.next_cursor || null) as string | null };
+};
+
 const MainAdminDashboard = () => {
   const { user, logout } = useAuth();
   const [departments, setDepartments] = useState<Department[]>([]);
   const [users, setUsers] = useState<UserProfile[]>([]);
+  const [usersCursor, setUsersCursor] = useState<string | null>(null);
+  const [loadingMoreUsers, setLoadingMoreUsers] = useState(false);
   const [stats, setStats] = useState({
     totalUsers: 0,
     totalDepartments: 0,
@@ -41,21 +60,21 @@ const MainAdminDashboard = () => {
 
   const fetchData = async () => {
     try {
-      const token = localStorage.getItem('auth_token');
-      const headers = {
-        Authorization: `Bearer ${token}`,
-        'Content-Type': 'application/json',
-      };
+      const headers = authHeaders();
 
       // Fetch departments
       const deptRes = await fetch('http://localhost:5000/api/departments', { headers });
       const deptJson = await deptRes.json();
       setDepartments(deptJson || []);
 
-      // Fetch users
-      const userRes = await fetch('http://localhost:5000/api/users', { headers });
-      const userJson = await userRes.json();
-      setUsers(userJson || []);
+      // Fetch the first page of users; the rest load from the list
+      const firstPage = await fetchUsersPage(null);
+      setUsers(firstPage.users);
+      setUsersCursor(firstPage.nextCursor);
+
+      // Fetch users count
+      const userStatsRes = await fetch('http://localhost:5000/api/users/stats', { headers });
+      const userStatsJson = await userStatsRes.json();
 
       // Fetch subjects count
       const subjectRes = await fetch('http://localhost:5000/api/subjects', { headers });
@@ -66,7 +85,7 @@ const MainAdminDashboard = () => {
       const timetableJson = await timetableRes.json();
 
       setStats({
-        totalUsers: userJson?.length || 0,
+        totalUsers: userStatsJson?.total || 0,
         totalDepartments: deptJson?.length || 0,
         totalSubjects: subjectJson?.length || 0,
         totalTimetables: timetableJson?.total || 0,
@@ -83,6 +102,25 @@ const MainAdminDashboard = () => {
     }
   };
 
+  const loadMoreUsers = async () => {
+    if (!usersCursor) return;
+    setLoadingMoreUsers(true);
+    try {
+      const page = await fetchUsersPage(usersCursor);
+      setUsers((current) => [...current, ...page.users]);
+      setUsersCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error fetching users:', error);
+      toast({
+        title: 'Error',
+        description: 'Failed to load more users',
+        variant: 'destructive'
+      });
+    } finally {
+      setLoadingMoreUsers(false);
+    }
+  };
+
   const handleLogout = () => {
     logout();
     toast({ 
@@ -211,6 +249,17 @@ const MainAdminDashboard = () => {
                     </Badge>
                   </div>
                 ))}
+                {usersCursor && (
+                  <Button
+                    onClick={loadMoreUsers}
+                    disabled={loadingMoreUsers}
+                    variant="outline"
+                    size="sm"
+                    className="w-full"
+                  >
+                    {loadingMoreUsers ? 'Loading...' : 'Load more'}
+                  </Button>
+                )}
               </div>
             </CardContent>
           </Card>